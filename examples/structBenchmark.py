@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Compare the speed and memory use of Struct and a struct class made by StructType
+
+./structBenchmark.py [numIter]
+
+Times construction, attribute access, and pickling and unpickling (with the highest pickle protocol)
+of a struct with four fields, and reports the pickled size and memory used per instance.
+"""
+import cPickle
+import sys
+import timeit
+
+import lsst.pipe.base as pipeBase
+
+FieldNames = ("exposure", "sources", "background", "metadata")
+
+## Struct class to compare with Struct; at module level so that its instances pickle by reference
+BenchStruct = pipeBase.StructType("BenchStruct", FieldNames)
+
+def makeStruct(cls):
+    """Return an instance of cls (Struct or BenchStruct) with small values for each field"""
+    return cls(exposure=1, sources=2.5, background="bg", metadata=None)
+
+def getMemory(struct):
+    """Return the memory used by struct (bytes), including its __dict__ if it has one"""
+    size = sys.getsizeof(struct)
+    if hasattr(struct, "__dict__"):
+        size += sys.getsizeof(struct.__dict__)
+    return size
+
+def timeOne(func, numIter):
+    """Return the best time per call of func (microseconds) of three runs of numIter calls"""
+    return min(timeit.repeat(func, number=numIter, repeat=3)) * 1e6 / numIter
+
+def run(numIter):
+    """Time Struct and BenchStruct, and print a table of the results"""
+    protocol = cPickle.HIGHEST_PROTOCOL
+    print "%-30s %12s %12s" % ("(per instance)", "Struct", "StructType")
+    resultList = []
+    for cls in (pipeBase.Struct, BenchStruct):
+        struct = makeStruct(cls)
+        pickled = cPickle.dumps(struct, protocol)
+        resultList.append((
+            timeOne(lambda: makeStruct(cls), numIter),
+            timeOne(lambda: struct.sources, numIter),
+            timeOne(lambda: cPickle.dumps(struct, protocol), numIter),
+            timeOne(lambda: cPickle.loads(pickled), numIter),
+            len(pickled),
+            getMemory(struct),
+        ))
+    for i, (label, fmt) in enumerate((
+        ("construct (us)", "%12.3f"),
+        ("get attribute (us)", "%12.3f"),
+        ("pickle (us)", "%12.3f"),
+        ("unpickle (us)", "%12.3f"),
+        ("pickled size (bytes)", "%12d"),
+        ("memory (bytes)", "%12d"),
+    )):
+        print ("%-30s " + fmt + " " + fmt) % (label, resultList[0][i], resultList[1][i])
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -1,5 +1,20 @@
 from __future__ import absolute_import
 from .argumentParser import *
+from .configFingerprint import *
+from .dataIdSet import *
+from .dataIdTable import *
+from .spanTracer import *
+from .dataRefCache import *
+from .executor import *
+from .existenceIndex import *
+from .memoryTracer import *
+from .metadataWriter import *
+from .profiler import *
+from .resourceUsage import *
+from .runJournal import *
+from .runSummary import *
+from .sharedResults import *
+from .targetPool import *
 from .struct import *
 from .task import *
 from .cmdLineTask import *
@@ -23,18 +23,21 @@ from __future__ import absolute_import, division
 import argparse
 import collections
 import fnmatch
-import itertools
+import functools
 import os
 import re
 import shlex
 import sys
 import shutil
 import textwrap
+import time
 
 import lsst.utils
-import lsst.pex.config as pexConfig
 import lsst.pex.logging as pexLog
-import lsst.daf.persistence as dafPersist
+from .existenceIndex import ExistenceIndex
+from .dataRefCache import DataRefCache
+from .dataIdSet import DataIdSet, DataIdSpec
+from .dataIdTable import DataIdTable
 
 __all__ = ["ArgumentParser", "ConfigFileAction", "ConfigValueAction", "DataIdContainer", "DatasetArgument"]
 
@@ -59,6 +62,37 @@ def _fixPath(defName, path):
         return os.path.abspath(path)
     return os.path.abspath(os.path.join(defRoot, path or ""))
 
+class _LazyNamespace(argparse.Namespace):
+    """!An argparse.Namespace some of whose attributes are computed when first accessed
+
+    Attributes registered with setLazy are computed by calling a function with no arguments
+    the first time they are read, and are then stored as ordinary attributes.
+    Pickling computes any attributes not yet computed.
+    """
+    def setLazy(self, name, func):
+        """!Compute attribute name by calling func() when it is first accessed"""
+        self.__dict__.pop(name, None)
+        self.__dict__.setdefault("_lazyFuncDict", {})[name] = func
+
+    def __getattr__(self, name):
+        lazyFuncDict = self.__dict__.get("_lazyFuncDict", {})
+        if name not in lazyFuncDict:
+            raise AttributeError("%r object has no attribute %r" % (type(self).__name__, name))
+        value = lazyFuncDict.pop(name)()
+        setattr(self, name, value)
+        return value
+
+    def _get_kwargs(self):
+        return [(name, value) for name, value in argparse.Namespace._get_kwargs(self) if name != "_lazyFuncDict"]
+
+    def __getstate__(self):
+        for name in list(self.__dict__.get("_lazyFuncDict", {})):
+            getattr(self, name)
+        return dict((name, value) for name, value in self.__dict__.iteritems() if name != "_lazyFuncDict")
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
 
 class DataIdContainer(object):
     """!A container for data IDs and associated data references
@@ -72,15 +106,82 @@ class DataIdContainer(object):
         """!Construct a DataIdContainer"""
         self.datasetType = None # the actual dataset type, as specified on the command line (if dynamic)
         self.level = level
-        self.idList = []
+        self.dataIds = DataIdSet()
         self.refList = []
 
+    @property
+    def refList(self):
+        """!List of data references
+
+        If computing the data references has been deferred (see deferMakeDataRefList),
+        they are computed when this list is first accessed.
+        """
+        if self._makeRefList is not None:
+            makeRefList, self._makeRefList = self._makeRefList, None
+            makeRefList()
+        return self._refList
+
+    @refList.setter
+    def refList(self, refList):
+        self._makeRefList = None
+        self._refList = refList
+
+    def deferMakeDataRefList(self, makeRefList):
+        """!Defer computing refList until it is first accessed
+
+        @param[in] makeRefList  function to call, with no arguments, to compute refList
+            (e.g. functools.partial(self.makeDataRefList, namespace))
+        """
+        self._makeRefList = makeRefList
+
+    def __getstate__(self):
+        self.refList # compute deferred data references
+        return self.__dict__.copy()
+
+    @property
+    def idList(self):
+        """!List of data ID dicts
+
+        The data IDs are held in compact form in dataIds (a \ref dataIdSet.DataIdSet "DataIdSet",
+        or a \ref dataIdTable.DataIdTable "DataIdTable" if one has been assigned to dataIds)
+        until this list is first accessed; from then on the list holds the data IDs and may be modified.
+        """
+        if not isinstance(self.dataIds, list):
+            self.dataIds = list(self.dataIds)
+        return self.dataIds
+
+    @idList.setter
+    def idList(self, idList):
+        self.dataIds = list(idList)
+
+    def addDataIds(self, dataIds):
+        """!Add data IDs, e.g. from a data ID argument
+
+        @param[in] dataIds      a \ref dataIdSet.DataIdSpec "DataIdSpec" or \ref dataIdSet.DataIdSet
+            "DataIdSet"; data IDs already present are ignored unless dataIds is not a DataIdSet
+            (e.g. because idList has been accessed)
+        """
+        if isinstance(self.dataIds, DataIdSet):
+            self.dataIds.add(dataIds)
+        else:
+            self.idList += list(dataIds)
+
+    def getIdSpec(self):
+        """!Return a hashable description of the data IDs, e.g. for use as a cache key"""
+        if isinstance(self.dataIds, list):
+            return tuple(_dataIdKey(dataId) for dataId in self.dataIds)
+        return self.dataIds.getSpec()
+
     def setDatasetType(self, datasetType):
         """!Set actual dataset type, once it is known"""
         self.datasetType = datasetType
 
     def castDataIds(self, butler):
-        """!Validate data IDs and cast them to the correct type (modify idList in place).
+        """!Validate data IDs and cast them to the correct type (modify dataIds in place).
+
+        If the data IDs are still in compact form, the data IDs are not computed: for a DataIdSet
+        each distinct value of each key is cast once, and for a DataIdTable the values of each key
+        are cast together (see \ref dataIdTable.DataIdTable.cast "DataIdTable.cast").
 
         @param[in] butler       data butler (a \ref lsst.daf.persistence.butler.Butler
             "lsst.daf.persistence.Butler")
@@ -92,40 +193,184 @@ class DataIdContainer(object):
         except KeyError:
             raise KeyError("Cannot get keys for datasetType %s at level %s" % (self.datasetType, self.level))
 
-        for dataDict in self.idList:
-            for key, strVal in dataDict.iteritems():
+        def getKeyType(key):
+            try:
+                return idKeyTypeDict[key]
+            except KeyError:
+                validKeys = sorted(idKeyTypeDict.keys())
+                raise KeyError("Unrecognized ID key %r; valid keys are: %s" % (key, validKeys))
+
+        def castValue(key, strVal):
+            keyType = getKeyType(key)
+            if keyType != str:
                 try:
-                    keyType = idKeyTypeDict[key]
-                except KeyError:
-                    validKeys = sorted(idKeyTypeDict.keys())
-                    raise KeyError("Unrecognized ID key %r; valid keys are: %s" % (key, validKeys))
-                if keyType != str:
-                    try:
-                        castVal = keyType(strVal)
-                    except Exception:
-                        raise TypeError("Cannot cast value %r to %s for ID key %r" % (strVal, keyType, key,))
-                    dataDict[key] = castVal
+                    return keyType(strVal)
+                except Exception:
+                    raise TypeError("Cannot cast value %r to %s for ID key %r" % (strVal, keyType, key,))
+            return strVal
+
+        if isinstance(self.dataIds, DataIdTable):
+            self.dataIds = self.dataIds.cast(dict((key, getKeyType(key)) for key in self.dataIds.keys()))
+            return
+        if not isinstance(self.dataIds, list):
+            self.dataIds = self.dataIds.mapValues(castValue)
+            return
+        for dataDict in self.dataIds:
+            for key, strVal in dataDict.iteritems():
+                dataDict[key] = castValue(key, strVal)
 
     def makeDataRefList(self, namespace):
-        """!Compute refList based on idList
+        """!Compute refList based on dataIds
 
         Not called if add_id_argument called with doMakeDataRef=False
 
+        Data references are looked up one data ID at a time with butler.subset, in the calling thread,
+        as the data IDs are computed from dataIds.
+        Checking that the data exists, which is usually the slow part, is done by a pool
+        of namespace.discoveryThreads threads (if present and greater than 1), concurrently
+        with looking up the next data IDs. Should an existence check fail in a pool thread
+        (e.g. because the butler is not thread-safe for that dataset type) it is repeated serially.
+        Duplicate data IDs and data references are ignored.
+
+        If namespace.existenceIndex is present and not None, it is used to check which data exists
+        (see dataExists).
+
         @param[in] namespace    results of parsing command-line (with 'butler' and 'log' elements)
         """
         if self.datasetType is None:
             raise RuntimeError("Must call setDatasetType first")
         butler = namespace.butler
-        for dataId in self.idList:
-            refList = list(butler.subset(datasetType=self.datasetType, level=self.level, dataId=dataId))
-            # exclude nonexistent data
-            # this is a recursive test, e.g. for the sake of "raw" data
-            refList = [dr for dr in refList if dataExists(butler=butler, datasetType=self.datasetType,
-                                                                  dataRef=dr)]
+        existenceIndex = getattr(namespace, "existenceIndex", None)
+        numThreads = getattr(namespace, "discoveryThreads", None) or 1
+        startTime = time.time()
+        numRefs = len(self.refList)
+        seenRefIds = set(_dataIdKey(dr.dataId) for dr in self.refList)
+
+        def addRefs(dataId, refList):
             if not refList:
                 namespace.log.warn("No data found for dataId=%s" % (dataId,))
-                continue
-            self.refList += refList
+                return
+            for dr in refList:
+                refId = _dataIdKey(dr.dataId)
+                if refId not in seenRefIds:
+                    seenRefIds.add(refId)
+                    self.refList.append(dr)
+
+        def iterSubsets():
+            for dataId in self._iterUniqueDataIds():
+                yield dataId, list(butler.subset(datasetType=self.datasetType, level=self.level, dataId=dataId))
+
+        if numThreads <= 1:
+            for dataId, refList in iterSubsets():
+                # exclude nonexistent data
+                # this is a recursive test, e.g. for the sake of "raw" data
+                addRefs(dataId, _filterExistingRefs(butler, self.datasetType, refList, existenceIndex))
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(numThreads)
+            try:
+                pending = collections.deque() # (dataId, list of AsyncResult), in order of data ID
+
+                def addNextRefs():
+                    addRefs(*_getExistingRefs(butler, self.datasetType, existenceIndex, *pending.popleft()))
+
+                for dataId, refList in iterSubsets():
+                    batchList = []
+                    for refBatch in _makeBatches(refList, _DISCOVERY_BATCH_SIZE):
+                        asyncResult = pool.apply_async(_filterExistingRefs, (butler, self.datasetType, refBatch,
+                                                                             existenceIndex, True))
+                        batchList.append((refBatch, asyncResult))
+                    pending.append((dataId, batchList))
+                    # stream completed results into refList, in order, and bound the number pending
+                    while pending and (len(pending) > 4*numThreads or
+                                       all(res.ready() for refBatch, res in pending[0][1])):
+                        addNextRefs()
+                while pending:
+                    addNextRefs()
+            finally:
+                pool.close()
+                pool.join()
+        namespace.log.info("Found %d %s data references in %.2f sec" %
+                           (len(self.refList) - numRefs, self.datasetType, time.time() - startTime))
+
+    def makeDataRefListFromIds(self, namespace, refDataIdList):
+        """!Compute refList based on dataIds, given the data IDs of the data references known to exist
+
+        This is used instead of makeDataRefList when the data IDs of the data references have been cached
+        by a \ref dataRefCache.DataRefCache "DataRefCache": the data references are looked up as usual
+        but not checked for existence.
+
+        @param[in] namespace        results of parsing command-line (with 'butler' and 'log' elements)
+        @param[in] refDataIdList    data IDs of all data references that exist
+        """
+        if self.datasetType is None:
+            raise RuntimeError("Must call setDatasetType first")
+        butler = namespace.butler
+        refIdSet = set(_dataIdKey(dataId) for dataId in refDataIdList)
+        for dataId in self._iterUniqueDataIds():
+            for dr in butler.subset(datasetType=self.datasetType, level=self.level, dataId=dataId):
+                refId = _dataIdKey(dr.dataId)
+                if refId in refIdSet:
+                    refIdSet.remove(refId)
+                    self.refList.append(dr)
+
+    def _iterUniqueDataIds(self):
+        """Iterate over the data IDs in dataIds, skipping duplicates"""
+        if isinstance(self.dataIds, DataIdSet):
+            # a DataIdSet has no duplicates
+            for dataId in self.dataIds:
+                yield dataId
+            return
+        seenIds = set()
+        for dataId in self.dataIds:
+            dataIdKey = _dataIdKey(dataId)
+            if dataIdKey not in seenIds:
+                seenIds.add(dataIdKey)
+                yield dataId
+
+## Maximum number of data references whose existence is checked in one job by DataIdContainer.makeDataRefList
+_DISCOVERY_BATCH_SIZE = 16
+
+def _dataIdKey(dataId):
+    """Return a hashable version of a data ID dict, for detecting duplicates"""
+    return tuple(sorted(dataId.iteritems()))
+
+def _makeBatches(itemList, batchSize):
+    """Split a list into a list of sublists of at most batchSize items"""
+    return [itemList[i:i + batchSize] for i in range(0, len(itemList), batchSize)]
+
+def _filterExistingRefs(butler, datasetType, refList, existenceIndex=None, catchErrors=False):
+    """Return the data references in refList for which data exists (see dataExists)
+
+    If catchErrors then return None instead of raising an exception.
+    """
+    try:
+        return [dr for dr in refList if dataExists(butler=butler, datasetType=datasetType, dataRef=dr,
+                                                   existenceIndex=existenceIndex)]
+    except Exception:
+        if not catchErrors:
+            raise
+        return None
+
+def _getExistingRefs(butler, datasetType, existenceIndex, dataId, batchList):
+    """Wait for _filterExistingRefs jobs run by a thread pool and combine their results
+
+    @param[in] butler       data butler
+    @param[in] datasetType  dataset type
+    @param[in] existenceIndex   ExistenceIndex, or None
+    @param[in] dataId       data ID from which the data references were made
+    @param[in] batchList    list of (list of data references, AsyncResult of _filterExistingRefs on that list);
+        any batch that failed in the thread pool is checked again in this thread
+
+    @return dataId, list of existing data references
+    """
+    refList = []
+    for refBatch, asyncResult in batchList:
+        existingRefList = asyncResult.get()
+        if existingRefList is None:
+            existingRefList = _filterExistingRefs(butler, datasetType, refBatch, existenceIndex)
+        refList += existingRefList
+    return dataId, refList
 
 
 class DataIdArgument(object):
@@ -214,6 +459,7 @@ class ArgumentParser(argparse.ArgumentParser):
         """
         self._name = name
         self._dataIdArgDict = {} # Dict of data identifier specifications, by argument name
+        self._mapperClassDict = {} # Dict of mapper class, by real path of repository; reset by parse_args
         argparse.ArgumentParser.__init__(self,
             usage = usage,
             fromfile_prefix_chars = '@',
@@ -250,12 +496,88 @@ class ArgumentParser(argparse.ArgumentParser):
         self.add_argument("--doraise", action="store_true",
             help="raise an exception on error (else log a message and continue)?")
         self.add_argument("--profile", help="Dump cProfile statistics to filename")
+        self.add_argument("--profile-mode", dest="profileMode", default="parent",
+            choices=("parent", "worker", "sample"),
+            help="what --profile measures: parent: cProfile of the parent process (which, with -j > 1, "
+                "only distributes targets); worker: cProfile of the targets in each process, written to "
+                "<filename>.<pid> and merged into <filename>; sample: like worker, but a low-overhead "
+                "sampling profiler writing collapsed stacks for flame graphs")
+        self.add_argument("--profile-interval", dest="profileInterval", type=float, default=0.005,
+            metavar="SEC", help="CPU time between samples for --profile-mode=sample")
         self.add_argument("--logdest", help="logging destination")
         self.add_argument("--show", nargs="+", default=(),
             help="display the specified information to stdout and quit (unless run is specified).")
         self.add_argument("-j", "--processes", type=int, default=1, help="Number of processes to use")
         self.add_argument("-t", "--timeout", type=float,
                           help="Timeout for multiprocessing; maximum wall time (sec)")
+        self.add_argument("--target-timeout", type=float, dest="targetTimeout", metavar="SEC",
+                          help=("maximum wall time (sec) for each target; a target that takes longer is "
+                                "recorded as failed and the worker process running it is killed and replaced, "
+                                "while the other targets continue (runs targets in worker processes, "
+                                "one at a time, even with -j 1)"))
+        self.add_argument("--speculate", type=float, default=0.0, metavar="FRACTION",
+                          help=("once all targets have been dispatched, re-run in an idle worker process any "
+                                "target that has been running longer than all but this fraction of completed "
+                                "targets took, and use whichever copy finishes first (the other copy is left "
+                                "to finish and its result ignored); only for tasks that may safely write the "
+                                "same outputs twice"))
+        self.add_argument("--executor", choices=("local", "socket"), default="local",
+                          help=("how to run targets: local: in this process, or in -j worker processes; "
+                                "socket: send them to workers on any host that connect to the --listen address, "
+                                "each started with python -m lsst.pipe.base.executor HOST:PORT and sharing "
+                                "the secret key in environment variable PIPE_BASE_AUTHKEY"))
+        self.add_argument("--listen", default="localhost:0", metavar="HOST:PORT",
+                          help="address on which to listen for workers with --executor=socket "
+                               "(port 0 picks a free port, which is logged)")
+        self.add_argument("--chunksize", type=int, default=1,
+                          help="Number of targets sent to a worker process at a time when multiprocessing")
+        self.add_argument("--max-in-flight", type=int, dest="maxInFlight",
+                          help=("Maximum number of targets dispatched to worker processes but not yet completed "
+                                "when multiprocessing (default: no limit)"))
+        self.add_argument("--discovery-threads", type=int, default=1, dest="discoveryThreads",
+                          help="Number of threads used to check which data exists for the data ID arguments")
+        self.add_argument("--existence-index", action="store_true", dest="useExistenceIndex", default=False,
+                          help=("check which data exists by listing each repository directory once, "
+                                "instead of checking for each file separately"))
+        self.add_argument("--metadata-writer", dest="metadataWriter", default="butler",
+                          choices=("butler", "async", "sqlite"),
+                          help="how to persist task metadata: butler: put each target's metadata with the "
+                               "butler; async: put it with the butler in batches; sqlite: write "
+                               "the metadata of all targets to one SQLite database in the output repository")
+        self.add_argument("--skip-existing", action="store_true", dest="skipExisting", default=False,
+                          help="before running the task, check which targets already have all the output "
+                               "datasets the task declares (in batches, using --discovery-threads threads), "
+                               "and skip them")
+        self.add_argument("--resume", action="store_true", default=False,
+                          help="record each completed target in the journal <task name>_runJournal.txt in the "
+                               "output repository, and skip targets that an earlier run with --resume and the "
+                               "same config completed successfully, if their outputs still exist")
+        self.add_argument("--run-summary", dest="runSummary", action="store_true", default=False,
+                          help="write one row per target, holding its data ID, resource usage and flattened "
+                               "task metadata, to the SQLite database <task name>_runSummary.sqlite3 in the "
+                               "output repository; summarize it with python -m lsst.pipe.base.runSummary")
+        self.add_argument("--trace-memory", dest="traceMemory", nargs="?", type=int, const=5,
+                          metavar="NUMSITES",
+                          help="add the net and peak memory allocated by each timed task method and block, "
+                               "and (with tracemalloc) the NUMSITES (default 5) top allocation sites, "
+                               "to task metadata")
+        self.add_argument("--trace", metavar="FILENAME",
+                          help="record the execution of tasks in all processes, and write it to this file "
+                               "in Chrome trace event format (JSON)")
+        self.add_argument("--dataref-cache", action="store_true", dest="useDataRefCache", default=False,
+                          help=("save the data references found for the data ID arguments in the output "
+                                "repo, and reuse them in later runs with the same arguments if the repos "
+                                "are unchanged"))
+        self.add_argument("--clobber-dataref-cache", action="store_true", dest="clobberDataRefCache",
+                          default=False,
+                          help="ignore and replace cached data references (implies --dataref-cache)")
+        self.add_argument("--schedule", choices=("ordered", "longest-first"), default="ordered",
+                          help=("order in which to process data references when multiprocessing: as specified, "
+                                "or longest-first based on the CPU time recorded by earlier runs "
+                                "(in the run summary, if any, else in task metadata)"))
+        self.add_argument("--reuse-task", action="store_true", dest="reuseTask", default=False,
+                          help=("construct the task once per process and reuse it for each data reference, "
+                                "instead of constructing a new task (and, with -j, a new process) each time"))
         self.add_argument("--clobber-output", action="store_true", dest="clobberOutput", default=False,
                           help=("remove and re-create the output directory if it already exists "
                                 "(safe with -j, but not all other forms of parallel execution)"))
@@ -283,7 +605,9 @@ class ArgumentParser(argparse.ArgumentParser):
 
         The associated data is put into namespace.<dataIdArgument.name> as an instance of ContainerClass;
         the container includes fields:
-        - idList: a list of data ID dicts
+        - dataIds: the data IDs, in compact form (a \ref dataIdSet.DataIdSet "DataIdSet";
+          a container may replace this with a \ref dataIdTable.DataIdTable "DataIdTable")
+        - idList: a list of data ID dicts (computed from dataIds when first accessed)
         - refList: a list of butler data references (empty if doMakeDataRefList false)
         """
         argName = name.lstrip("-")
@@ -329,14 +653,19 @@ class ArgumentParser(argparse.ArgumentParser):
         @return namespace: an argparse.Namespace containing many useful fields including:
         - camera: camera name
         - config: the supplied config with all overrides applied, validated and frozen
-        - butler: a butler for the data
+        - butler: a butler for the data (constructed when first accessed, e.g. to cast data IDs)
         - an entry for each of the data ID arguments registered by add_id_argument(),
           the value of which is a DataIdArgument that includes public elements 'idList' and 'refList'
+          (refList is computed when first accessed)
         - log: a pex_logging log
         - an entry for each command-line argument, with the following exceptions:
           - config is the supplied config, suitably updated
           - configfile, id and loglevel are all missing
         - obsPkg: name of obs_ package for this camera
+        - existenceIndex: the \ref existenceIndex.ExistenceIndex "ExistenceIndex" used to check
+          which data exists if --existence-index is specified, else None
+        - dataRefCache: the \ref dataRefCache.DataRefCache "DataRefCache" used to save and restore
+          data references if --dataref-cache or --clobber-dataref-cache is specified, else None
         """
         if args == None:
             args = sys.argv[1:]
@@ -348,16 +677,18 @@ class ArgumentParser(argparse.ArgumentParser):
             else:
                 self.exit("%s: error: Must specify input as first argument" % self.prog)
 
+        self._mapperClassDict = {}
+
         # Note that --rerun may change namespace.input, but if it does we verify that the
         # new input has the same mapper class.
-        namespace = argparse.Namespace()
+        namespace = _LazyNamespace()
         namespace.input = _fixPath(DEFAULT_INPUT_NAME, args[0])
         if not os.path.isdir(namespace.input):
             self.error("Error: input=%r not found" % (namespace.input,))
 
         namespace.config = config
         namespace.log = log if log is not None else pexLog.Log.getDefaultLog()
-        mapperClass = dafPersist.Butler.getMapperClass(namespace.input)
+        mapperClass = self._getMapperClass(namespace.input)
         namespace.camera = mapperClass.getCameraName()
         namespace.obsPkg = mapperClass.getPackageName()
 
@@ -390,16 +721,40 @@ class ArgumentParser(argparse.ArgumentParser):
         namespace.log.info("output=%s" % (namespace.output,))
 
         obeyShowArgument(namespace.show, namespace.config, exit=False)
+        if namespace.show and "run" not in namespace.show and "data" not in namespace.show:
+            # nothing more to show; exit before constructing a butler
+            sys.exit(0)
 
-        namespace.butler = dafPersist.Butler(
+        # constructing a butler takes a long time, so only do it if needed
+        import lsst.daf.persistence as dafPersist
+        namespace.setLazy("butler", functools.partial(dafPersist.Butler,
             root = namespace.input,
             calibRoot = namespace.calib,
             outputRoot = namespace.output,
-        )
+        ))
+
+        if namespace.useExistenceIndex:
+            namespace.setLazy("existenceIndex", lambda: ExistenceIndex(
+                butler = namespace.butler,
+                rootList = [namespace.output, namespace.input, namespace.calib],
+            ))
+        else:
+            namespace.existenceIndex = None
+        del namespace.useExistenceIndex
+
+        if namespace.useDataRefCache or namespace.clobberDataRefCache:
+            namespace.dataRefCache = DataRefCache(
+                cacheDir = os.path.join(namespace.output or namespace.input, "_dataRefCache"),
+                rootList = [namespace.output, namespace.input, namespace.calib],
+                refresh = namespace.clobberDataRefCache,
+            )
+        else:
+            namespace.dataRefCache = None
+        del namespace.useDataRefCache
+        del namespace.clobberDataRefCache
 
         # convert data in each of the identifier lists to proper types
-        # this is done after constructing the butler, hence after parsing the command line,
-        # because it takes a long time to construct a butler
+        # this is done after parsing the command line, because it needs the butler
         self._processDataIds(namespace)
         if "data" in namespace.show:
             for dataIdName in self._dataIdArgDict.iterkeys():
@@ -433,7 +788,7 @@ class ArgumentParser(argparse.ArgumentParser):
         This allows for hacking the directories, e.g., to include a "rerun".
         Modifications are made to the 'namespace' object in-place.
         """
-        mapperClass = dafPersist.Butler.getMapperClass(_fixPath(DEFAULT_INPUT_NAME,namespace.rawInput))
+        mapperClass = self._getMapperClass(_fixPath(DEFAULT_INPUT_NAME,namespace.rawInput))
         namespace.calib = _fixPath(DEFAULT_CALIB_NAME,  namespace.rawCalib)
 
         guessedRerun = False            # did we guess the rerun name?
@@ -473,7 +828,7 @@ class ArgumentParser(argparse.ArgumentParser):
                     namespace.output = namespace.rerun[0]
             else:
                 self.error("Error: invalid argument for --rerun: %s" % namespace.rerun)
-            if modifiedInput and dafPersist.Butler.getMapperClass(namespace.input) != mapperClass:
+            if modifiedInput and self._getMapperClass(namespace.input) != mapperClass:
                 self.error("Error: input directory specified by --rerun must have the same mapper as INPUT")
         else:
             namespace.rerun = None
@@ -482,13 +837,21 @@ class ArgumentParser(argparse.ArgumentParser):
         del namespace.rawOutput
         del namespace.rawRerun
 
+    def _getMapperClass(self, root):
+        """Return the mapper class of a repository, calling Butler.getMapperClass once per repository"""
+        realRoot = os.path.realpath(root)
+        if realRoot not in self._mapperClassDict:
+            import lsst.daf.persistence as dafPersist
+            self._mapperClassDict[realRoot] = dafPersist.Butler.getMapperClass(root)
+        return self._mapperClassDict[realRoot]
+
     def _processDataIds(self, namespace):
         """!Process the parsed data for each data ID argument
 
         Processing includes:
         - Validate data ID keys
         - Cast the data ID values to the correct type
-        - Compute data references from data IDs
+        - Arrange for data references to be computed from data IDs when refList is first accessed
 
         @param[in,out] namespace    parsed namespace (an argparse.Namespace);
             reads these attributes:
@@ -496,20 +859,61 @@ class ArgumentParser(argparse.ArgumentParser):
             - log
             - \<name_dstype> for each data ID argument with a dynamic dataset type registered using
                 add_id_argument
+            - dataRefCache (optional): a \ref dataRefCache.DataRefCache "DataRefCache", or None;
+                only used for data ID arguments whose container is a DataIdContainer
+                that does not override castDataIds or makeDataRefList
             and modifies these attributes:
             - \<name> for each data ID argument registered using add_id_argument
         """
+        dataRefCache = getattr(namespace, "dataRefCache", None)
         for dataIdArgument in self._dataIdArgDict.itervalues():
             dataIdContainer = getattr(namespace, dataIdArgument.name)
-            dataIdContainer.setDatasetType(dataIdArgument.getDatasetType(namespace))
-            try:
-                dataIdContainer.castDataIds(butler = namespace.butler)
-            except (KeyError, TypeError) as e:
-                # failure of castDataIds indicates invalid command args
-                self.error(e)
-            # failure of makeDataRefList indicates a bug that wants a traceback
+            datasetType = dataIdArgument.getDatasetType(namespace)
+            dataIdContainer.setDatasetType(datasetType)
+            cacheKey = None
+            refDataIdList = None
+            if dataRefCache is not None and dataIdArgument.doMakeDataRefList and \
+                    _isDefaultDataIdContainer(dataIdArgument.ContainerClass):
+                cacheKey = dataRefCache.getKey(datasetType, dataIdArgument.level, dataIdContainer.getIdSpec())
+                cached = dataRefCache.get(cacheKey)
+                if cached is not None:
+                    dataIdContainer.dataIds, refDataIdList = cached
+            if refDataIdList is None:
+                try:
+                    dataIdContainer.castDataIds(butler = namespace.butler)
+                except (KeyError, TypeError) as e:
+                    # failure of castDataIds indicates invalid command args
+                    self.error(e)
             if dataIdArgument.doMakeDataRefList:
-                dataIdContainer.makeDataRefList(namespace)
+                dataIdContainer.deferMakeDataRefList(functools.partial(
+                    self._makeDataRefList, namespace, dataIdArgument, cacheKey, refDataIdList))
+
+    def _makeDataRefList(self, namespace, dataIdArgument, cacheKey=None, refDataIdList=None):
+        """Compute the data references for a data ID argument, using and updating namespace.dataRefCache
+
+        @param[in,out] namespace    parsed namespace (an argparse.Namespace)
+        @param[in] dataIdArgument   data ID argument (a DataIdArgument)
+        @param[in] cacheKey         key for namespace.dataRefCache, or None if not using the cache
+        @param[in] refDataIdList    data IDs of the data references from namespace.dataRefCache,
+            or None if not cached
+        """
+        dataIdContainer = getattr(namespace, dataIdArgument.name)
+        if refDataIdList is not None:
+            dataIdContainer.makeDataRefListFromIds(namespace, refDataIdList)
+            namespace.log.info("Using %d cached %s data references for --%s" %
+                               (len(dataIdContainer.refList), dataIdContainer.datasetType, dataIdArgument.name))
+            return
+        # failure of makeDataRefList indicates a bug that wants a traceback
+        dataIdContainer.makeDataRefList(namespace)
+        if namespace.existenceIndex is not None:
+            namespace.log.info("Listed %d directories to check which data exists" %
+                               (namespace.existenceIndex.numListings,))
+        if cacheKey is not None:
+            try:
+                namespace.dataRefCache.put(cacheKey, dataIdContainer.dataIds,
+                                           [dataRef.dataId for dataRef in dataIdContainer.refList])
+            except Exception, e:
+                namespace.log.warn("Could not save data references in cache: %s" % (e,))
 
     def _applyInitialOverrides(self, namespace):
         """!Apply obs-package-specific and camera-specific config override files, if found
@@ -561,6 +965,14 @@ class ArgumentParser(argparse.ArgumentParser):
                 continue
             yield arg
 
+def _isDefaultDataIdContainer(ContainerClass):
+    """Return True if ContainerClass computes data IDs and data references as DataIdContainer does"""
+    for methodName in ("castDataIds", "makeDataRefList"):
+        method = getattr(ContainerClass, methodName, None)
+        if getattr(method, "__func__", method) is not getattr(DataIdContainer, methodName).__func__:
+            return False
+    return True
+
 def getTaskDict(config, taskDict=None, baseName=""):
     """!Get a dictionary of task info for all subtasks in a config
 
@@ -575,6 +987,7 @@ def getTaskDict(config, taskDict=None, baseName=""):
         as a prefix for additional entries in taskDict; otherwise no prefix is used)
     @return taskDict: a dict of config field name: task name
     """
+    import lsst.pex.config as pexConfig
     if taskDict is None:
         taskDict = dict()
     for fieldName, field in config.iteritems():
@@ -730,12 +1143,12 @@ class IdValueAction(argparse.Action):
     """!argparse action callback to process a data ID into a dict
     """
     def __call__(self, parser, namespace, values, option_string):
-        """!Parse --id data and append results to namespace.\<argument>.idList
+        """!Parse --id data and add results to namespace.\<argument>.dataIds
 
         @param[in] parser           argument parser (instance of ArgumentParser)
         @param[in,out] namespace    parsed command (an instance of argparse.Namespace);
             updated values:
-            - \<idName>.idList, where \<idName> is the name of the ID argument,
+            - \<idName>.dataIds, where \<idName> is the name of the ID argument,
                 for instance "id" for ID argument --id
         @param[in] values           a list of data IDs; see data format below
         @param[in] option_string    option value specified by the user (a str)
@@ -749,11 +1162,14 @@ class IdValueAction(argparse.Action):
 
         The cross product is computed for keys with multiple values. For example:
             --id visit 1^2 ccd 1,1^2,2
-        results in the following data ID dicts being appended to namespace.\<argument>.idList:
+        results in the following data ID dicts being added to namespace.\<argument>.dataIds:
             {"visit":1, "ccd":"1,1"}
-            {"visit":2, "ccd":"1,1"}
             {"visit":1, "ccd":"2,2"}
+            {"visit":2, "ccd":"1,1"}
             {"visit":2, "ccd":"2,2"}
+        The cross product is not computed here: the values are stored in a \ref dataIdSet.DataIdSpec
+        "DataIdSpec" and data IDs are computed as they are needed. Data IDs specified by more than one
+        data ID argument are only included once.
         """
         if namespace.config is None:
             return
@@ -769,19 +1185,14 @@ class IdValueAction(argparse.Action):
                     v1 = int(mat.group(1))
                     v2 = int(mat.group(2))
                     v3 = mat.group(3); v3 = int(v3) if v3 else 1
-                    for v in range(v1, v2 + 1, v3):
+                    for v in xrange(v1, v2 + 1, v3):
                         idDict[name].append(str(v))
                 else:
                     idDict[name].append(v)
 
-        keyList = idDict.keys()
-        iterList = [idDict[key] for key in keyList]
-        idDictList = [collections.OrderedDict(zip(keyList, valList))
-            for valList in itertools.product(*iterList)]
-
         argName = option_string.lstrip("-")
         ident = getattr(namespace, argName)
-        ident.idList += idDictList
+        ident.addDataIds(DataIdSpec(idDict))
 
 class LogLevelAction(argparse.Action):
     """!argparse action to set log level
@@ -843,7 +1254,7 @@ def getDottedAttr(item, name):
         subitem = getattr(subitem, subname)
     return subitem
 
-def dataExists(butler, datasetType, dataRef):
+def dataExists(butler, datasetType, dataRef, existenceIndex=None):
     """!Return True if data exists at the current level or any data exists at a deeper level, False otherwise
 
     @param[in] butler       data butler (a \ref lsst.daf.persistence.butler.Butler
@@ -851,12 +1262,18 @@ def dataExists(butler, datasetType, dataRef):
     @param[in] datasetType  dataset type (a str)
     @param[in] dataRef      butler data reference (a \ref lsst.daf.persistence.butlerSubset.ButlerDataRef
         "lsst.daf.persistence.ButlerDataRef")
+    @param[in] existenceIndex   an \ref existenceIndex.ExistenceIndex "ExistenceIndex" used to check
+        the existence of data without a filesystem call per dataset, or None to ask the butler
     """
     subDRList = dataRef.subItems()
     if subDRList:
         for subDR in subDRList:
-            if dataExists(butler, datasetType, subDR):
+            if dataExists(butler, datasetType, subDR, existenceIndex):
                 return True
         return False
     else:
+        if existenceIndex is not None:
+            exists = existenceIndex.datasetExists(datasetType=datasetType, dataId=dataRef.dataId)
+            if exists is not None:
+                return exists
         return butler.datasetExists(datasetType = datasetType, dataId = dataRef.dataId)
@@ -20,47 +20,387 @@ from __future__ import absolute_import, division
 # the GNU General Public License along with this program.  If not, 
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
+import collections
+import os
 import sys
+import time
 import traceback
 import functools
 import contextlib
-
-import lsst.afw.table as afwTable
+import heapq
+import itertools
+import json
 
 from .task import Task, TaskError
 from .struct import Struct
 from .argumentParser import ArgumentParser
-from lsst.pex.logging import getDefaultLog
+from .existenceIndex import ExistenceIndex
+from .spanTracer import SpanTracer, getTracer, setTracer
+from .memoryTracer import MemoryTracer, getMemoryTracer, setMemoryTracer
+from .runSummary import flattenMetadata, RunSummaryWriter, readRunSummaryItem
+from .runJournal import getTargetKey, RunJournal
+from .configFingerprint import computeConfigDigest, computeFileDigest, getDatasetPath, readConfigFingerprint, \
+    writeConfigFingerprint, writeConfigIfAbsent
+from .metadataWriter import ButlerMetadataWriter, SqliteMetadataWriter, AsyncMetadataWriter, \
+    getMetadataWriter, setMetadataWriter
+from .resourceUsage import ResourceFieldNames, getResourceUsage, ResourceSummary
+from .profiler import getProcessProfiler, removeProcessProfiles, finishProcessProfiles
+from .executor import SerialExecutor, PoolExecutor, SocketExecutor, parseAddress, getAuthKey
+from .targetPool import TargetPool
+from .sharedResults import makeSharedResultDir, removeSharedResultDir, exportSharedArrays, importSharedArrays
+
+__all__ = ["CmdLineTask", "TaskRunner", "ButlerInitializedTaskRunner", "TargetCostModel", "MetadataCostModel",
+           "RunSummaryCostModel"]
+
+def _runTarget(runner, indexedArgs):
+    """Run a task runner on one target
+
+    @param[in] runner       the task runner
+    @param[in] indexedArgs  a tuple of (index of target in TaskRunner.getTargetList, target)
+
+    @return a tuple of:
+    - the value returned by TaskRunner.\_\_call\_\_; if runner._sharedResultDir is set, large arrays in it
+      are replaced by handles to memory-mapped files (see \ref sharedResults.exportSharedArrays
+      "exportSharedArrays")
+    - a Struct of statistics for this target, containing:
+      - index: the index of the target
+      - wallTime: wall time (sec) spent in TaskRunner.\_\_call\_\_
+      - taskSetupTime: the time (sec) spent making or resetting the task for this target,
+        or None if TaskRunner.\_\_call\_\_ does not obtain its task with TaskRunner.getTask
+      - traceEvents: list of trace events recorded while running the target if runner.traceFile
+        is set (see --trace), else None
+      - resources: resources used by this process to run the target, as returned by
+        \ref resourceUsage.getResourceUsage "getResourceUsage" (wallTime, cpuTime, maxResidentSetSize, ...)
+      - dataId: a str describing the data ID of the target, or None if unknown
+      - failed: True if TaskRunner.\_\_call\_\_ called TaskRunner.markFailed (e.g. because it caught
+        an exception raised by the task), or returned a result with a true "failed" attribute
+      - targetKey: if runner.resume (see --resume), the key of the target in the
+        \ref runJournal.RunJournal "RunJournal" (see \ref runJournal.getTargetKey "getTargetKey"), else None
+      - summaryRow: if runner.runSummaryName is set (see --run-summary), a tuple of (data ID of the target
+        (a dict, or the str dataId if the target has no single data ID), dict of column name: value
+        for the \ref runSummary.RunSummaryWriter "run summary"), else None
+    """
+    index, args = indexedArgs
+    runner._taskSetupTime = None
+    runner._summaryRow = None
+    runner._targetFailed = False
+    if runner.metadataWriterName != "butler":
+        metadataWriter = getMetadataWriter()
+        if metadataWriter is None or metadataWriter.pid != os.getpid():
+            _installMetadataWriter(runner.makeMetadataWriter())
+    if runner.traceMemory is not None:
+        memoryTracer = getMemoryTracer()
+        if memoryTracer is None or memoryTracer.pid != os.getpid():
+            setMemoryTracer(MemoryTracer(numTopSites=runner.traceMemory))
+    tracer = None
+    if runner.traceFile:
+        tracer = getTracer()
+        if tracer is None or tracer.pid != os.getpid():
+            # first target in this process
+            tracer = SpanTracer()
+            setTracer(tracer)
+    profiler = None
+    if runner.profileName and runner.profileMode != "parent":
+        profiler = getProcessProfiler(runner.profileName, mode=_ProfilerModeDict[runner.profileMode],
+                                      interval=runner.profileInterval)
+    dataId = _getDataIdStr(args)
+    startUsage = getResourceUsage()
+    if profiler is not None:
+        profiler.start()
+    try:
+        if tracer is None:
+            result = runner(args)
+        else:
+            with tracer.span("target", category="TaskRunner", index=index, dataId=dataId):
+                result = runner(args)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    resources = getResourceUsage(startUsage)
+    failed = runner._targetFailed or bool(getattr(result, "failed", False))
+    if runner.metadataWriterName != "butler" and (runner.resume or runner.targetTimeout or runner.speculate):
+        # the target is about to be journaled as done, or this worker may be killed once the result is sent
+        getMetadataWriter().flush()
+    if runner._sharedResultDir is not None and result is not None:
+        # large arrays are returned through memory-mapped files (see TaskRunner.SHARED_RESULT_MIN_SIZE)
+        result = exportSharedArrays(result, runner._sharedResultDir, runner.SHARED_RESULT_MIN_SIZE)
+    summaryRow = None
+    if runner.runSummaryName:
+        row = collections.OrderedDict()
+        dataIdDict = getattr(args[0], "dataId", None) if isinstance(args, (list, tuple)) and args else None
+        if isinstance(dataIdDict, dict):
+            row.update(dataIdDict)
+        for name in ResourceFieldNames:
+            row["resources." + name] = getattr(resources, name)
+        if runner._summaryRow is not None:
+            row.update(runner._summaryRow)
+        summaryRow = (dict(dataIdDict) if isinstance(dataIdDict, dict) else dataId, row)
+    return result, Struct(
+        index = index,
+        wallTime = resources.wallTime,
+        taskSetupTime = runner._taskSetupTime,
+        traceEvents = tracer.popEvents() if tracer is not None else None,
+        resources = resources,
+        dataId = dataId,
+        failed = failed,
+        targetKey = getTargetKey(args) if runner.resume else None,
+        summaryRow = summaryRow,
+    )
+
+def _makeFailedTarget(runner, indexedArgs, reason, wallTime):
+    """Return the result of a target that did not complete, in the form returned by _runTarget
+
+    Used by TargetPool for a target that timed out or whose worker process died (see --target-timeout).
+
+    @param[in] runner       the task runner
+    @param[in] indexedArgs  a tuple of (index of target in TaskRunner.getTargetList, target)
+    @param[in] reason       description of why the target did not complete
+    @param[in] wallTime     wall time (sec) from dispatching the target until it was abandoned
+    """
+    index, args = indexedArgs
+    result = None
+    if runner.doReturnResults:
+        result = Struct(
+            dataRef = args[0] if isinstance(args, (list, tuple)) and args else args,
+            metadata = None,
+            result = None,
+        )
+    return result, Struct(
+        index = index,
+        wallTime = wallTime,
+        taskSetupTime = None,
+        traceEvents = None,
+        resources = None,
+        dataId = _getDataIdStr(args),
+        failed = True,
+        targetKey = getTargetKey(args) if runner.resume else None,
+        summaryRow = None,
+    )
+
+def _installMetadataWriter(metadataWriter):
+    """Install a metadata writer in this process, and close it (flushing it) when the process exits"""
+    from multiprocessing.util import Finalize
+    metadataWriter.finalizer = Finalize(metadataWriter, metadataWriter.close, exitpriority=10)
+    setMetadataWriter(metadataWriter)
+
+## Description of each reason for skipping targets (see TaskRunner.logSkippedTargets)
+_SkipReasonDict = {
+    "resume": "completed by an earlier run (see --resume)",
+    "skipExisting": "whose outputs already exist (see --skip-existing)",
+}
+
+## ProcessProfiler mode for each value of --profile-mode other than "parent"
+_ProfilerModeDict = dict(worker="cprofile", sample="sample")
+
+def _closeQuietly(obj):
+    """Close obj, ignoring any error (e.g. after an error writing to it), and return None"""
+    try:
+        obj.close()
+    except Exception:
+        pass
+    return None
 
-__all__ = ["CmdLineTask", "TaskRunner", "ButlerInitializedTaskRunner"]
+def _getDataIdStr(args):
+    """Return a string describing the data ID of a target, for tracing, or None if not known"""
+    try:
+        dataRef = args[0]
+        if hasattr(dataRef, "dataId"):
+            return str(dataRef.dataId)
+        return str([ref.dataId for ref in dataRef])
+    except Exception:
+        return None
 
-def _poolFunctionWrapper(function, arg):
-    """Wrapper around function to catch exceptions that don't inherit from Exception
+def _computeMakespan(durationList, numProcesses):
+    """Return the makespan of running jobs on numProcesses workers, each taking the next job when idle
 
-    Such exceptions aren't caught by multiprocessing, which causes the slave
-    process to crash and you end up hitting the timeout.
+    @param[in] durationList     duration of each job, in the order in which they are dispatched
+    @param[in] numProcesses     number of workers
     """
-    try:
-        return function(arg)
-    except Exception:
-        raise # No worries
-    except:
-        # Need to wrap the exception with something multiprocessing will recognise
-        cls, exc, tb = sys.exc_info()
-        log = getDefaultLog()
-        log.warn("Unhandled exception %s (%s):\n%s" % (cls.__name__, exc, traceback.format_exc()))
-        raise Exception("Unhandled exception: %s (%s)" % (cls.__name__, exc))
-
-def _runPool(pool, timeout, function, iterable):
-    """Wrapper around pool.map_async, to handle timeout
-
-    This is required so as to trigger an immediate interrupt on the KeyboardInterrupt (Ctrl-C); see
-    http://stackoverflow.com/questions/1408356/keyboard-interrupts-with-pythons-multiprocessing-pool
-
-    Further wraps the function in _poolFunctionWrapper to catch exceptions
-    that don't inherit from Exception.
+    finishTimeList = [0.0]*max(1, numProcesses)
+    for duration in durationList:
+        heapq.heappush(finishTimeList, heapq.heappop(finishTimeList) + duration)
+    return max(finishTimeList)
+
+class TargetCostModel(object):
+    """!Estimate the relative cost of running a task on each target, for scheduling
+
+    TaskRunner uses a cost model to run the most expensive targets first when --schedule=longest-first
+    is specified, so that a few slow targets do not end up running alone at the end of a run.
+    The default implementation knows nothing and returns None for every target;
+    see RunSummaryCostModel and MetadataCostModel for models based on earlier runs.
+    Override TaskRunner.makeCostModel to use a different model.
+    """
+    def getCost(self, target):
+        """!Return the estimated cost of a target (e.g. in CPU sec), or None if unknown
+
+        @param[in] target   an element of the list returned by TaskRunner.getTargetList
+        """
+        return None
+
+    def getCostList(self, targetList):
+        """!Return the estimated costs of a list of targets, as a list in the same order
+
+        The default implementation calls getCost for each target; override it if the costs of many targets
+        can be found faster together.
+
+        @param[in] targetList   list of targets, as returned by TaskRunner.getTargetList
+        """
+        return [self.getCost(target) for target in targetList]
+
+class RunSummaryCostModel(TargetCostModel):
+    """!Estimate the cost of each target from the CPU time recorded in a run summary (see --run-summary)
+
+    The run summary is read once, with one query, so this is much faster than MetadataCostModel.
+    """
+    def __init__(self, fileName, columnName="resources.cpuTime"):
+        """!Construct a RunSummaryCostModel
+
+        @param[in] fileName     name of the run-summary database written by an earlier run
+        @param[in] columnName   name of the column holding the cost of each target
+        """
+        self.costDict = readRunSummaryItem(fileName, columnName)
+
+    def getCost(self, target):
+        dataRef = target[0] if isinstance(target, tuple) else target
+        dataId = getattr(dataRef, "dataId", None)
+        if not isinstance(dataId, dict):
+            return None
+        return self.costDict.get(json.dumps(dict(dataId), sort_keys=True, default=str))
+
+## Result of MetadataCostModel._readCost in a thread when it raised an exception
+_CostFailed = object()
+
+class MetadataCostModel(TargetCostModel):
+    """!Estimate the cost of each target from the CPU time recorded in its persisted task metadata
+
+    For targets that have been processed before, the cost is \<methodName>EndCpuTime - \<methodName>StartCpuTime
+    as recorded by \ref timer.timeMethod "timeMethod" in the metadata of the top-level task.
+    This reads the metadata of each target, so getCostList reads them concurrently,
+    and only for the first maxTargets targets.
+    """
+    def __init__(self, metadataName, taskName, methodName="run", numThreads=1, maxTargets=None):
+        """!Construct a MetadataCostModel
+
+        @param[in] metadataName name of the metadata dataset type (see CmdLineTask._getMetadataName)
+        @param[in] taskName     full name of the top-level task
+        @param[in] methodName   name of the timed method
+        @param[in] numThreads   number of threads in which getCostList reads metadata
+        @param[in] maxTargets   maximum number of targets whose metadata getCostList reads
+            (the cost of the others is unknown), or None for no limit
+        """
+        self.metadataName = metadataName
+        self.itemPrefix = "%s.%s" % (taskName.replace(".", ":"), methodName)
+        self.numThreads = int(numThreads)
+        self.maxTargets = maxTargets
+
+    def getCost(self, target):
+        try:
+            return self._readCost(target)
+        except Exception:
+            return None
+
+    def getCostList(self, targetList):
+        numToRead = len(targetList) if self.maxTargets is None else min(len(targetList), self.maxTargets)
+        readList = targetList[:numToRead]
+        numThreads = min(self.numThreads, numToRead)
+        if numThreads > 1:
+            from multiprocessing.pool import ThreadPool
+            threadPool = ThreadPool(numThreads)
+            try:
+                costList = threadPool.map(self._readCostInThread, readList)
+            finally:
+                threadPool.close()
+                threadPool.join()
+            # a read that failed in a thread (e.g. because the butler is not thread-safe for that
+            # dataset type) is repeated serially
+            costList = [self.getCost(target) if cost is _CostFailed else cost
+                        for target, cost in itertools.izip(readList, costList)]
+        else:
+            costList = [self.getCost(target) for target in readList]
+        return costList + [None]*(len(targetList) - numToRead)
+
+    def _readCostInThread(self, target):
+        """Return the cost of a target, or _CostFailed if reading it raised an exception"""
+        try:
+            return self._readCost(target)
+        except Exception:
+            return _CostFailed
+
+    def _readCost(self, target):
+        """Return the cost of a target, or None if it has no metadata"""
+        dataRef = target[0] if isinstance(target, tuple) else target
+        if self.metadataName is None or not hasattr(dataRef, "datasetExists"):
+            return None
+        if not dataRef.datasetExists(self.metadataName):
+            return None
+        metadata = dataRef.get(self.metadataName, immediate=True)
+        return metadata.get(self.itemPrefix + "EndCpuTime") - metadata.get(self.itemPrefix + "StartCpuTime")
+
+## The task runner used by a worker process of a pool made with _initPoolWorker
+_poolRunner = None
+
+def _initPoolWorker(runner):
+    """Pool initializer that saves the task runner in the worker process, so it is sent only once"""
+    global _poolRunner
+    _poolRunner = runner
+
+def _runPoolWorkerTarget(indexedArgs):
+    """Run the task runner saved by _initPoolWorker on one target; see _runTarget"""
+    return _runTarget(_poolRunner, indexedArgs)
+
+class _PrefetchedButler(object):
+    """Butler proxy that answers datasetExists and get for datasets read ahead of time, all at once
+
+    Used by TaskRunner.precall so that CmdLineTask.writeConfig and CmdLineTask.writeSchemas, which read
+    one config or schema dataset at a time, do not wait for storage once per dataset.
+    Only calls with no data ID (as used for configs and schemas) are answered from the prefetched datasets;
+    all other calls and attributes are passed to the butler.
     """
-    return pool.map_async(functools.partial(_poolFunctionWrapper, function), iterable).get(timeout)
+    def __init__(self, butler, datasetNameList, numThreads):
+        """Read the named datasets, if they exist, concurrently in up to numThreads threads
+
+        A dataset that cannot be read is not prefetched, so the error is raised when it is used.
+        """
+        self._butler = butler
+        self._prefetchDict = {} # dataset type: (exists, object or None)
+        def fetch(datasetName):
+            try:
+                if not butler.datasetExists(datasetName):
+                    return (False, None)
+                return (True, butler.get(datasetName, immediate=True))
+            except Exception:
+                return None
+        numThreads = min(numThreads, len(datasetNameList))
+        if numThreads > 1:
+            from multiprocessing.pool import ThreadPool
+            threadPool = ThreadPool(numThreads)
+            try:
+                fetchedList = threadPool.map(fetch, datasetNameList)
+            finally:
+                threadPool.close()
+                threadPool.join()
+        else:
+            fetchedList = [fetch(datasetName) for datasetName in datasetNameList]
+        for datasetName, fetched in itertools.izip(datasetNameList, fetchedList):
+            if fetched is not None:
+                self._prefetchDict[datasetName] = fetched
+
+    def datasetExists(self, datasetType, *args, **kwargs):
+        if not args and not kwargs and datasetType in self._prefetchDict:
+            return self._prefetchDict[datasetType][0]
+        return self._butler.datasetExists(datasetType, *args, **kwargs)
+
+    def get(self, datasetType, *args, **kwargs):
+        if not args and set(kwargs) <= set(["immediate"]) and self._prefetchDict.get(datasetType, (False,))[0]:
+            return self._prefetchDict[datasetType][1]
+        return self._butler.get(datasetType, *args, **kwargs)
+
+    def put(self, obj, datasetType, *args, **kwargs):
+        self._prefetchDict.pop(datasetType, None)
+        return self._butler.put(obj, datasetType, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._butler, name)
 
 @contextlib.contextmanager
 def profile(filename, log=None):
@@ -110,6 +450,11 @@ class TaskRunner(object):
     that overrides TaskRunner.getTargetList and possibly TaskRunner.\_\_call\_\_.
     See TaskRunner.getTargetList for details.
 
+    If you override TaskRunner.\_\_call\_\_ and it catches an exception raised by the task (rather than
+    letting it propagate), it must report the failure by calling TaskRunner.markFailed, or by returning
+    a result with a true "failed" attribute (e.g. a Struct with failed=True); otherwise the target is
+    treated as having succeeded, e.g. it is recorded as done in the journal used by --resume.
+
     This design matches the common pattern for command-line tasks: the run method takes a single
     data reference, of some suitable name. Additional arguments are rare, and if present, require
     a subclass of TaskRunner that calls these additional arguments by name.
@@ -127,6 +472,9 @@ class TaskRunner(object):
     [2] http://stackoverflow.com/questions/1408356/keyboard-interrupts-with-pythons-multiprocessing-pool)
     """
     TIMEOUT = 9999 # Default timeout (sec) for multiprocessing
+    SHARED_RESULT_MIN_SIZE = 1 << 20 # Min size (bytes) of arrays returned via memory-mapped files; None for none
+    PRECALL_FETCH_THREADS = 8 # Max number of threads reading existing config and schema datasets in precall
+    MAX_COST_TARGETS = 10000 # Max number of targets whose metadata is read for --schedule=longest-first
     def __init__(self, TaskClass, parsedCmd, doReturnResults=False):
         """!Construct a TaskRunner
 
@@ -153,15 +501,60 @@ class TaskRunner(object):
         self.clobberConfig = bool(parsedCmd.clobberConfig)
         self.doBackup = not bool(parsedCmd.noBackupConfig)
         self.numProcesses = int(getattr(parsedCmd, 'processes', 1))
+        self.reuseTask = bool(getattr(parsedCmd, 'reuseTask', False))
+        self.schedule = getattr(parsedCmd, 'schedule', None) or "ordered"
+        self.traceFile = getattr(parsedCmd, 'trace', None)
+        self.traceMemory = getattr(parsedCmd, 'traceMemory', None)
+        self.metadataWriterName = getattr(parsedCmd, 'metadataWriter', None) or "butler"
+        repoDir = getattr(parsedCmd, 'output', None) or getattr(parsedCmd, 'input', None)
+        repoDir = repoDir or "."
+        self.metadataDbName = os.path.join(repoDir, "%s_metadata.sqlite3" % (TaskClass._DefaultName,))
+        self.runSummaryName = None
+        if getattr(parsedCmd, 'runSummary', False):
+            self.runSummaryName = os.path.join(repoDir, "%s_runSummary.sqlite3" % (TaskClass._DefaultName,))
+        self._summaryRow = None
+        self.resume = bool(getattr(parsedCmd, 'resume', False))
+        self.skipExisting = bool(getattr(parsedCmd, 'skipExisting', False))
+        self.journalName = os.path.join(repoDir, "%s_runJournal.txt" % (TaskClass._DefaultName,))
+        self._targetFailed = False
+        self.profileName = getattr(parsedCmd, 'profile', None)
+        self.profileMode = getattr(parsedCmd, 'profileMode', None) or "parent"
+        self.profileInterval = getattr(parsedCmd, 'profileInterval', None) or 0.005
+        self._task = None
+        self._taskSetupTime = None
+        self._sharedResultDir = None
 
         self.timeout = getattr(parsedCmd, 'timeout', None)
         if self.timeout is None or self.timeout <= 0:
             self.timeout = self.TIMEOUT
+        self.targetTimeout = getattr(parsedCmd, 'targetTimeout', None)
+        if self.targetTimeout is not None and self.targetTimeout <= 0:
+            self.targetTimeout = None
+        self.speculate = max(0.0, float(getattr(parsedCmd, 'speculate', None) or 0.0))
+        self.executorName = getattr(parsedCmd, 'executor', None) or "local"
+        self.listenAddress = getattr(parsedCmd, 'listen', None) or "localhost:0"
+
+        self.chunksize = max(1, int(getattr(parsedCmd, 'chunksize', None) or 1))
+        self.maxInFlight = getattr(parsedCmd, 'maxInFlight', None)
+        if self.maxInFlight is not None and self.maxInFlight <= 0:
+            self.maxInFlight = None
 
         if self.numProcesses > 1:
             if not TaskClass.canMultiprocess:
                 self.log.warn("This task does not support multiprocessing; using one process")
                 self.numProcesses = 1
+        if self.targetTimeout is not None or self.speculate > 0:
+            if not TaskClass.canMultiprocess:
+                self.log.warn("This task does not support multiprocessing; ignoring --target-timeout "
+                              "and --speculate")
+                self.targetTimeout = None
+                self.speculate = 0.0
+        if self.executorName != "local" and not TaskClass.canMultiprocess:
+            self.log.warn("This task does not support multiprocessing; ignoring --executor=%s" %
+                          (self.executorName,))
+            self.executorName = "local"
+        ## Run targets in a TargetPool, which enforces self.targetTimeout and re-runs stragglers
+        self.useTargetPool = self.targetTimeout is not None or self.speculate > 0
 
     def prepareForMultiProcessing(self):
         """!Prepare this instance for multiprocessing by removing optional non-picklable elements.
@@ -177,35 +570,257 @@ class TaskRunner(object):
 
         @return a list of results returned by TaskRunner.\_\_call\_\_, or an empty list if
         TaskRunner.\_\_call\_\_ is not called (e.g. if TaskRunner.precall returns `False`).
-        See TaskRunner.\_\_call\_\_ for details.
+        See TaskRunner.\_\_call\_\_ for details. The results are in the order of TaskRunner.getTargetList,
+        even when multiprocessing; use TaskRunner.runIter to receive them in order of completion.
         """
-        resultList = []
-        if self.numProcesses > 1:
-            import multiprocessing
-            self.prepareForMultiProcessing()
-            pool = multiprocessing.Pool(processes=self.numProcesses, maxtasksperchild=1)
-            mapFunc = functools.partial(_runPool, pool, self.timeout)
-        else:
-            pool = None
-            mapFunc = map
-
-        if self.precall(parsedCmd):
-            profileName = parsedCmd.profile if hasattr(parsedCmd, "profile") else None
-            log = parsedCmd.log
-            targetList = self.getTargetList(parsedCmd)
-            if len(targetList) > 0:
-                with profile(profileName, log):
-                    # Run the task using self.__call__
-                    resultList = mapFunc(self, targetList)
+        indexedResultList = sorted(self.runIter(parsedCmd, withIndex=True), key=lambda item: item[0])
+        return [result for index, result in indexedResultList]
+
+    def runIter(self, parsedCmd, withIndex=False):
+        """!Run the task on all targets, yielding each result as soon as it is available.
+
+        This is the streaming form of TaskRunner.run: targets are pulled lazily from TaskRunner.getTargetList
+        (which may return a generator) and results are yielded in order of completion, so memory use
+        in the parent process does not grow with the number of targets and failures raised with --doraise
+        surface immediately.
+
+        If withIndex is true then (index, result) is yielded for each target instead of the result,
+        where index is the position of the target in the list returned by TaskRunner.getTargetList.
+
+        The targets are run by the \ref executor.Executor "Executor" returned by TaskRunner.makeExecutor:
+        in this process, in local worker processes, or (with --executor=socket) in worker processes that
+        connect from any host. TaskRunner.precall is only called here, so the config and schemas are written
+        once, before any target is dispatched. The executor is made after precall, so worker processes
+        (which receive this runner once, when they start) see any state that precall sets on the runner.
+
+        When multiprocessing, targets are sent to the workers in chunks of self.chunksize targets
+        (see --chunksize), and at most self.maxInFlight targets (see --max-in-flight; None for no limit)
+        are dispatched to the workers before their results have been yielded.
+
+        If self.targetTimeout is not None (see --target-timeout) or self.speculate > 0 (see --speculate) then
+        targets are run one at a time by the workers of a \ref targetPool.TargetPool "TargetPool" (even if
+        self.numProcesses is 1): a target that runs longer than self.targetTimeout sec is recorded as failed
+        (or, with --doraise, raises \ref executor.TargetFailedError "TargetFailedError") and the worker
+        running it is killed and replaced, as is a target whose worker dies, while the rest of the run continues.
+        Once all targets have been dispatched, idle workers re-run stragglers among the slowest self.speculate
+        fraction of targets; the first copy to finish is used, and the other copy is left to finish (it is
+        never killed, so it cannot leave truncated outputs) and its result ignored. Both copies write the
+        target's outputs, so only use --speculate for tasks whose outputs may safely be written twice.
+        self.chunksize, self.maxInFlight and self.timeout are not used.
+
+        If self.schedule is "longest-first" (see --schedule) then all targets are first read
+        and sorted by TaskRunner.sortTargetsByCost, and each idle worker takes the next target
+        from the shared queue (regardless of --chunksize).
+
+        The resources used by each target (CPU time, peak memory, I/O and page faults) are measured
+        in the process that runs it, and summarized by TaskRunner.writeResourceSummary at the end of the run.
+
+        If self.profileName is set (see --profile) then, depending on self.profileMode (see --profile-mode),
+        this process is profiled while it runs the targets ("parent"), or each process profiles the targets
+        it runs and the profiles are merged into one file when the run ends ("worker" and "sample";
+        see \ref profiler.getProcessProfiler "getProcessProfiler").
+
+        If self.metadataWriterName is not "butler" (see --metadata-writer) then each process installs
+        the \ref metadataWriter.MetadataWriter "MetadataWriter" returned by TaskRunner.makeMetadataWriter,
+        which is flushed when the process exits (or, for this process, when the run ends). It is also
+        flushed after each target if the target is journaled (--resume) or if a worker may be killed
+        (--target-timeout or --speculate), so that no metadata is lost for a target reported as done.
+
+        If self.resume is true (see --resume) then each completed target is recorded in the
+        \ref runJournal.RunJournal "RunJournal" self.journalName, and targets that the journal shows were
+        completed successfully with the same config are skipped if TaskRunner.targetOutputsExist.
+
+        If self.skipExisting is true (see --skip-existing) then, before targets are dispatched, targets that
+        already have all the output datasets declared by the task (see CmdLineTask._getOutputDatasetNames)
+        are skipped; the check is done in batches, by TaskRunner.targetOutputsExist.
+
+        If self.runSummaryName is set (see --run-summary) then a row describing each target is written
+        to that SQLite database, using a \ref runSummary.RunSummaryWriter "RunSummaryWriter",
+        as results arrive.
+
+        If self.traceMemory is not None (see --trace-memory) then each process installs a
+        \ref memoryTracer.MemoryTracer "MemoryTracer" reporting self.traceMemory allocation sites,
+        so the memory allocated by each timed task method and block is added to task metadata.
+
+        If self.traceFile is set (see --trace) then a \ref spanTracer.SpanTracer "SpanTracer" records spans
+        for precall, each target and each timed task method, in this process and in all workers,
+        and they are written to self.traceFile in Chrome trace event format when the run ends.
+
+        If self.doReturnResults is true and the targets are run in worker processes on this host
+        then numpy arrays of at least self.SHARED_RESULT_MIN_SIZE bytes in the results are not pickled:
+        each is written to a memory-mapped file (in /dev/shm if possible) and mapped here without copying,
+        by \ref sharedResults.exportSharedArrays "exportSharedArrays" and
+        \ref sharedResults.importSharedArrays "importSharedArrays". Each file is deleted as soon as it is
+        mapped, and the directory holding them is removed when the run ends.
+        """
+        if self.doReturnResults and self.SHARED_RESULT_MIN_SIZE is not None:
+            # made before the executor's worker processes, so they know its name
+            self._sharedResultDir = makeSharedResultDir()
+        executor = None
+        resultIter = None
+        summaryWriter = None
+        journal = None
+        oldMetadataWriter = getMetadataWriter()
+        oldMemoryTracer = getMemoryTracer()
+        tracer = oldTracer = None
+        if self.traceFile:
+            tracer = SpanTracer()
+            oldTracer = setTracer(tracer)
+        try:
+            if tracer is None:
+                doRun = self.precall(parsedCmd)
             else:
-                log.warn("Not running the task because there is no data to process; "
-                    "you may preview data using \"--show data\"")
-
-        if pool is not None:
-            pool.close()
-            pool.join()
-
-        return resultList
+                with tracer.span("precall", category="TaskRunner"):
+                    doRun = self.precall(parsedCmd)
+            if doRun:
+                # made after precall, so the workers receive any state that precall sets on this runner
+                executor = self.makeExecutor(parsedCmd)
+                if self._sharedResultDir is not None and (executor.inProcess or not executor.isLocal):
+                    # results are not pickled, or the workers cannot see files on this host
+                    removeSharedResultDir(self._sharedResultDir)
+                    self._sharedResultDir = None
+                if executor.inProcess:
+                    function = functools.partial(_runTarget, self)
+                else:
+                    # each worker process receives this runner once, when it starts (see _initPoolWorker)
+                    function = _runPoolWorkerTarget
+                profileName = self.profileName if self.profileMode == "parent" else None
+                if self.profileName and self.profileMode != "parent":
+                    removeProcessProfiles(self.profileName)
+                log = parsedCmd.log
+                targetIter = iter(self.getTargetList(parsedCmd))
+                skipCountDict = dict.fromkeys(_SkipReasonDict, 0)
+                if self.resume:
+                    journal = RunJournal(self.journalName, computeConfigDigest(self.config))
+                    targetIter = self._skipDoneTargets(targetIter, journal, parsedCmd, skipCountDict)
+                if self.skipExisting:
+                    targetIter = self._skipExistingTargets(targetIter, parsedCmd, skipCountDict)
+                try:
+                    firstTarget = next(targetIter)
+                except StopIteration:
+                    if any(skipCountDict.itervalues()):
+                        log.info("Not running the task because all targets were skipped")
+                        self.logSkippedTargets(skipCountDict, log)
+                    else:
+                        log.warn("Not running the task because there is no data to process; "
+                            "you may preview data using \"--show data\"")
+                else:
+                    indexedTargetIter = enumerate(itertools.chain([firstTarget], targetIter))
+                    if self.schedule == "longest-first":
+                        indexedTargetIter = self.sortTargetsByCost(list(indexedTargetIter), parsedCmd)
+                    setupTimeList = []
+                    wallTimeDict = {}
+                    resourceSummary = ResourceSummary()
+                    if self.runSummaryName:
+                        try:
+                            summaryWriter = RunSummaryWriter(self.runSummaryName)
+                        except Exception, e:
+                            log.warn("Could not open run summary %s: %s" % (self.runSummaryName, e))
+                    startTime = time.time()
+                    with profile(profileName, log):
+                        # Run the task using self.__call__
+                        resultIter = executor.imapUnordered(function, indexedTargetIter)
+                        for result, stats in resultIter:
+                            if stats.taskSetupTime is not None:
+                                setupTimeList.append(stats.taskSetupTime)
+                            wallTimeDict[stats.index] = stats.wallTime
+                            if stats.resources is not None:
+                                resourceSummary.add(stats.resources, stats.dataId)
+                            if summaryWriter is not None and stats.summaryRow is not None:
+                                try:
+                                    summaryWriter.add(*stats.summaryRow)
+                                except Exception, e:
+                                    log.warn("Could not write to run summary %s (%s); no longer writing it" %
+                                             (self.runSummaryName, e))
+                                    summaryWriter = _closeQuietly(summaryWriter)
+                            if journal is not None and stats.targetKey is not None:
+                                journal.record(stats.targetKey, "failed" if stats.failed else "done")
+                            if tracer is not None and stats.traceEvents:
+                                tracer.addEvents(stats.traceEvents)
+                            if self._sharedResultDir is not None:
+                                result = importSharedArrays(result)
+                            yield (stats.index, result) if withIndex else result
+                    self.logSkippedTargets(skipCountDict, log)
+                    self.logTaskSetupTimes(setupTimeList, log)
+                    self.logMakespan(time.time() - startTime, wallTimeDict, log)
+                    self.writeResourceSummary(resourceSummary, parsedCmd)
+        except BaseException:
+            if hasattr(resultIter, "close"):
+                resultIter.close()
+            if executor is not None:
+                executor.terminate()
+                executor.join()
+                executor = None
+            raise
+        finally:
+            if executor is not None:
+                executor.close()
+                executor.join()
+            if self._sharedResultDir is not None:
+                removeSharedResultDir(self._sharedResultDir)
+                self._sharedResultDir = None
+            if journal is not None:
+                journal.close()
+            if summaryWriter is not None:
+                try:
+                    summaryWriter.close()
+                    parsedCmd.log.info("Wrote run summary to %s" % (self.runSummaryName,))
+                except Exception, e:
+                    parsedCmd.log.warn("Could not write run summary %s: %s" % (self.runSummaryName, e))
+            if self.profileName and self.profileMode != "parent":
+                numProfiles = finishProcessProfiles(self.profileName, mode=_ProfilerModeDict[self.profileMode])
+                if numProfiles:
+                    parsedCmd.log.info("Merged the profiles of %d processes into %s" %
+                                       (numProfiles, self.profileName))
+            metadataWriter = getMetadataWriter()
+            if metadataWriter is not oldMetadataWriter:
+                # installed by _runTarget, running targets in this process
+                metadataWriter.finalizer.cancel()
+                metadataWriter.close()
+                setMetadataWriter(oldMetadataWriter)
+            memoryTracer = getMemoryTracer()
+            if memoryTracer is not oldMemoryTracer:
+                # installed by _runTarget, running targets in this process
+                memoryTracer.stop()
+                setMemoryTracer(oldMemoryTracer)
+            if tracer is not None:
+                setTracer(oldTracer)
+                tracer.writeChromeTrace(self.traceFile)
+                parsedCmd.log.info("Wrote trace of %d spans to %s" % (len(tracer.getEvents()), self.traceFile))
+
+    def makeExecutor(self, parsedCmd):
+        """!Return the \ref executor.Executor "Executor" that runs the targets, as chosen by the command line
+
+        - With --executor=socket, a \ref executor.SocketExecutor "SocketExecutor" listening on
+          self.listenAddress (see --listen) for workers, which may run on other hosts.
+        - Else with --target-timeout or --speculate, a \ref targetPool.TargetPool "TargetPool" of
+          self.numProcesses processes.
+        - Else if self.numProcesses > 1, a \ref executor.PoolExecutor "PoolExecutor".
+        - Else a \ref executor.SerialExecutor "SerialExecutor".
+
+        If the executor runs targets in other processes then this calls TaskRunner.prepareForMultiProcessing,
+        and each worker process receives this runner once, when it starts.
+        Override this method to run targets in some other way.
+        """
+        if self.executorName == "local" and not self.useTargetPool and self.numProcesses <= 1:
+            return SerialExecutor()
+        self.prepareForMultiProcessing()
+        # with --doraise a target that cannot be completed raises TargetFailedError
+        onFailure = None if self.doRaise else functools.partial(_makeFailedTarget, self)
+        if self.executorName == "socket":
+            return SocketExecutor(parseAddress(self.listenAddress), getAuthKey(), initializer=_initPoolWorker,
+                                  initargs=(self,), onFailure=onFailure, log=parsedCmd.log)
+        # with --reuse-task each worker lives for the whole run, else each target gets a fresh worker
+        maxTargetsPerWorker = None if self.reuseTask else 1
+        if self.useTargetPool:
+            return TargetPool(self.numProcesses, initializer=_initPoolWorker, initargs=(self,),
+                              maxTargetsPerWorker=maxTargetsPerWorker, targetTimeout=self.targetTimeout,
+                              speculate=self.speculate, onFailure=onFailure, log=parsedCmd.log)
+        # with longest-first scheduling, idle workers must take one target at a time from the shared queue
+        return PoolExecutor(self.numProcesses, initializer=_initPoolWorker, initargs=(self,),
+                            maxTargetsPerWorker=maxTargetsPerWorker,
+                            chunksize=1 if self.schedule == "longest-first" else self.chunksize,
+                            maxInFlight=self.maxInFlight, timeout=self.timeout)
 
     @staticmethod
     def getTargetList(parsedCmd, **kwargs):
@@ -247,9 +862,292 @@ class TaskRunner(object):
         (2) If your task does not meet condition (1) then you must override both TaskRunner.getTargetList
         and TaskRunner.\_\_call\_\_. You may do this however you see fit, so long as TaskRunner.getTargetList
         returns a list, each of whose elements is sent to TaskRunner.\_\_call\_\_, which runs your task.
+
+        TaskRunner.getTargetList may also return an iterator (e.g. a generator) instead of a list;
+        TaskRunner.runIter consumes it lazily, which avoids holding every target in memory at once.
         """
         return [(ref, kwargs) for ref in parsedCmd.id.refList]
 
+    def _skipDoneTargets(self, targetIter, journal, parsedCmd, skipCountDict):
+        """Iterate over the targets that were not completed by an earlier run, according to the journal
+
+        @param[in] targetIter   iterable of targets
+        @param[in] journal      the RunJournal of this run
+        @param[in] parsedCmd    parsed command-line options
+        @param[in,out] skipCountDict  dict of reason: number of targets skipped; "resume" is incremented
+            for each target skipped
+        """
+        statusDict, numInvalid = journal.getStatusDict()
+        if numInvalid > 0:
+            parsedCmd.log.warn("Ignoring %d records in journal %s that are for a different config" %
+                               (numInvalid, journal.fileName))
+        doneSet = set(key for key, status in statusDict.iteritems() if status == "done")
+        datasetNameList = self.getResumeDatasetNames(parsedCmd) if doneSet else []
+        for target in targetIter:
+            if getTargetKey(target) in doneSet and self.targetOutputsExist(target, datasetNameList):
+                skipCountDict["resume"] += 1
+            else:
+                yield target
+
+    def _skipExistingTargets(self, targetIter, parsedCmd, skipCountDict, batchSize=256):
+        """Iterate over the targets that do not have all the output datasets declared by the task
+
+        Targets are checked in batches of batchSize, concurrently in parsedCmd.discoveryThreads threads
+        if that is greater than 1, using the argument parser's ExistenceIndex if it made one, else a new one.
+        A target whose check fails in a thread (e.g. because the butler is not thread-safe for that
+        dataset type) is checked again serially, in this thread, as for data discovery.
+
+        @param[in] targetIter   iterable of targets
+        @param[in] parsedCmd    parsed command-line options
+        @param[in,out] skipCountDict  dict of reason: number of targets skipped; "skipExisting" is incremented
+            for each target skipped
+        @param[in] batchSize    number of targets to check at once
+        """
+        task = self.makeTask(parsedCmd=parsedCmd)
+        datasetNameList = task._getOutputDatasetNames()
+        if not datasetNameList:
+            parsedCmd.log.warn("--skip-existing has no effect: task %s declares no output datasets" %
+                               (task.getName(),))
+            for target in targetIter:
+                yield target
+            return
+        existenceIndex = getattr(parsedCmd, "existenceIndex", None)
+        if existenceIndex is None:
+            existenceIndex = ExistenceIndex(
+                butler = parsedCmd.butler,
+                rootList = [getattr(parsedCmd, name, None) for name in ("output", "input", "calib")],
+            )
+        checkTarget = functools.partial(self.targetOutputsExist, datasetNameList=datasetNameList,
+                                        existenceIndex=existenceIndex)
+        def checkTargetInThread(target):
+            try:
+                return checkTarget(target)
+            except Exception:
+                return None # checked again in this thread
+        numThreads = getattr(parsedCmd, "discoveryThreads", None) or 1
+        threadPool = None
+        if numThreads > 1:
+            from multiprocessing.pool import ThreadPool
+            threadPool = ThreadPool(numThreads)
+        startTime = time.time()
+        numChecked = 0
+        try:
+            while True:
+                batch = list(itertools.islice(targetIter, batchSize))
+                if not batch:
+                    break
+                if threadPool is not None:
+                    existsList = threadPool.map(checkTargetInThread, batch)
+                    # a check that failed in a thread (e.g. because the butler's registry is bound to
+                    # this thread) is repeated serially
+                    existsList = [checkTarget(target) if exists is None else exists
+                                  for target, exists in itertools.izip(batch, existsList)]
+                else:
+                    existsList = [checkTarget(target) for target in batch]
+                numChecked += len(batch)
+                for target, exists in itertools.izip(batch, existsList):
+                    if exists:
+                        skipCountDict["skipExisting"] += 1
+                    else:
+                        yield target
+        finally:
+            if threadPool is not None:
+                threadPool.close()
+                threadPool.join()
+        parsedCmd.log.info("Checked the outputs %s of %d targets in %.1f sec, listing %d directories" %
+                           (datasetNameList, numChecked, time.time() - startTime, existenceIndex.numListings))
+
+    def logSkippedTargets(self, skipCountDict, log):
+        """!Report the number of targets skipped for each reason (see --resume and --skip-existing)
+
+        @param[in] skipCountDict    dict of reason: number of targets skipped; see _SkipReasonDict
+        @param[in] log              log to which to report
+        """
+        for reason, description in sorted(_SkipReasonDict.iteritems()):
+            if skipCountDict.get(reason):
+                log.info("Skipped %d targets %s" % (skipCountDict[reason], description))
+
+    def getResumeDatasetNames(self, parsedCmd):
+        """!Return the names of the datasets that must exist for a completed target to be skipped by --resume
+
+        The default implementation returns the output datasets declared by the task
+        (see CmdLineTask._getOutputDatasetNames) and its metadata dataset (which is written when processing
+        of a target ends) if that is persisted with the butler.
+
+        @param[in] parsedCmd    parsed command-line options
+        """
+        task = self.makeTask(parsedCmd=parsedCmd)
+        datasetNameList = list(task._getOutputDatasetNames())
+        metadataName = task._getMetadataName()
+        if self.metadataWriterName == "butler" and metadataName is not None:
+            datasetNameList.append(metadataName)
+        return datasetNameList
+
+    def targetOutputsExist(self, target, datasetNameList, existenceIndex=None):
+        """!Return True if the specified datasets exist for all data references of a target
+
+        @param[in] target           a target, as returned by TaskRunner.getTargetList
+        @param[in] datasetNameList  list of dataset types
+        @param[in] existenceIndex   an \ref existenceIndex.ExistenceIndex "ExistenceIndex" used to check
+            existence without a filesystem call per dataset, or None to ask the data references
+        """
+        dataRef = target[0]
+        dataRefList = [dataRef] if hasattr(dataRef, "dataId") else list(dataRef)
+        for ref in dataRefList:
+            for datasetName in datasetNameList:
+                exists = None
+                if existenceIndex is not None:
+                    exists = existenceIndex.datasetExists(datasetType=datasetName, dataId=ref.dataId)
+                if exists is None:
+                    exists = ref.datasetExists(datasetName)
+                if not exists:
+                    return False
+        return True
+
+    def makeCostModel(self, parsedCmd):
+        """!Return the TargetCostModel used by TaskRunner.sortTargetsByCost
+
+        The default implementation returns a RunSummaryCostModel if an earlier run of this task wrote
+        a run summary (see --run-summary), as that reads the costs of all targets with one query.
+        Otherwise it returns a MetadataCostModel that reads the CPU time of the task's run method from
+        the metadata persisted by earlier runs, using parsedCmd.discoveryThreads threads (see
+        --discovery-threads), for at most self.MAX_COST_TARGETS targets.
+
+        @param[in] parsedCmd    parsed command-line options
+        """
+        repoDir = getattr(parsedCmd, 'output', None) or getattr(parsedCmd, 'input', None) or "."
+        runSummaryName = os.path.join(repoDir, "%s_runSummary.sqlite3" % (self.TaskClass._DefaultName,))
+        if os.path.exists(runSummaryName):
+            try:
+                return RunSummaryCostModel(runSummaryName)
+            except Exception, e:
+                parsedCmd.log.warn("Could not read costs from run summary %s: %s" % (runSummaryName, e))
+        task = self.makeTask(parsedCmd=parsedCmd)
+        return MetadataCostModel(metadataName=task._getMetadataName(), taskName=task.getFullName(),
+                                 numThreads=getattr(parsedCmd, "discoveryThreads", None) or 1,
+                                 maxTargets=self.MAX_COST_TARGETS)
+
+    def sortTargetsByCost(self, indexedTargetList, parsedCmd):
+        """!Sort targets so that the most expensive targets run first
+
+        Costs are estimated by the cost model returned by TaskRunner.makeCostModel. Targets whose cost
+        is unknown are assumed to have the mean cost of the others; the sort is stable, so targets
+        of equal cost retain their original order.
+
+        @param[in] indexedTargetList    list of (index, target) for all targets
+        @param[in] parsedCmd            parsed command-line options
+        @return the sorted list of (index, target)
+        """
+        costModel = self.makeCostModel(parsedCmd)
+        costList = costModel.getCostList([target for index, target in indexedTargetList])
+        knownCostList = [cost for cost in costList if cost is not None]
+        defaultCost = sum(knownCostList)/len(knownCostList) if knownCostList else 0.0
+        parsedCmd.log.info("Scheduling longest-first; cost is known for %d of %d targets" %
+                           (len(knownCostList), len(costList)))
+        order = sorted(range(len(costList)),
+                       key=lambda i: -(costList[i] if costList[i] is not None else defaultCost))
+        return [indexedTargetList[i] for i in order]
+
+    def logMakespan(self, makespan, wallTimeDict, log):
+        """!Report the wall time taken to process all targets, compared to that of other schedules
+
+        The alternatives are estimated from the measured wall time of each target, assuming each
+        of the numProcesses processes takes the next target whenever it is idle.
+
+        @param[in] makespan     wall time (sec) taken to process all targets
+        @param[in] wallTimeDict dict of index of target in TaskRunner.getTargetList: wall time (sec)
+        @param[in] log          log to which to report
+        """
+        if self.numProcesses <= 1 or not wallTimeDict:
+            return
+        orderedTimeList = [wallTimeDict[index] for index in sorted(wallTimeDict)]
+        log.info("Makespan %.1f sec for %d targets with %d processes and %s schedule; "
+                 "estimated %.1f sec in the given order, %.1f sec longest-first" %
+                 (makespan, len(orderedTimeList), self.numProcesses, self.schedule,
+                  _computeMakespan(orderedTimeList, self.numProcesses),
+                  _computeMakespan(sorted(orderedTimeList, reverse=True), self.numProcesses)))
+
+    def writeResourceSummary(self, resourceSummary, parsedCmd):
+        """!Log the total resources used by all targets, and write a summary table to the output repo
+
+        The table (see \ref resourceUsage.ResourceSummary.format "ResourceSummary.format") is written
+        next to the persisted config, as file config/\<task name>_resources.txt in the output repository
+        (or the input repository if there is no output repository); it is overwritten on each run.
+        Nothing is written if parsedCmd specifies no repository.
+
+        @param[in] resourceSummary  a \ref resourceUsage.ResourceSummary "ResourceSummary" of all targets
+        @param[in] parsedCmd        parsed command-line options
+        """
+        if not len(resourceSummary):
+            return
+        log = parsedCmd.log
+        log.info("Resource usage of %d targets: %.1f sec CPU in total, %.1f sec wall time for the slowest; "
+                 "largest maxResidentSetSize %d" %
+                 (len(resourceSummary), sum(resourceSummary.getValues("cpuTime")),
+                  max(resourceSummary.getValues("wallTime")),
+                  max(resourceSummary.getValues("maxResidentSetSize"))))
+        repoDir = getattr(parsedCmd, "output", None) or getattr(parsedCmd, "input", None)
+        if repoDir is None:
+            return
+        fileName = os.path.join(repoDir, "config", "%s_resources.txt" % (self.TaskClass._DefaultName,))
+        try:
+            resourceSummary.write(fileName)
+        except Exception, e:
+            log.warn("Could not write resource summary %s: %s" % (fileName, e))
+        else:
+            log.info("Wrote resource summary to %s" % (fileName,))
+
+    def logTaskSetupTimes(self, setupTimeList, log):
+        """!Report the per-target overhead of making (or, if reuseTask, resetting) the task
+
+        @param[in] setupTimeList    list of times (sec) spent obtaining the task for each target
+        @param[in] log              log to which to report
+        """
+        if not setupTimeList:
+            return
+        totalTime = sum(setupTimeList)
+        log.info("Task setup took %.4f sec/target on average (max %.4f sec; %.2f sec total for %d targets%s)" %
+                 (totalTime/len(setupTimeList), max(setupTimeList), totalTime, len(setupTimeList),
+                  "; reusing tasks" if self.reuseTask else ""))
+
+    def makeMetadataWriter(self):
+        """!Return the \ref metadataWriter.MetadataWriter "MetadataWriter" used by each process to persist
+        task metadata, as specified by self.metadataWriterName (see --metadata-writer)
+
+        - "async": an \ref metadataWriter.AsyncMetadataWriter "AsyncMetadataWriter" that puts metadata
+            with the butler in batches (in the thread that runs the task, which owns the butler)
+        - "sqlite": an AsyncMetadataWriter that writes metadata in batches, in a background thread,
+            to the SQLite database
+            self.metadataDbName (\<task name>_metadata.sqlite3 in the output repository),
+            using a \ref metadataWriter.SqliteMetadataWriter "SqliteMetadataWriter"
+        """
+        if self.metadataWriterName == "async":
+            return AsyncMetadataWriter(ButlerMetadataWriter())
+        elif self.metadataWriterName == "sqlite":
+            return AsyncMetadataWriter(SqliteMetadataWriter(self.metadataDbName))
+        raise RuntimeError("Unknown metadata writer %r" % (self.metadataWriterName,))
+
+    def getTask(self, args):
+        """!Return the task to run on a single target, and record how long it took to obtain
+
+        If reuseTask is false this is a new task from TaskRunner.makeTask. Otherwise the task is made
+        on the first target this process runs, and reused for later targets after clearing its metadata
+        with \ref task.Task.emptyMetadata "emptyMetadata"; this saves constructing the whole task hierarchy
+        for every target, but any other state that the task keeps from one target to the next is retained.
+
+        @param[in] args     args tuple passed to TaskRunner.\_\_call\_\_
+        """
+        startTime = time.time()
+        if not self.reuseTask:
+            task = self.makeTask(args=args)
+        elif self._task is None:
+            task = self._task = self.makeTask(args=args)
+        else:
+            task = self._task
+            task.emptyMetadata()
+        self._taskSetupTime = time.time() - startTime
+        return task
+
     def makeTask(self, parsedCmd=None, args=None):
         """!Create a Task instance
 
@@ -274,16 +1172,14 @@ class TaskRunner(object):
         the TaskRunner itself, for compatibility with multiprocessing.
 
         The default implementation writes schemas and configs, or compares them to existing
-        files on disk if present.
+        files on disk if present; see writeConfigAndSchemas.
         """
         task = self.makeTask(parsedCmd=parsedCmd)
         if self.doRaise:
-            task.writeConfig(parsedCmd.butler, clobber=self.clobberConfig, doBackup=self.doBackup)
-            task.writeSchemas(parsedCmd.butler, clobber=self.clobberConfig, doBackup=self.doBackup)
+            self.writeConfigAndSchemas(task, parsedCmd.butler)
         else:
             try:
-                task.writeConfig(parsedCmd.butler, clobber=self.clobberConfig, doBackup=self.doBackup)
-                task.writeSchemas(parsedCmd.butler, clobber=self.clobberConfig, doBackup=self.doBackup)
+                self.writeConfigAndSchemas(task, parsedCmd.butler)
             except Exception, e:
                 task.log.fatal("Failed in task initialization: %s" % e)
                 if not isinstance(e, TaskError):
@@ -291,6 +1187,44 @@ class TaskRunner(object):
                 return False
         return True
 
+    def writeConfigAndSchemas(self, task, butler):
+        """!Write the config and schemas of a task, or compare them to existing ones; called by precall
+
+        Calls task.writeConfig and task.writeSchemas. Unless the config is to be clobbered,
+        the existing config and schema datasets are first read all at once, concurrently in up to
+        PRECALL_FETCH_THREADS threads, rather than one after another by writeConfig and writeSchemas.
+        The config is not read if writeConfig will not need it: if it does not exist yet, or if its
+        fingerprint shows that it matches (see \ref configFingerprint.readConfigFingerprint
+        "readConfigFingerprint").
+
+        @param[in] task     the task, as returned by makeTask
+        @param[in] butler   data butler
+        """
+        if not self.clobberConfig:
+            datasetNameList = [dataset + "_schema" for dataset in task.getAllSchemaCatalogs()]
+            configName = task._getConfigName()
+            if configName is not None:
+                # writeConfig reads the existing config only if it has no fingerprint matching task.config
+                configPath = getDatasetPath(butler, configName)
+                if configPath is None or (os.path.exists(configPath) and
+                                          readConfigFingerprint(configPath) != computeConfigDigest(task.config)):
+                    datasetNameList.insert(0, configName)
+            startTime = time.time()
+            butler = _PrefetchedButler(butler, datasetNameList, self.PRECALL_FETCH_THREADS)
+            task.log.info("Read the existing config and schemas (%d datasets) in %.2f sec" %
+                          (len(datasetNameList), time.time() - startTime))
+        task.writeConfig(butler, clobber=self.clobberConfig, doBackup=self.doBackup)
+        task.writeSchemas(butler, clobber=self.clobberConfig, doBackup=self.doBackup)
+
+    def markFailed(self):
+        """!Record that the target being run by TaskRunner.\_\_call\_\_ failed
+
+        Call this from TaskRunner.\_\_call\_\_ if it handles an exception raised by the task, so that
+        the target is reported as failed (e.g. it is not recorded as done by --resume).
+        The flag is reset before each target.
+        """
+        self._targetFailed = True
+
     def __call__(self, args):
         """!Run the Task on a single target.
 
@@ -312,7 +1246,7 @@ class TaskRunner(object):
             - result: result returned by task run, or None if the task fails
         """
         dataRef, kwargs = args
-        task = self.makeTask(args=args)
+        task = self.getTask(args)
         result = None # in case the task fails
         if self.doRaise:
             result = task.run(dataRef, **kwargs)
@@ -320,6 +1254,7 @@ class TaskRunner(object):
             try:
                 result = task.run(dataRef, **kwargs)
             except Exception, e:
+                self.markFailed()
                 # don't use a try block as we need to preserve the original exception
                 if hasattr(dataRef, "dataId"):
                     task.log.fatal("Failed on dataId=%s: %s" % (dataRef.dataId, e))
@@ -332,6 +1267,8 @@ class TaskRunner(object):
                 if not isinstance(e, TaskError):
                     traceback.print_exc(file=sys.stderr)
         task.writeMetadata(dataRef)
+        if self.runSummaryName:
+            self._summaryRow = flattenMetadata(task.getFullMetadata())
 
         if self.doReturnResults:
             return Struct(
@@ -471,6 +1408,14 @@ class CmdLineTask(Task):
         """!Write the configuration used for processing the data, or check that an existing
         one is equal to the new one if present.
 
+        A fingerprint file holding the canonical digest of the config
+        (see \ref configFingerprint.computeConfigDigest "computeConfigDigest") is written next to the
+        persisted config, so a later run can check its config by comparing digests, without reading the
+        persisted config. If there is no config, it is created atomically (see
+        \ref configFingerprint.writeConfigIfAbsent "writeConfigIfAbsent"), so several processes or hosts
+        starting at once against the same output repo agree on one config. If the butler cannot report the
+        path of the config, it is persisted and compared through the butler instead.
+
         @param[in] butler   data butler used to write the config.
             The config is written to dataset type self._getConfigName()
         @param[in] clobber  a boolean flag that controls what happens if a config already has been saved:
@@ -480,17 +1425,41 @@ class CmdLineTask(Task):
         configName = self._getConfigName()
         if configName is None:
             return
+        digest = computeConfigDigest(self.config)
+        configPath = getDatasetPath(butler, configName)
         if clobber:
             butler.put(self.config, configName, doBackup=doBackup)
-        elif butler.datasetExists(configName):
-            # this may be subject to a race condition; see #2789
+            if configPath is not None:
+                writeConfigFingerprint(configPath, digest)
+            return
+        if configPath is not None:
+            try:
+                if writeConfigIfAbsent(self.config, configPath, digest):
+                    return
+            except (IOError, OSError), e:
+                self.log.warn("Could not write config %r atomically (%s); writing it with the butler" %
+                              (configName, e))
+                configPath = None
+            else:
+                if readConfigFingerprint(configPath) == digest:
+                    return
+        if butler.datasetExists(configName):
+            fileDigest = None
+            if configPath is not None:
+                # read before the config, so the fingerprint is not valid if the config changes meanwhile
+                fileDigest = computeFileDigest(configPath)
             oldConfig = butler.get(configName, immediate=True)
+            oldDigest = computeConfigDigest(oldConfig)
             output = lambda msg: self.log.fatal("Comparing configuration: " + msg)
-            if not self.config.compare(oldConfig, shortcut=False, output=output):
+            # configs that persist identically are equal; compare field by field only to report differences
+            if oldDigest != digest and not self.config.compare(oldConfig, shortcut=False, output=output):
                 raise TaskError(
                     ("Config does not match existing task config %r on disk; tasks configurations " + \
                     "must be consistent within the same output repo (override with --clobber-config)") % \
                     (configName,))
+            if fileDigest is not None:
+                # the config was persisted without a fingerprint (or it is stale); add one for later runs
+                writeConfigFingerprint(configPath, oldDigest, fileDigest)
         else:
             butler.put(self.config, configName)
 
@@ -508,6 +1477,7 @@ class CmdLineTask(Task):
         then some schemas may have been saved successfully and others may not, and there is no easy way to
         tell which is which.
         """
+        import lsst.afw.table as afwTable # slow to import, and only needed here
         for dataset, catalog in self.getAllSchemaCatalogs().iteritems():
             schemaDataset = dataset + "_schema"
             if clobber:
@@ -527,11 +1497,18 @@ class CmdLineTask(Task):
 
         @param[in] dataRef  butler data reference used to write the metadata.
             The metadata is written to dataset type self._getMetadataName()
+
+        If a \ref metadataWriter.MetadataWriter "MetadataWriter" is installed (see --metadata-writer)
+        then the metadata is passed to it, and may be persisted later or elsewhere.
         """
         try:
             metadataName = self._getMetadataName()
             if metadataName is not None:
-                dataRef.put(self.getFullMetadata(), metadataName)
+                metadataWriter = getMetadataWriter()
+                if metadataWriter is None:
+                    dataRef.put(self.getFullMetadata(), metadataName)
+                else:
+                    metadataWriter.write(dataRef, metadataName, self.getFullMetadata())
         except Exception, e:
             self.log.warn("Could not persist metadata for dataId=%s: %s" % (dataRef.dataId, e,))
 
@@ -542,6 +1519,16 @@ class CmdLineTask(Task):
         """
         return self._DefaultName + "_config"
 
+    def _getOutputDatasetNames(self):
+        """!Return the list of dataset types that this task writes for each target it processes
+
+        TaskRunner uses this to skip targets whose outputs already exist (see --skip-existing and --resume).
+        The default implementation returns an empty list; override it to declare your task's outputs.
+
+        @note The names may depend on the config; that is why this is not a class method.
+        """
+        return []
+
     def _getMetadataName(self):
         """!Return the name of the metadata dataset type, or None if metadata is not to be persisted
 
@@ -0,0 +1,157 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Canonical digests of task configs, stored next to persisted configs so that they can be checked cheaply.
+"""
+import errno
+import hashlib
+import json
+import os
+import socket
+from StringIO import StringIO
+
+__all__ = ["computeConfigDigest", "computeFileDigest", "getDatasetPath", "readConfigFingerprint",
+           "writeConfigFingerprint", "writeConfigIfAbsent"]
+
+## Suffix of the name of the fingerprint file written next to a persisted config
+FingerprintSuffix = ".digest"
+
+def computeConfigDigest(config):
+    """!Return a canonical hex digest (str) of a config (an lsst.pex.config.Config)
+
+    The digest is the SHA-1 of the lines of the config as it would be persisted (saveToStream),
+    without comments and blank lines, sorted. It therefore depends on the values of the fields and the
+    targets of retargeted subtasks, but not on the order of the fields or their documentation,
+    and is the same in any process on any host for the same config (e.g. once the config is frozen).
+    Configs with the same digest are equal; configs that compare equal may have different digests
+    (e.g. floats that differ by less than the comparison tolerance).
+    """
+    stream = StringIO()
+    config.saveToStream(stream, "config")
+    lineList = sorted(line.rstrip() for line in stream.getvalue().splitlines()
+                      if line.strip() and not line.lstrip().startswith("#"))
+    return hashlib.sha1("\n".join(lineList)).hexdigest()
+
+def getDatasetPath(butler, datasetType):
+    """!Return the path of the file of a dataset that has no data ID (such as a config), or None if unknown
+
+    @param[in] butler       data butler
+    @param[in] datasetType  dataset type; the butler must support datasetType + "_filename"
+    """
+    try:
+        pathList = butler.get(datasetType + "_filename", immediate=True)
+    except Exception:
+        return None
+    if isinstance(pathList, basestring):
+        return pathList
+    if isinstance(pathList, (list, tuple)) and len(pathList) == 1 and isinstance(pathList[0], basestring):
+        return pathList[0]
+    return None
+
+def computeFileDigest(path):
+    """!Return the SHA-1 hex digest (str) of the contents of a file, such as a persisted config"""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def _getTempPath(path):
+    """Return a name for a temporary file next to path, unique across processes and hosts"""
+    dirName, baseName = os.path.split(path)
+    return os.path.join(dirName, ".%s.%s.%d.tmp" % (baseName, socket.gethostname(), os.getpid()))
+
+def readConfigFingerprint(configPath):
+    """!Return the digest of a persisted config recorded in its fingerprint file, or None if not valid
+
+    The fingerprint is only valid if it exists and the persisted config has not been changed since
+    the fingerprint was written (e.g. by an older version of this package that wrote no fingerprint).
+
+    @param[in] configPath   path of the persisted config
+    @return the digest, as computed by computeConfigDigest, or None
+    """
+    try:
+        with open(configPath + FingerprintSuffix, "r") as f:
+            fingerprint = json.load(f)
+        if fingerprint["fileDigest"] != computeFileDigest(configPath):
+            return None
+        return str(fingerprint["digest"])
+    except Exception:
+        return None
+
+def writeConfigFingerprint(configPath, digest, fileDigest=None):
+    """!Write (atomically replace) the fingerprint file of a persisted config
+
+    @param[in] configPath   path of the persisted config
+    @param[in] digest       digest of the config, as computed by computeConfigDigest
+    @param[in] fileDigest   SHA-1 hex digest of the contents of configPath from which digest was computed,
+        or None to read it now. If the file has since changed, the fingerprint is not valid (which is safe).
+    """
+    if fileDigest is None:
+        fileDigest = computeFileDigest(configPath)
+    fingerprintPath = configPath + FingerprintSuffix
+    tempPath = _getTempPath(fingerprintPath)
+    try:
+        with open(tempPath, "w") as f:
+            json.dump(dict(digest=digest, fileDigest=fileDigest), f)
+        os.rename(tempPath, fingerprintPath)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+
+def writeConfigIfAbsent(config, configPath, digest=None):
+    """!Persist a config, and its fingerprint, if no config has been persisted to configPath
+
+    Creating the file is atomic, and safe if several processes (on one or several hosts sharing a file
+    system) try at once: the config is written to a temporary file which is then hard linked to configPath,
+    which fails if configPath exists. So if configPath exists it is complete.
+
+    @param[in] config       config to persist (an lsst.pex.config.Config)
+    @param[in] configPath   path to which to persist it
+    @param[in] digest       digest of the config, as computed by computeConfigDigest, or None to compute it
+    @return True if the config was written, False if configPath already existed
+
+    @throw OSError or IOError if the file cannot be written or linked
+        (e.g. on a file system that does not support hard links)
+    """
+    if digest is None:
+        digest = computeConfigDigest(config)
+    dirName = os.path.dirname(configPath)
+    if dirName and not os.path.isdir(dirName):
+        try:
+            os.makedirs(dirName)
+        except OSError:
+            if not os.path.isdir(dirName): # it may have been made by another process
+                raise
+    tempPath = _getTempPath(configPath)
+    try:
+        with open(tempPath, "w") as f:
+            config.saveToStream(f, "config")
+        try:
+            os.link(tempPath, configPath)
+        except OSError, e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        fileDigest = computeFileDigest(tempPath)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+    writeConfigFingerprint(configPath, digest, fileDigest)
+    return True
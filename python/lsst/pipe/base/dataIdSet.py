@@ -0,0 +1,209 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Compact, lazily expanded sets of data IDs, as specified by --id arguments.
+"""
+import collections
+import itertools
+import operator
+
+__all__ = ["DataIdSpec", "DataIdSet"]
+
+class DataIdSpec(object):
+    """!The data IDs specified by one data ID argument: the cross product of a list of values for each key
+
+    Only the values are stored; data IDs are computed as needed when iterating. For example
+    --id visit=1..200000 ccd=0..103 is stored as 200104 values, not 20.8 million data ID dicts.
+
+    Iteration order matches itertools.product: the last key varies fastest.
+    Duplicate values for a key are ignored.
+    """
+    def __init__(self, valueDict):
+        """!Construct a DataIdSpec
+
+        @param[in] valueDict    dict of data ID key: sequence of values for that key;
+            use a collections.OrderedDict to control the order of keys in the data IDs
+        """
+        self.valueDict = collections.OrderedDict()
+        for key, valueList in valueDict.iteritems():
+            self.valueDict[key] = _uniqueList(valueList)
+        self._valueSetDict = None
+
+    def __iter__(self):
+        """!Iterate over the data IDs, as collections.OrderedDict"""
+        keyList = self.valueDict.keys()
+        for valList in itertools.product(*self.valueDict.values()):
+            yield collections.OrderedDict(itertools.izip(keyList, valList))
+
+    def __len__(self):
+        """!Return the number of data IDs, without computing them"""
+        return reduce(operator.mul, (len(valueList) for valueList in self.valueDict.itervalues()), 1)
+
+    def __contains__(self, dataId):
+        """!Return True if the specified data ID (a dict) is one of the data IDs of this DataIdSpec"""
+        if len(dataId) != len(self.valueDict):
+            return False
+        for key, value in dataId.iteritems():
+            if key not in self.valueDict or value not in self._getValueSet(key):
+                return False
+        return True
+
+    def __repr__(self):
+        return "DataIdSpec(%r)" % (dict(self.valueDict),)
+
+    def __getstate__(self):
+        return (self.valueDict,)
+
+    def __setstate__(self, state):
+        self.valueDict, = state
+        self._valueSetDict = None
+
+    def _getValueSet(self, key):
+        """Return the set of values for a key"""
+        if self._valueSetDict is None:
+            self._valueSetDict = dict((key, frozenset(valueList))
+                                      for key, valueList in self.valueDict.iteritems())
+        return self._valueSetDict[key]
+
+    def mapValues(self, func):
+        """!Return a new DataIdSpec with each value replaced by func(key, value)
+
+        func is called once per distinct value of each key, not once per data ID.
+        """
+        return DataIdSpec(collections.OrderedDict(
+            (key, [func(key, value) for value in valueList]) for key, valueList in self.valueDict.iteritems()
+        ))
+
+    def intersection(self, other):
+        """!Return a DataIdSpec of the data IDs that are in both this DataIdSpec and another"""
+        if set(self.valueDict) != set(other.valueDict):
+            return DataIdSpec(collections.OrderedDict((key, []) for key in self.valueDict))
+        return DataIdSpec(collections.OrderedDict(
+            (key, [value for value in valueList if value in other._getValueSet(key)])
+            for key, valueList in self.valueDict.iteritems()
+        ))
+
+    def getSpec(self):
+        """!Return a hashable description of this DataIdSpec"""
+        return tuple((key, tuple(valueList)) for key, valueList in self.valueDict.iteritems())
+
+class DataIdSet(object):
+    """!A set of data IDs described as a union of DataIdSpecs, minus the data IDs of other DataIdSpecs
+
+    Data IDs are computed lazily, in the order of the DataIdSpecs that were added, and each
+    data ID is produced once even if it is specified by several DataIdSpecs. Overlap is detected
+    with DataIdSpec.__contains__, so the data IDs are never all held in memory.
+
+    Set algebra: a | b is the union and a - b the difference of DataIdSets or DataIdSpecs;
+    add and exclude modify a DataIdSet in place.
+    """
+    def __init__(self, specList=(), excludeList=()):
+        """!Construct a DataIdSet
+
+        @param[in] specList     sequence of DataIdSpecs whose data IDs are included
+        @param[in] excludeList  sequence of DataIdSpecs whose data IDs are excluded
+        """
+        self.specList = list(specList)
+        self.excludeList = list(excludeList)
+
+    def add(self, other):
+        """!Include the data IDs of a DataIdSpec or DataIdSet"""
+        if isinstance(other, DataIdSet):
+            if other.excludeList:
+                raise ValueError("Cannot add a DataIdSet that has exclusions")
+            self.specList += other.specList
+        else:
+            self.specList.append(other)
+
+    def exclude(self, other):
+        """!Exclude the data IDs of a DataIdSpec or DataIdSet"""
+        if isinstance(other, DataIdSet):
+            if other.excludeList:
+                raise ValueError("Cannot exclude a DataIdSet that has exclusions")
+            self.excludeList += other.specList
+        else:
+            self.excludeList.append(other)
+
+    def __or__(self, other):
+        result = DataIdSet(self.specList, self.excludeList)
+        result.add(other)
+        return result
+
+    def __sub__(self, other):
+        result = DataIdSet(self.specList, self.excludeList)
+        result.exclude(other)
+        return result
+
+    def __iter__(self):
+        """!Iterate over the data IDs, as collections.OrderedDict"""
+        for i, spec in enumerate(self.specList):
+            otherSpecList = self.specList[:i] + self.excludeList
+            for dataId in spec:
+                if not any(dataId in otherSpec for otherSpec in otherSpecList):
+                    yield dataId
+
+    def __contains__(self, dataId):
+        return any(dataId in spec for spec in self.specList) and \
+            not any(dataId in spec for spec in self.excludeList)
+
+    def __len__(self):
+        """!Return the number of data IDs, without computing them
+
+        The number of data IDs of each DataIdSpec, less the number also in a previous DataIdSpec
+        or excluded, is computed from the intersections of the DataIdSpecs.
+        """
+        numIds = 0
+        for i, spec in enumerate(self.specList):
+            overlapList = [spec.intersection(otherSpec) for otherSpec in self.specList[:i] + self.excludeList]
+            overlapList = [overlap for overlap in overlapList if len(overlap) > 0]
+            numIds += len(spec)
+            if overlapList:
+                numIds -= len(DataIdSet(overlapList))
+        return numIds
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return "DataIdSet(%r, %r)" % (self.specList, self.excludeList)
+
+    def mapValues(self, func):
+        """!Return a new DataIdSet with each value replaced by func(key, value); see DataIdSpec.mapValues"""
+        return DataIdSet(
+            specList = [spec.mapValues(func) for spec in self.specList],
+            excludeList = [spec.mapValues(func) for spec in self.excludeList],
+        )
+
+    def getSpec(self):
+        """!Return a hashable description of this DataIdSet"""
+        return (tuple(spec.getSpec() for spec in self.specList),
+                tuple(spec.getSpec() for spec in self.excludeList))
+
+def _uniqueList(valueList):
+    """Return a list of the values in valueList, without duplicates, in order of first appearance"""
+    seenSet = set()
+    result = []
+    for value in valueList:
+        if value not in seenSet:
+            seenSet.add(value)
+            result.append(value)
+    return result
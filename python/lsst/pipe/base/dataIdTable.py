@@ -0,0 +1,166 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Columnar storage of data IDs, one numpy array per key.
+"""
+import collections
+import itertools
+
+__all__ = ["DataIdTable"]
+
+## Types whose values are stored in a typed numpy array once cast; values of other types are stored as objects
+_NUMPY_TYPES = (int, long, float, bool)
+
+## Types to which numpy casts an array of values with the same results as calling the type on each value
+_NUMPY_CAST_TYPES = (int, float)
+
+class DataIdTable(object):
+    """!A list of data IDs that all have the same keys, stored as one numpy array per key
+
+    Holding many data IDs as columns is much more compact than a list of dicts, and lets
+    DataIdContainer.castDataIds cast the values of each key as a whole (see cast).
+    Iterating and indexing yield data ID dicts (collections.OrderedDict) of python scalars.
+
+    Use a DataIdTable as the dataIds of a DataIdContainer for data IDs that are not specified as a
+    cross product, e.g. a long list of data IDs read from a file.
+
+    @note This is API only: ArgumentParser never makes a DataIdTable (--id arguments are held in a
+    \ref dataIdSet.DataIdSet "DataIdSet", which already casts each distinct value once). A task's
+    DataIdContainer subclass or TaskRunner may assign one to DataIdContainer.dataIds before
+    castDataIds is called.
+    """
+    def __init__(self, columnDict):
+        """!Construct a DataIdTable
+
+        @param[in] columnDict   dict of data ID key: sequence of values, all of the same length;
+            use a collections.OrderedDict to control the order of keys in the data IDs
+        """
+        import numpy # not imported at module level, to keep importing lsst.pipe.base fast
+        self.columnDict = collections.OrderedDict()
+        for key, values in columnDict.iteritems():
+            self.columnDict[key] = numpy.asarray(values)
+        lengthSet = set(len(column) for column in self.columnDict.itervalues())
+        if len(lengthSet) > 1:
+            raise ValueError("All columns must have the same length; lengths are %s" % (sorted(lengthSet),))
+        self._length = lengthSet.pop() if lengthSet else 0
+
+    @classmethod
+    def fromDicts(cls, dataIdList):
+        """!Construct a DataIdTable from a sequence of data ID dicts, which must all have the same keys"""
+        dataIdList = list(dataIdList)
+        if not dataIdList:
+            return cls({})
+        keyList = list(dataIdList[0].keys())
+        keySet = set(keyList)
+        for dataId in dataIdList:
+            if set(dataId) != keySet:
+                raise ValueError("Data ID %s does not have keys %s" % (dataId, keyList))
+        return cls(collections.OrderedDict((key, [dataId[key] for dataId in dataIdList]) for key in keyList))
+
+    @classmethod
+    def fromSpec(cls, spec):
+        """!Construct a DataIdTable of the data IDs of a \ref dataIdSet.DataIdSpec "DataIdSpec"
+
+        The cross product is computed with numpy, in the same order as iterating over the DataIdSpec.
+        """
+        import numpy
+        sizeList = [len(valueList) for valueList in spec.valueDict.itervalues()]
+        columnDict = collections.OrderedDict()
+        for i, (key, valueList) in enumerate(spec.valueDict.iteritems()):
+            numBefore = int(numpy.prod(sizeList[:i]))
+            numAfter = int(numpy.prod(sizeList[i + 1:]))
+            columnDict[key] = numpy.tile(numpy.repeat(numpy.asarray(valueList), numAfter), numBefore)
+        return cls(columnDict)
+
+    def keys(self):
+        """!Return the list of data ID keys"""
+        return self.columnDict.keys()
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        """!Iterate over the data IDs, as collections.OrderedDict"""
+        keyList = self.columnDict.keys()
+        columnList = [column.tolist() for column in self.columnDict.itervalues()]
+        for valList in itertools.izip(*columnList):
+            yield collections.OrderedDict(itertools.izip(keyList, valList))
+
+    def __getitem__(self, i):
+        """!Return the data ID at index i, as a collections.OrderedDict"""
+        return collections.OrderedDict((key, column[i].item()) for key, column in self.columnDict.iteritems())
+
+    def __repr__(self):
+        return "DataIdTable(%d data IDs with keys %s)" % (len(self), self.keys())
+
+    def cast(self, keyTypeDict):
+        """!Return a new DataIdTable with the values of each key cast to the specified type
+
+        Each column is cast as a whole: the distinct values are found with numpy.unique and cast together
+        (with numpy if keyType is int or float, else by calling keyType once per distinct value),
+        and the results are scattered back with one indexing operation.
+
+        @param[in] keyTypeDict  dict of data ID key: type; keys that are missing or whose type is str
+            are not cast
+
+        @throw TypeError if a value cannot be cast; the message names the value and key
+        """
+        columnDict = collections.OrderedDict()
+        for key, column in self.columnDict.iteritems():
+            keyType = keyTypeDict.get(key, str)
+            if keyType != str:
+                column = _castColumn(column, keyType, key)
+            columnDict[key] = column
+        return DataIdTable(columnDict)
+
+    def getSpec(self):
+        """!Return a hashable description of this DataIdTable"""
+        return tuple((key, tuple(column.tolist())) for key, column in self.columnDict.iteritems())
+
+def _castColumn(column, keyType, key):
+    """Cast a numpy array of values to keyType; raise TypeError naming a value that cannot be cast"""
+    import numpy
+    try:
+        uniqueValues, inverse = numpy.unique(column, return_inverse=True)
+    except TypeError:
+        # values that cannot be sorted, e.g. of mixed types
+        uniqueValues, inverse = column, numpy.arange(len(column))
+    if keyType in _NUMPY_CAST_TYPES:
+        try:
+            return uniqueValues.astype(keyType)[inverse]
+        except (TypeError, ValueError, OverflowError):
+            pass # find and report the value that cannot be cast, below
+    castList = []
+    for strVal in uniqueValues.tolist():
+        try:
+            value = keyType(strVal)
+            if keyType in _NUMPY_TYPES:
+                numpy.array(value, dtype=keyType) # check that it fits, e.g. an int in 64 bits
+            castList.append(value)
+        except Exception:
+            raise TypeError("Cannot cast value %r to %s for ID key %r" % (strVal, keyType, key,))
+    if keyType in _NUMPY_TYPES:
+        castValues = numpy.array(castList, dtype=keyType)
+    else:
+        castValues = numpy.empty(len(castList), dtype=object)
+        castValues[:] = castList
+    return castValues[inverse]
@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Persistent cache of the data IDs and data references computed by the argument parser.
+"""
+import cPickle as pickle
+import hashlib
+import os
+import tempfile
+
+from .existenceIndex import _getParentChain
+
+__all__ = ["DataRefCache"]
+
+## Files whose modification time and size identify the state of a repository
+_REGISTRY_NAMES = ("registry.sqlite3", "calibRegistry.sqlite3")
+
+def computeRepoFingerprint(rootList):
+    """!Return a cheap fingerprint of the state of a set of repositories
+
+    The fingerprint includes the chain of repositories linked through "_parent" from each root,
+    and the modification time and size of the registries of those repositories. Root directory
+    modification times are not used, because writing outputs (including this cache) changes them.
+
+    @param[in] rootList     list of repository roots; None entries are ignored
+    """
+    fingerprint = []
+    for root in rootList:
+        if not root:
+            continue
+        for path in _getParentChain(os.path.abspath(root)):
+            fingerprint.append((path,))
+            for name in _REGISTRY_NAMES:
+                try:
+                    stat = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue
+                fingerprint.append((path, name, stat.st_mtime, stat.st_size))
+    return tuple(fingerprint)
+
+class DataRefCache(object):
+    """!Cache, in the output repository, of the data references computed for data ID arguments
+
+    Computing data references for a large data ID argument means checking the existence of every
+    dataset it matches, which can take minutes. This cache saves the data IDs (after casting)
+    and the data IDs of the existing data references, so that a later run with the same data ID
+    argument against the same repositories only has to ask the butler for the subset for each data ID.
+
+    Entries are keyed by dataset type, level, the data ID argument and a fingerprint
+    of the repositories (see computeRepoFingerprint), so adding data to a repository invalidates them.
+    Datasets added or removed without changing a registry (e.g. outputs of other tasks) are not noticed;
+    use --clobber-dataref-cache after such changes.
+    """
+    def __init__(self, cacheDir, rootList, refresh=False):
+        """!Construct a DataRefCache
+
+        @param[in] cacheDir     directory in which to save cache entries; created when needed
+        @param[in] rootList     list of repository roots (e.g. output, input and calib); None entries are ignored
+        @param[in] refresh      ignore existing entries (but replace them with new ones)?
+        """
+        self.cacheDir = cacheDir
+        self.refresh = bool(refresh)
+        self._fingerprint = computeRepoFingerprint(rootList)
+
+    def getKey(self, datasetType, level, idSpec):
+        """!Return the key for a data ID argument
+
+        @param[in] datasetType  dataset type
+        @param[in] level        level of dataset, for butler
+        @param[in] idSpec       description of the data IDs parsed from the command line, before casting,
+            as returned by DataIdContainer.getIdSpec
+        """
+        return hashlib.sha1(repr((datasetType, level, idSpec, self._fingerprint))).hexdigest()
+
+    def get(self, key):
+        """!Return the cached (dataIds, list of data reference data IDs), or None if not cached
+
+        @param[in] key      key returned by getKey
+        """
+        if self.refresh:
+            return None
+        try:
+            with open(self._getPath(key), "rb") as cacheFile:
+                return pickle.load(cacheFile)
+        except Exception:
+            return None
+
+    def put(self, key, dataIds, refDataIdList):
+        """!Save a cache entry
+
+        The entry is written to a temporary file and renamed, so concurrent readers and writers
+        never see a partial entry.
+
+        @param[in] key              key returned by getKey
+        @param[in] dataIds          data IDs after casting (DataIdContainer.dataIds)
+        @param[in] refDataIdList    list of data IDs of the existing data references
+        """
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError:
+                if not os.path.isdir(self.cacheDir):
+                    raise
+        fd, tempPath = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as cacheFile:
+                pickle.dump((dataIds, list(refDataIdList)), cacheFile, pickle.HIGHEST_PROTOCOL)
+            os.rename(tempPath, self._getPath(key))
+        except Exception:
+            os.remove(tempPath)
+            raise
+
+    def _getPath(self, key):
+        """Return the path of the file for a cache entry"""
+        return os.path.join(self.cacheDir, key + ".pickle")
@@ -0,0 +1,565 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Executors, which run a function on each target of a TaskRunner: in this process, in a local process pool,
+or in worker processes on other hosts that connect to this one over a socket.
+"""
+import collections
+import errno
+import functools
+import itertools
+import os
+import select
+import sys
+import threading
+import time
+import traceback
+import Queue
+
+from lsst.pex.logging import getDefaultLog
+
+__all__ = ["Executor", "SerialExecutor", "PoolExecutor", "SocketExecutor", "TargetFailedError",
+           "parseAddress", "getAuthKey", "runSocketWorker"]
+
+## Environment variable holding the secret key shared by a SocketExecutor and its workers
+AuthKeyEnvName = "PIPE_BASE_AUTHKEY"
+
+class TargetFailedError(RuntimeError):
+    """!Exception raised by an executor for a target that could not be completed (e.g. it timed out,
+    or the worker process running it died), if the executor has no onFailure function
+    """
+    pass
+
+class Executor(object):
+    """!Interface for running a function on each target of a TaskRunner
+
+    TaskRunner.runIter obtains an executor from TaskRunner.makeExecutor and passes every target
+    (as a tuple of (index, target)) to Executor.imapUnordered, then calls Executor.close and Executor.join
+    when the run ends, or Executor.terminate and Executor.join if it fails.
+
+    Executors that run targets in other processes (those for which inProcess is False) are constructed
+    with an initializer that each worker process calls once before running any target; TaskRunner
+    uses it to send the runner to each worker, and the function only receives the target.
+    Implementations:
+    - SerialExecutor: runs the targets in this process.
+    - PoolExecutor: runs the targets in a local multiprocessing.Pool.
+    - \ref targetPool.TargetPool "TargetPool": runs the targets in local worker processes, one at a time,
+      with a per-target time limit and speculative re-execution of stragglers.
+    - SocketExecutor: sends the targets to worker processes, on any host, that connect to a socket.
+    """
+    ## True if the function is called in this process (so it and the targets need not be picklable)
+    inProcess = False
+    ## True if the function is called on this host (so it may return data in local temporary files)
+    isLocal = True
+
+    def imapUnordered(self, function, iterable):
+        """!Call function on each item of iterable, yielding the results as they complete
+
+        @param[in] function     function to call on each item; exceptions it raises are re-raised here
+        @param[in] iterable     iterable of items; it is consumed lazily
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """!Stop accepting work; the workers exit once they are idle"""
+        pass
+
+    def terminate(self):
+        """!Stop the workers at once"""
+        pass
+
+    def join(self):
+        """!Wait for the workers to exit; call Executor.close or Executor.terminate first"""
+        pass
+
+class SerialExecutor(Executor):
+    """!Executor that calls the function on each target in turn, in this process
+    """
+    inProcess = True
+
+    def imapUnordered(self, function, iterable):
+        return itertools.imap(function, iterable)
+
+def _poolFunctionWrapper(function, arg):
+    """Wrapper around function to catch exceptions that don't inherit from Exception
+
+    Such exceptions aren't caught by multiprocessing, which causes the slave
+    process to crash and you end up hitting the timeout.
+    """
+    try:
+        return function(arg)
+    except Exception:
+        raise # No worries
+    except:
+        # Need to wrap the exception with something multiprocessing will recognise
+        cls, exc, tb = sys.exc_info()
+        log = getDefaultLog()
+        log.warn("Unhandled exception %s (%s):\n%s" % (cls.__name__, exc, traceback.format_exc()))
+        raise Exception("Unhandled exception: %s (%s)" % (cls.__name__, exc))
+
+def _runChunk(function, chunk):
+    """Call function on each element of a chunk of targets, returning the list of results"""
+    return [_poolFunctionWrapper(function, arg) for arg in chunk]
+
+def _makeChunks(iterable, chunksize):
+    """Generate lists of up to chunksize consecutive items from iterable, consuming it lazily"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+def _throttle(iterable, window, stopped):
+    """Generate items from iterable, acquiring the semaphore window before each one
+
+    Iteration ends early once the threading.Event stopped is set.
+    """
+    for item in iterable:
+        window.acquire()
+        if stopped.is_set():
+            return
+        yield item
+
+def _runPool(pool, timeout, function, iterable, chunksize=1, maxInFlight=None):
+    """Generator wrapper around pool.imap_unordered, to handle timeout and stream results
+
+    Results are yielded in the order in which they complete. The iterable is consumed lazily
+    (it may be a generator) and sent to the workers in lists of chunksize elements.
+    If maxInFlight is not None then at most that many elements (rounded up to a whole chunk)
+    are dispatched to the pool but not yet yielded, so memory use in the parent stays bounded.
+
+    The timeout (sec) applies to the whole run, as for map_async().get(timeout);
+    it is also required so as to trigger an immediate interrupt on the KeyboardInterrupt (Ctrl-C); see
+    http://stackoverflow.com/questions/1408356/keyboard-interrupts-with-pythons-multiprocessing-pool
+
+    Further wraps the function in _poolFunctionWrapper to catch exceptions
+    that don't inherit from Exception.
+    """
+    chunkIter = _makeChunks(iterable, chunksize)
+    window = None
+    stopped = threading.Event()
+    if maxInFlight is not None:
+        window = threading.Semaphore(max(1, -(-maxInFlight // chunksize)))
+        chunkIter = _throttle(chunkIter, window, stopped)
+    deadline = time.time() + timeout
+    resultIter = pool.imap_unordered(functools.partial(_runChunk, function), chunkIter)
+    try:
+        while True:
+            try:
+                resultChunk = resultIter.next(max(0, deadline - time.time()))
+            except StopIteration:
+                return
+            if window is not None:
+                window.release()
+            for result in resultChunk:
+                yield result
+    finally:
+        # unblock the pool's task handler thread, should it be waiting on the window
+        stopped.set()
+        if window is not None:
+            window.release()
+
+class PoolExecutor(Executor):
+    """!Executor that runs the targets in a local multiprocessing.Pool
+
+    Targets are sent to the workers in chunks, and results are yielded in the order in which they complete.
+    """
+    def __init__(self, processes, initializer=None, initargs=(), maxTargetsPerWorker=None, chunksize=1,
+                 maxInFlight=None, timeout=9999):
+        """!Construct a PoolExecutor
+
+        @param[in] processes        number of worker processes
+        @param[in] initializer      function called in each worker process when it starts, or None
+        @param[in] initargs         arguments for initializer
+        @param[in] maxTargetsPerWorker  number of chunks a worker runs before it exits and is replaced,
+            or None for no limit
+        @param[in] chunksize        number of targets sent to a worker at a time
+        @param[in] maxInFlight      maximum number of targets dispatched but whose results have not been
+            yielded (rounded up to a whole chunk), or None for no limit
+        @param[in] timeout          maximum wall time (sec) for the whole run; it is also needed for
+            KeyboardInterrupt to interrupt the run (see _runPool)
+        """
+        import multiprocessing
+        self._pool = multiprocessing.Pool(processes=processes, initializer=initializer, initargs=initargs,
+                                          maxtasksperchild=maxTargetsPerWorker)
+        self.chunksize = chunksize
+        self.maxInFlight = maxInFlight
+        self.timeout = timeout
+
+    def imapUnordered(self, function, iterable):
+        return _runPool(self._pool, self.timeout, function, iterable, chunksize=self.chunksize,
+                        maxInFlight=self.maxInFlight)
+
+    def close(self):
+        self._pool.close()
+
+    def terminate(self):
+        self._pool.terminate()
+
+    def join(self):
+        self._pool.join()
+
+def parseAddress(addressStr):
+    """!Parse a socket address of the form HOST:PORT (HOST may be omitted, for all interfaces)
+
+    @return a tuple of (host, port)
+    """
+    host, sep, port = addressStr.rpartition(":")
+    if not sep:
+        raise ValueError("Address %r is not of the form HOST:PORT" % (addressStr,))
+    return host, int(port)
+
+def getAuthKey():
+    """!Return the secret key shared by a SocketExecutor and its workers: the value of the environment
+    variable PIPE_BASE_AUTHKEY
+
+    @throw RuntimeError if PIPE_BASE_AUTHKEY is not set
+    """
+    authkey = os.environ.get(AuthKeyEnvName)
+    if not authkey:
+        raise RuntimeError("Set environment variable %s to a secret shared by the coordinator and its "
+                           "workers" % (AuthKeyEnvName,))
+    return authkey
+
+class _RemoteWorker(object):
+    """A connection to a worker of a SocketExecutor, and the target it is running"""
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        ## the function the worker has been set up to run, or None
+        self.function = None
+        ## the item being run, or None if idle
+        self.item = None
+        ## time at which the current item was sent to this worker
+        self.startTime = None
+
+class SocketExecutor(Executor):
+    """!Executor that sends targets to worker processes, on this or other hosts, that connect to a socket
+
+    The executor listens on a socket, and worker processes started with runSocketWorker (e.g. by running
+    `python -m lsst.pipe.base.executor HOST:PORT` on each host) connect to it; workers may connect
+    at any time during the run. Each connection is authenticated with the secret key given to both
+    (see getAuthKey) by multiprocessing.connection, which also pickles the messages.
+
+    Each worker receives the function and the initializer once, then one target at a time, and sends back
+    the result. The function, initializer, targets and results must be picklable, and the modules that
+    define them (such as that of the task) must be importable by the workers. Targets are normally data
+    references, so every worker must see the repositories at the same paths (e.g. on a shared file system).
+    If a worker disconnects while running a target, the target is sent to another worker,
+    up to maxAttempts times in all.
+
+    Only the coordinator (the process using this executor) runs TaskRunner.precall,
+    so the config and schemas are written once, before any target is sent.
+    """
+    isLocal = False
+
+    def __init__(self, address, authkey, initializer=None, initargs=(), maxAttempts=2, onFailure=None,
+                 log=None):
+        """!Construct a SocketExecutor and start listening for workers
+
+        @param[in] address      address (host, port) on which to listen; port 0 picks a free port
+        @param[in] authkey      secret key (str) shared with the workers
+        @param[in] initializer  function called by each worker before it runs its first target, or None
+        @param[in] initargs     arguments for initializer
+        @param[in] maxAttempts  maximum number of times a target is sent to a worker, if workers disconnect
+            while running it
+        @param[in] onFailure    function called as onFailure(item, reason, wallTime) for an item that could
+            not be completed, returning the value to yield for it; if None then TargetFailedError is raised
+        @param[in] log          log (an lsst.pex.logging.Log) for reporting workers and failed targets, or None
+        """
+        from multiprocessing.connection import Listener
+        self._listener = Listener(tuple(address), authkey=authkey)
+        ## the address (host, port) on which this executor listens
+        self.address = self._listener.address
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.maxAttempts = max(1, int(maxAttempts))
+        self.onFailure = onFailure
+        self.log = log
+        self._workerList = []
+        self._closed = False
+        self._newConnQueue = Queue.Queue()
+        # the accept thread writes a byte to this pipe for each new connection, to wake up imapUnordered
+        self._wakeReadFd, self._wakeWriteFd = os.pipe()
+        self._acceptThread = threading.Thread(target=self._acceptWorkers, name="SocketExecutor.accept")
+        self._acceptThread.daemon = True
+        self._acceptThread.start()
+        self._log("info", "Listening for workers on %s:%d; start each with: python -m lsst.pipe.base.executor "
+                  "%s:%d" % (self.address + self.address))
+
+    def imapUnordered(self, function, iterable):
+        iterator = iter(iterable)
+        exhausted = False
+        retryQueue = collections.deque() # (item, number of attempts so far, start time) to send again
+        attemptDict = {} # id of item: (number of attempts so far, time first sent)
+        isWaitingLogged = False
+        try:
+            while True:
+                self._addNewWorkers()
+                for worker in list(self._workerList):
+                    if worker.item is not None:
+                        continue
+                    if retryQueue:
+                        item = retryQueue.popleft()
+                    elif not exhausted:
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        attemptDict[id(item)] = (0, time.time())
+                    else:
+                        break
+                    numAttempts, startTime = attemptDict[id(item)]
+                    attemptDict[id(item)] = (numAttempts + 1, startTime)
+                    if not self._dispatch(worker, function, item):
+                        retryQueue.appendleft(item)
+                        attemptDict[id(item)] = (numAttempts, startTime)
+                busyList = [worker for worker in self._workerList if worker.item is not None]
+                if exhausted and not retryQueue and not busyList:
+                    return
+                if not self._workerList and not isWaitingLogged:
+                    self._log("info", "Waiting for workers to connect to %s:%d" % self.address)
+                    isWaitingLogged = True
+
+                readyList = self._wait([worker.conn for worker in busyList])
+                for worker in busyList:
+                    if worker.conn not in readyList:
+                        continue
+                    item = worker.item
+                    try:
+                        reply = worker.conn.recv()
+                    except (EOFError, IOError):
+                        reply = None
+                    if reply is None:
+                        self._removeWorker(worker)
+                        numAttempts, startTime = attemptDict[id(item)]
+                        if numAttempts < self.maxAttempts:
+                            self._log("warn", "Worker %s disconnected while running a target; sending it to "
+                                      "another worker" % (worker.name,))
+                            retryQueue.append(item)
+                            continue
+                        del attemptDict[id(item)]
+                        reason = "was abandoned after %d workers disconnected while running it" % (numAttempts,)
+                        self._log("warn", "Target %s" % (reason,))
+                        if self.onFailure is None:
+                            raise TargetFailedError("Target %s" % (reason,))
+                        yield self.onFailure(item, reason, time.time() - startTime)
+                        continue
+                    worker.item = None
+                    del attemptDict[id(item)]
+                    if not reply[0]:
+                        self._log("warn", "Target failed in worker %s:\n%s" % (worker.name, reply[2]))
+                        raise reply[1]
+                    yield reply[1]
+        finally:
+            # workers running abandoned targets cannot be stopped, so disconnect them
+            for worker in list(self._workerList):
+                if worker.item is not None:
+                    self._removeWorker(worker)
+
+    def close(self):
+        """!Tell the workers to exit once they are idle, and stop listening"""
+        if self._closed:
+            return
+        self._closed = True
+        self._addNewWorkers()
+        for worker in list(self._workerList):
+            try:
+                worker.conn.send(None)
+            except Exception:
+                pass
+            self._removeWorker(worker)
+        self._stopListening()
+
+    def terminate(self):
+        """!Disconnect the workers (each exits once its current target is done), and stop listening"""
+        if self._closed:
+            return
+        self._closed = True
+        self._addNewWorkers()
+        for worker in list(self._workerList):
+            self._removeWorker(worker)
+        self._stopListening()
+
+    def join(self):
+        self._acceptThread.join()
+        for fd in (self._wakeReadFd, self._wakeWriteFd):
+            os.close(fd)
+        self._wakeReadFd = self._wakeWriteFd = None
+
+    def _acceptWorkers(self):
+        """Accept and authenticate connections from workers, until the executor is closed"""
+        from multiprocessing import AuthenticationError
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+            except (AuthenticationError, EOFError, IOError, OSError), e:
+                if not self._closed:
+                    self._log("warn", "Rejected a connection: %s" % (e,))
+                continue
+            if self._closed:
+                conn.close()
+                break
+            self._newConnQueue.put((conn, "%s:%s" % self._listener.last_accepted))
+            os.write(self._wakeWriteFd, "x")
+
+    def _stopListening(self):
+        """Close the listener, waking up the accept thread with a connection of our own"""
+        import socket
+        host, port = self.address
+        if host in ("", "0.0.0.0"):
+            host = "127.0.0.1"
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+        except Exception:
+            pass
+        self._listener.close()
+
+    def _addNewWorkers(self):
+        """Add the workers that have connected since the last call"""
+        while True:
+            try:
+                conn, name = self._newConnQueue.get_nowait()
+            except Queue.Empty:
+                return
+            if self._closed:
+                conn.close()
+                continue
+            self._workerList.append(_RemoteWorker(conn, name))
+            self._log("info", "Worker %s connected; %d workers" % (name, len(self._workerList)))
+
+    def _dispatch(self, worker, function, item):
+        """Send an item (and, first, the function) to an idle worker; return False if the worker is gone"""
+        try:
+            if worker.function is not function:
+                worker.conn.send(("setup", function, self.initializer, self.initargs))
+                worker.function = function
+            worker.conn.send(("run", item))
+        except (EOFError, IOError, OSError):
+            self._removeWorker(worker)
+            return False
+        worker.item = item
+        worker.startTime = time.time()
+        return True
+
+    def _removeWorker(self, worker):
+        """Close the connection to a worker and forget it"""
+        worker.conn.close()
+        if worker in self._workerList:
+            self._workerList.remove(worker)
+            if not self._closed:
+                self._log("info", "Worker %s disconnected; %d workers" % (worker.name, len(self._workerList)))
+
+    def _wait(self, connList):
+        """Wait until a connection in connList is readable or a worker connects; return the readable ones"""
+        fdList = [conn.fileno() for conn in connList] + [self._wakeReadFd]
+        while True:
+            try:
+                readyFdList = select.select(fdList, [], [])[0]
+            except (OSError, select.error), e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            break
+        if self._wakeReadFd in readyFdList:
+            os.read(self._wakeReadFd, 4096)
+        return [conn for conn in connList if conn.fileno() in readyFdList]
+
+    def _log(self, level, msg):
+        """Log a message, if this executor has a log"""
+        if self.log is not None:
+            getattr(self.log, level)(msg)
+
+def runSocketWorker(address, authkey):
+    """!Connect to a SocketExecutor and run the targets it sends, until it closes the connection
+
+    @param[in] address  address (host, port) of the SocketExecutor
+    @param[in] authkey  secret key (str) shared with the SocketExecutor
+
+    @return the number of targets run
+    """
+    from multiprocessing.connection import Client
+    conn = Client(tuple(address), authkey=authkey)
+    function = None
+    numTargets = 0
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, IOError):
+                break
+            except Exception, e:
+                # e.g. the module defining the function or target cannot be imported here
+                conn.send((False, e, traceback.format_exc()))
+                break
+            if message is None:
+                break
+            if message[0] == "setup":
+                function, initializer, initargs = message[1:]
+                if initializer is not None:
+                    initializer(*initargs)
+                continue
+            try:
+                reply = (True, function(message[1]))
+            except Exception, e:
+                reply = (False, e, traceback.format_exc())
+            try:
+                conn.send(reply)
+            except (EOFError, IOError):
+                break
+            except Exception, e:
+                # the result or exception cannot be pickled
+                conn.send((False, RuntimeError("Cannot return result: %s" % (e,)), traceback.format_exc()))
+            numTargets += 1
+    finally:
+        conn.close()
+    return numTargets
+
+def main(argv=None):
+    """!Run worker processes for a command-line task run with --executor=socket
+
+    Usage: python -m lsst.pipe.base.executor [-j N] HOST:PORT
+    with the secret key in environment variable PIPE_BASE_AUTHKEY.
+    """
+    import argparse
+    import multiprocessing
+    parser = argparse.ArgumentParser(description="Run targets sent by a command-line task run with "
+                                     "--executor=socket; the secret key is read from $%s" % (AuthKeyEnvName,))
+    parser.add_argument("address", help="HOST:PORT on which the task listens (see its --listen argument)")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="number of worker processes to run")
+    args = parser.parse_args(argv)
+    address = parseAddress(args.address)
+    authkey = getAuthKey()
+    if args.processes <= 1:
+        runSocketWorker(address, authkey)
+        return
+    processList = [multiprocessing.Process(target=runSocketWorker, args=(address, authkey))
+                   for i in range(args.processes)]
+    for process in processList:
+        process.start()
+    for process in processList:
+        process.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Answer dataset existence queries from directory listings.
+"""
+import collections
+import os
+import re
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__all__ = ["ExistenceIndex"]
+
+def _listDirectory(dirPath):
+    """Return the set of names of the entries in a directory, or an empty set if it cannot be listed"""
+    try:
+        if scandir is not None:
+            return frozenset(entry.name for entry in scandir(dirPath))
+        return frozenset(os.listdir(dirPath))
+    except OSError:
+        return frozenset()
+
+def _getParentChain(root):
+    """Return a list of root and the repositories it links to through "_parent", in search order"""
+    chain = []
+    while root is not None and root not in chain:
+        chain.append(root)
+        parent = os.path.join(root, "_parent")
+        root = os.path.realpath(parent) if os.path.exists(parent) else None
+    return chain
+
+class ExistenceIndex(object):
+    """!Answer butler dataset existence queries by listing each directory once, instead of a stat per file
+
+    Checking existence with butler.datasetExists costs at least one filesystem metadata call per dataset,
+    which is slow on shared filesystems such as NFS and GPFS when there are many data IDs. An ExistenceIndex
+    instead asks the butler's mapper where each dataset would be, lists the directory that would contain it
+    the first time that directory is needed, and answers all queries about files in that directory
+    from memory.
+
+    A file is searched for under the repository root it maps to and then through the chain of "_parent"
+    links from that root, as the butler does; the roots are the input, calib and output repositories
+    determined by the argument parser. The listings are not refreshed, so the index should only be used
+    for a short time (e.g. while the argument parser computes data references).
+
+    The index is thread-safe.
+    """
+    def __init__(self, butler, rootList):
+        """!Construct an ExistenceIndex
+
+        @param[in] butler       data butler (a \ref lsst.daf.persistence.butler.Butler
+            "lsst.daf.persistence.Butler")
+        @param[in] rootList     list of repository roots (e.g. output, input and calib); None entries are ignored
+        """
+        self.butler = butler
+        self._rootChainList = [_getParentChain(os.path.abspath(root)) for root in rootList if root]
+        self._dirDict = {} # directory path: frozenset of entry names
+        self._existingPathDict = collections.defaultdict(set) # dataset type: set of existing paths found
+        self._lock = threading.Lock()
+
+    @property
+    def numListings(self):
+        """!Number of directories that have been listed"""
+        return len(self._dirDict)
+
+    def getExistingPaths(self, datasetType):
+        """!Return the set of paths found to exist so far for the specified dataset type"""
+        with self._lock:
+            return set(self._existingPathDict[datasetType])
+
+    def datasetExists(self, datasetType, dataId):
+        """!Return True if all files of a dataset exist, False if not, or None if the index cannot tell
+
+        If None is returned (e.g. because the mapper cannot compute the location) the caller should
+        use butler.datasetExists instead.
+
+        @param[in] datasetType  dataset type (a str)
+        @param[in] dataId       data ID (a dict)
+        """
+        pathList = self._getPathList(datasetType, dataId)
+        if not pathList:
+            return None
+        foundPathList = []
+        for path in pathList:
+            foundPath = self._findPath(path)
+            if foundPath is None:
+                return False
+            foundPathList.append(foundPath)
+        with self._lock:
+            self._existingPathDict[datasetType].update(foundPathList)
+        return True
+
+    def _getPathList(self, datasetType, dataId):
+        """Return the list of file paths of a dataset, without searching parent repositories, or None"""
+        try:
+            # write=True asks the mapper not to search for the file itself
+            location = self.butler.mapper.map(datasetType, dataId, write=True)
+            pathList = location.getLocations()
+        except Exception:
+            return None
+        # strip FITS extension specifiers such as "foo.fits[1]"
+        return [re.sub(r"\[[^\]]*\]$", "", path) for path in pathList]
+
+    def _findPath(self, path):
+        """Return the path at which a file is found, searching parent repositories, or None if not found"""
+        path = os.path.abspath(path)
+        for rootChain in self._rootChainList:
+            relPath = os.path.relpath(path, rootChain[0])
+            if relPath.startswith(os.pardir):
+                continue
+            for root in rootChain:
+                candidatePath = os.path.join(root, relPath)
+                if self._fileExists(candidatePath):
+                    return candidatePath
+            return None
+        return path if self._fileExists(path) else None
+
+    def _fileExists(self, path):
+        """Return True if path is listed in its directory, listing the directory if not yet done"""
+        dirPath, name = os.path.split(path)
+        names = self._dirDict.get(dirPath)
+        if names is None:
+            names = _listDirectory(dirPath)
+            with self._lock:
+                names = self._dirDict.setdefault(dirPath, names)
+        return name in names
@@ -0,0 +1,213 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Opt-in measurement of the memory allocated by each timed block of a task.
+"""
+import contextlib
+import os
+
+from lsst.pex.logging import getDefaultLog
+
+__all__ = ["MemoryTracer", "getMemoryTracer", "setMemoryTracer", "traceMemory"]
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python < 3.4, unless patched with pytracemalloc
+    tracemalloc = None
+
+class MemoryTracer(object):
+    """!Measure the net and peak memory allocated by each timed method and block of code of a task
+
+    When a tracer is installed with setMemoryTracer, \ref timer.timeMethod "timeMethod" and Task.timer
+    add these items to the task's metadata:
+    - \<name>MemoryNet: memory allocated (bytes) by the method or block, less memory freed by it
+    - \<name>MemoryPeak: peak memory (bytes) while it ran, relative to the memory in use when it started
+    - \<name>MemoryTopSites: (if numTopSites > 0) descriptions of the source lines that allocated the most
+        memory that was still allocated when it ended, as strings "\<file>:\<line> size=\<bytes> count=\<blocks>"
+    where \<name> is the method or block name. In the full metadata these are under the task's full name,
+    so the subtask that caused a peak can be identified. Nested blocks are measured independently:
+    the peak of an outer block includes the peaks of the blocks it contains.
+
+    Python memory is traced with tracemalloc if it is available. Otherwise (e.g. Python 2 without
+    pytracemalloc) the resident set size of the process is measured, using the Linux /proc/self/status
+    and /proc/self/clear_refs files to read and reset the peak; this includes memory allocated by
+    C++ code, but allocation sites are not available. If tracemalloc cannot reset its peak
+    (tracemalloc.reset_peak is new in Python 3.9, and pytracemalloc lacks it) then \<name>MemoryPeak
+    is the peak resident set size, measured as above. If the peak cannot be reset by either means
+    (e.g. not on Linux) then \<name>MemoryPeak is omitted, and a warning is logged when the tracer is made.
+
+    Tracing slows the code considerably, especially with numTopSites > 0, as a snapshot of all
+    allocations is taken at the start and end of each block; it is meant for diagnosing memory use.
+    """
+    def __init__(self, numTopSites=5, numFrames=1):
+        """!Construct a MemoryTracer and start tracing memory allocations (if using tracemalloc)
+
+        @param[in] numTopSites  number of allocation sites to report for each block (if using tracemalloc)
+        @param[in] numFrames    number of stack frames to record for each allocation (if using tracemalloc)
+        """
+        ## ID of the process that constructed this tracer; a forked child process must make its own tracer
+        self.pid = os.getpid()
+        self.numTopSites = int(numTopSites) if tracemalloc is not None else 0
+        self.useTracemalloc = tracemalloc is not None
+        self._startedTracemalloc = False
+        if self.useTracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(numFrames)
+                self._startedTracemalloc = True
+        # peaks are measured with tracemalloc if it can reset its peak, else from the resident set size
+        self._peakFromRss = not (self.useTracemalloc and hasattr(tracemalloc, "reset_peak"))
+        self._canResetPeak = _resetPeakRss() if self._peakFromRss else True
+        if not self._canResetPeak:
+            getDefaultLog().warn("MemoryTracer cannot reset the peak memory use of this process, "
+                                 "so <name>MemoryPeak will not be added to task metadata")
+        # list of [start memory, start memory as measured for the peak, peak memory] of the open blocks,
+        # outermost first
+        self._blockStack = []
+
+    def stop(self):
+        """!Stop tracing memory allocations with tracemalloc, if this tracer started it"""
+        if self._startedTracemalloc:
+            tracemalloc.stop()
+            self._startedTracemalloc = False
+
+    def _readMemory(self):
+        """Return (current, current as measured for the peak, peak) memory use (bytes)"""
+        if self.useTracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            if not self._peakFromRss:
+                return current, current, peak
+        rssCurrent, rssPeak = _readRss()
+        if not self.useTracemalloc:
+            current = rssCurrent
+        return current, rssCurrent, rssPeak
+
+    def _resetPeak(self):
+        if self._peakFromRss:
+            _resetPeakRss()
+        else:
+            tracemalloc.reset_peak()
+
+    def _updatePeaks(self):
+        """Update the peak memory of all open blocks, then reset the peak so the next block starts afresh
+
+        @return (current, current as measured for the peak) memory use (bytes)
+        """
+        current, peakCurrent, peak = self._readMemory()
+        for block in self._blockStack:
+            block[2] = max(block[2], peak)
+        if self._canResetPeak:
+            self._resetPeak()
+        return current, peakCurrent
+
+    @contextlib.contextmanager
+    def measure(self, obj, name):
+        """!Context manager that measures the memory allocated by a block of code and adds it to metadata
+
+        @param[in,out] obj  a \ref task.Task "Task", or any object with a metadata attribute
+            (an lsst.daf.base.PropertyList or other object with add(name, value) method)
+        @param[in] name     name of method or block of code; the prefix of the metadata items
+        """
+        startSnapshot = _takeSnapshot() if self.numTopSites > 0 else None
+        current, peakCurrent = self._updatePeaks()
+        block = [current, peakCurrent, peakCurrent]
+        self._blockStack.append(block)
+        try:
+            yield
+        finally:
+            endCurrent = self._updatePeaks()[0]
+            self._blockStack.pop()
+            startMemory, peakStartMemory, peakMemory = block
+            obj.metadata.add(name = name + "MemoryNet", value = long(endCurrent - startMemory))
+            if self._canResetPeak:
+                obj.metadata.add(name = name + "MemoryPeak", value = long(peakMemory - peakStartMemory))
+            if startSnapshot is not None:
+                statList = [stat for stat in _takeSnapshot().compare_to(startSnapshot, "lineno")
+                            if stat.size_diff > 0]
+                for stat in statList[:self.numTopSites]:
+                    frame = stat.traceback[0]
+                    obj.metadata.add(name = name + "MemoryTopSites",
+                                     value = "%s:%d size=%d count=%d" %
+                                     (frame.filename, frame.lineno, stat.size_diff, stat.count_diff))
+
+def _takeSnapshot():
+    """Return a tracemalloc snapshot, excluding memory allocated by tracemalloc itself"""
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+def _readRss():
+    """Return (current, peak) resident set size (bytes) of this process, from /proc/self/status"""
+    valueDict = {}
+    with open("/proc/self/status") as statusFile:
+        for line in statusFile:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key, value = line.split(":", 1)
+                valueDict[key] = long(value.split()[0]) * 1024 # value is in kB
+    return valueDict.get("VmRSS", 0), valueDict.get("VmHWM", 0)
+
+def _resetPeakRss():
+    """Reset the peak resident set size of this process to the current value; return True if successful"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clearRefsFile:
+            clearRefsFile.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+## The memory tracer installed in this process, or None
+_memoryTracer = None
+
+def getMemoryTracer():
+    """!Return the MemoryTracer installed in this process, or None if memory tracing is disabled"""
+    return _memoryTracer
+
+def setMemoryTracer(tracer):
+    """!Install a MemoryTracer in this process, or disable memory tracing if tracer is None
+
+    @return the previously installed tracer, or None
+    """
+    global _memoryTracer
+    oldTracer, _memoryTracer = _memoryTracer, tracer
+    return oldTracer
+
+class _NullContext(object):
+    """A context manager that does nothing, used when no memory tracer is installed"""
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+_nullContext = _NullContext()
+
+def traceMemory(obj, name):
+    """!Return a context manager that measures the memory allocated by a block of code of a task,
+    if a MemoryTracer is installed
+
+    @param[in,out] obj  a \ref task.Task "Task"; see MemoryTracer.measure
+    @param[in] name     name of method or block of code
+
+    If no memory tracer is installed this returns a context manager that does nothing.
+    """
+    tracer = _memoryTracer
+    if tracer is None:
+        return _nullContext
+    return tracer.measure(obj, name)
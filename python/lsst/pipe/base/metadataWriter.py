@@ -0,0 +1,276 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Persistence of task metadata: synchronous, asynchronous (batched in a background thread) or consolidated.
+"""
+import json
+import os
+import Queue
+import threading
+
+from lsst.pex.logging import getDefaultLog
+
+__all__ = ["MetadataWriter", "ButlerMetadataWriter", "SqliteMetadataWriter", "AsyncMetadataWriter",
+           "getMetadataWriter", "setMetadataWriter"]
+
+class MetadataWriter(object):
+    """!Base class for objects that persist the metadata of each target processed by a CmdLineTask
+
+    CmdLineTask.writeMetadata uses the writer installed with setMetadataWriter, if any,
+    instead of putting the metadata with the data butler itself.
+    """
+    ## May writeBatch be called from a thread other than the one that constructed the data references?
+    ## (not if it uses the data butler, whose registry is bound to the thread that opened it)
+    isThreadSafe = True
+
+    def __init__(self, log=None):
+        """!Construct a MetadataWriter
+
+        @param[in] log      log for reporting failures (an lsst.pex.logging.Log); if None, the default log
+        """
+        self.log = log if log is not None else getDefaultLog()
+        ## ID of the process that constructed this writer; a forked child process must make its own writer
+        self.pid = os.getpid()
+        ## multiprocessing.util.Finalize that closes this writer when the process exits, or None
+        self.finalizer = None
+
+    def write(self, dataRef, metadataName, metadata):
+        """!Persist (or queue for persisting) the metadata of one target
+
+        @param[in] dataRef          data reference of the target
+        @param[in] metadataName     dataset type of the metadata
+        @param[in] metadata         metadata to persist (an lsst.daf.base.PropertySet), which must not be
+            modified afterwards, as it may be persisted later
+        """
+        self.writeBatch([(dataRef, metadataName, metadata)])
+
+    def writeBatch(self, itemList):
+        """!Persist the metadata of several targets
+
+        Failures are logged and do not prevent the other items from being persisted.
+
+        @param[in] itemList     list of (dataRef, metadataName, metadata); see write
+        """
+        raise NotImplementedError("Subclasses must implement writeBatch")
+
+    def flush(self):
+        """!Wait until all metadata passed to write has been persisted"""
+        pass
+
+    def close(self):
+        """!Flush and release any resources; the writer may not be used afterwards"""
+        self.flush()
+
+    def _logFailure(self, dataRef, e):
+        self.log.warn("Could not persist metadata for dataId=%s: %s" % (dataRef.dataId, e,))
+
+class ButlerMetadataWriter(MetadataWriter):
+    """!Persist metadata with the data butler, one dataset per target (the default behavior)"""
+    isThreadSafe = False
+
+    def writeBatch(self, itemList):
+        for dataRef, metadataName, metadata in itemList:
+            try:
+                dataRef.put(metadata, metadataName)
+            except Exception, e:
+                self._logFailure(dataRef, e)
+
+class SqliteMetadataWriter(MetadataWriter):
+    """!Persist the metadata of all targets of a run in one SQLite database, instead of one file per target
+
+    The database has one table, "metadata", with one row per metadata item and these columns:
+    - datasetType: the dataset type of the metadata, e.g. "processCcd_metadata"
+    - dataId: the data ID, as a JSON object with sorted keys
+    - name: the full name of the item, e.g. "processCcd:calibrate.runEndCpuTime"
+    - value: the values of the item, as a JSON array
+
+    Metadata for a target that is already in the database replaces it. Several processes may write
+    to the same database; each batch is written in one transaction, and concurrent writers wait for
+    each other. For best performance wrap this writer in an AsyncMetadataWriter, which batches writes.
+    """
+    def __init__(self, fileName, log=None, timeout=600):
+        """!Construct a SqliteMetadataWriter
+
+        @param[in] fileName     name of SQLite database file; it and its directory are created if necessary
+        @param[in] log          log for reporting failures; if None, the default log
+        @param[in] timeout      maximum time (sec) to wait for other processes writing the database
+        """
+        MetadataWriter.__init__(self, log=log)
+        self.fileName = fileName
+        self.timeout = timeout
+        self._connection = None
+
+    def _connect(self):
+        """Return the connection to the database, connecting and making the table if necessary"""
+        if self._connection is None:
+            import sqlite3
+            dirName = os.path.dirname(self.fileName)
+            if dirName and not os.path.isdir(dirName):
+                try:
+                    os.makedirs(dirName)
+                except OSError:
+                    if not os.path.isdir(dirName): # another process may have made it
+                        raise
+            connection = sqlite3.connect(self.fileName, timeout=self.timeout, check_same_thread=False)
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS metadata "
+                                   "(datasetType TEXT, dataId TEXT, name TEXT, value TEXT)")
+                connection.execute("CREATE INDEX IF NOT EXISTS metadata_target "
+                                   "ON metadata (datasetType, dataId)")
+            self._connection = connection
+        return self._connection
+
+    def writeBatch(self, itemList):
+        rowList = []
+        targetList = []
+        for dataRef, metadataName, metadata in itemList:
+            try:
+                dataIdStr = json.dumps(dict(dataRef.dataId), sort_keys=True, default=str)
+                rowList += [(metadataName, dataIdStr, name, json.dumps(valueList, default=str))
+                            for name, valueList in _iterItems(metadata)]
+                targetList.append((metadataName, dataIdStr))
+            except Exception, e:
+                self._logFailure(dataRef, e)
+        if not targetList:
+            return
+        try:
+            connection = self._connect()
+            with connection:
+                connection.executemany("DELETE FROM metadata WHERE datasetType = ? AND dataId = ?", targetList)
+                connection.executemany("INSERT INTO metadata VALUES (?, ?, ?, ?)", rowList)
+        except Exception, e:
+            self.log.warn("Could not persist metadata for %d targets to %s: %s" %
+                          (len(targetList), self.fileName, e))
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def _iterItems(metadata, prefix=""):
+    """Iterate over (full name, list of values) of all items of a PropertySet, recursively"""
+    for name in metadata.names():
+        fullName = prefix + name
+        if metadata.isPropertySetPtr(name):
+            for item in _iterItems(metadata.getPropertySet(name), fullName + "."):
+                yield item
+        else:
+            yield fullName, list(metadata.getArray(name))
+
+class AsyncMetadataWriter(MetadataWriter):
+    """!Persist metadata in batches, in a background thread if possible, using another MetadataWriter
+
+    write queues the metadata and returns immediately, so the task can go on to the next target while
+    the metadata is persisted. If the wrapped writer is thread-safe (see MetadataWriter.isThreadSafe)
+    a background thread passes everything queued since its last write (up to maxBatchSize items)
+    to the wrapped writer's writeBatch in one call. Otherwise (e.g. for a ButlerMetadataWriter) the batches
+    are written in the calling thread, by write when maxBatchSize items are pending, and by flush.
+
+    Call flush before relying on the metadata having been persisted (e.g. before reporting a target
+    as done): metadata still queued is lost if the process is killed.
+    """
+    def __init__(self, writer, maxBatchSize=100, maxQueueSize=1000):
+        """!Construct an AsyncMetadataWriter
+
+        @param[in] writer       the MetadataWriter that persists the metadata
+        @param[in] maxBatchSize maximum number of targets to pass to writer.writeBatch at once
+        @param[in] maxQueueSize maximum number of targets whose metadata may be queued;
+            write blocks while the queue is full
+        """
+        MetadataWriter.__init__(self, log=writer.log)
+        self.writer = writer
+        self.maxBatchSize = int(maxBatchSize)
+        self._queue = Queue.Queue(maxsize=maxQueueSize)
+        self._thread = None
+        self._pendingList = [] # items to write in the calling thread, if writer is not thread-safe
+
+    def write(self, dataRef, metadataName, metadata):
+        if not self.writer.isThreadSafe:
+            self._pendingList.append((dataRef, metadataName, metadata))
+            if len(self._pendingList) >= self.maxBatchSize:
+                self._writePending()
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="AsyncMetadataWriter")
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((dataRef, metadataName, metadata))
+
+    def writeBatch(self, itemList):
+        for item in itemList:
+            self.write(*item)
+
+    def _run(self):
+        """Persist queued metadata in batches until None is dequeued"""
+        isDone = False
+        while not isDone:
+            itemList = [self._queue.get()]
+            while len(itemList) < self.maxBatchSize:
+                try:
+                    itemList.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            isDone = itemList[-1] is None
+            try:
+                self.writer.writeBatch([item for item in itemList if item is not None])
+            except Exception, e:
+                self.log.warn("Could not persist metadata: %s" % (e,))
+            finally:
+                for item in itemList:
+                    self._queue.task_done()
+
+    def _writePending(self):
+        """Persist the items pending in the calling thread"""
+        itemList, self._pendingList = self._pendingList, []
+        if itemList:
+            try:
+                self.writer.writeBatch(itemList)
+            except Exception, e:
+                self.log.warn("Could not persist metadata: %s" % (e,))
+
+    def flush(self):
+        self._queue.join()
+        self._writePending()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._writePending()
+        self.writer.close()
+
+## The metadata writer installed in this process, or None
+_metadataWriter = None
+
+def getMetadataWriter():
+    """!Return the MetadataWriter installed in this process, or None if metadata is put directly"""
+    return _metadataWriter
+
+def setMetadataWriter(writer):
+    """!Install a MetadataWriter in this process, or None to put metadata with the butler directly
+
+    @return the previously installed writer, or None
+    """
+    global _metadataWriter
+    oldWriter, _metadataWriter = _metadataWriter, writer
+    return oldWriter
@@ -0,0 +1,222 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Profiling of the targets run by each process of a TaskRunner: deterministic (cProfile) or sampling.
+"""
+import os
+import re
+import signal
+
+__all__ = ["SampleProfiler", "ProcessProfiler", "getProcessProfiler", "removeProcessProfiles",
+           "finishProcessProfiles"]
+
+## Profiling modes supported by ProcessProfiler
+ProfileModes = ("cprofile", "sample")
+
+class SampleProfiler(object):
+    """!Statistical profiler that samples the Python stack of the main thread on a CPU-time timer
+
+    While enabled, a SIGPROF signal is delivered every `interval` seconds of CPU time used by this process,
+    and the signal handler counts the stack of the code that was interrupted. The overhead is a small
+    constant per sample, regardless of how many functions are called, so hot loops are not distorted
+    as they are by cProfile.
+
+    Stacks are written in "collapsed" format: one line per distinct stack, listing its frames from the
+    outermost to the innermost separated by semicolons, followed by a space and the number of samples.
+    This is the input format of flame graph tools such as flamegraph.pl and speedscope.
+
+    @warning Only the main thread is sampled, and only one SampleProfiler may be enabled at a time,
+    as it replaces the handler for SIGPROF.
+    """
+    def __init__(self, interval=0.005):
+        """!Construct a SampleProfiler
+
+        @param[in] interval     sampling interval (sec of CPU time)
+        """
+        self.interval = float(interval)
+        self._countDict = {} # dict of tuple of code objects (outermost first): number of samples
+        self._oldHandler = None
+
+    def enable(self):
+        """!Start sampling; must be called from the main thread"""
+        self._oldHandler = signal.signal(signal.SIGPROF, self._handleSignal)
+        # restart system calls interrupted by a sample, rather than failing them with EINTR
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        """!Stop sampling"""
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._oldHandler or signal.SIG_DFL)
+        self._oldHandler = None
+
+    def _handleSignal(self, signum, frame):
+        """Count the stack of the interrupted frame"""
+        codeList = []
+        while frame is not None:
+            codeList.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(reversed(codeList))
+        self._countDict[stack] = self._countDict.get(stack, 0) + 1
+
+    def getCounts(self):
+        """!Return a dict of collapsed stack (a str): number of samples"""
+        countDict = {}
+        for stack, count in self._countDict.iteritems():
+            collapsedStack = ";".join(_formatCode(code) for code in stack)
+            countDict[collapsedStack] = countDict.get(collapsedStack, 0) + count
+        return countDict
+
+    def dump_stats(self, fileName):
+        """!Write the samples to a file in collapsed stack format
+
+        This has the same name as cProfile.Profile.dump_stats, so the two profilers are interchangeable.
+        """
+        writeCollapsed(self.getCounts(), fileName)
+
+def _formatCode(code):
+    """Format a code object as a frame of a collapsed stack"""
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename).replace(";", "_"),
+                           code.co_firstlineno)
+
+def readCollapsed(fileName):
+    """!Read a file of collapsed stacks, returning a dict of collapsed stack: number of samples"""
+    countDict = {}
+    with open(fileName) as inFile:
+        for line in inFile:
+            collapsedStack, sep, count = line.rstrip("\n").rpartition(" ")
+            if sep:
+                countDict[collapsedStack] = countDict.get(collapsedStack, 0) + int(count)
+    return countDict
+
+def writeCollapsed(countDict, fileName):
+    """!Write a dict of collapsed stack: number of samples to a file, most frequent stack first"""
+    with open(fileName, "w") as outFile:
+        for collapsedStack, count in sorted(countDict.iteritems(), key=lambda item: (-item[1], item[0])):
+            outFile.write("%s %d\n" % (collapsedStack, count))
+
+class ProcessProfiler(object):
+    """!Profile the targets run by one process, and write the results to a file for that process
+
+    The profile accumulates over all targets that the process runs (see start and stop), and is written to
+    \<fileName>.\<pid> by dump, which is called automatically when the process exits if the profiler was
+    made by getProcessProfiler. finishProcessProfiles then merges the files of all processes.
+    """
+    def __init__(self, fileName, mode="cprofile", interval=0.005):
+        """!Construct a ProcessProfiler
+
+        @param[in] fileName     name of the merged profile; this process writes \<fileName>.\<pid>
+        @param[in] mode         "cprofile" for cProfile statistics (readable with pstats),
+            or "sample" for a SampleProfiler (collapsed stacks)
+        @param[in] interval     sampling interval (sec of CPU time) if mode is "sample"
+        """
+        if mode not in ProfileModes:
+            raise ValueError("Unknown profile mode %r; must be one of %s" % (mode, ProfileModes))
+        self.mode = mode
+        self.pid = os.getpid()
+        self.processFileName = "%s.%d" % (fileName, self.pid)
+        if mode == "cprofile":
+            from cProfile import Profile
+            self._profiler = Profile()
+        else:
+            self._profiler = SampleProfiler(interval=interval)
+        self._isUsed = False
+        ## multiprocessing.util.Finalize that dumps the profile when the process exits, or None
+        self.finalizer = None
+
+    def start(self):
+        """!Start or resume profiling"""
+        self._isUsed = True
+        self._profiler.enable()
+
+    def stop(self):
+        """!Pause profiling"""
+        self._profiler.disable()
+
+    def dump(self):
+        """!Write the profile of this process to \<fileName>.\<pid>, if anything was profiled"""
+        if self._isUsed:
+            self._profiler.dump_stats(self.processFileName)
+
+## The ProcessProfiler of this process, made by getProcessProfiler
+_processProfiler = None
+
+def getProcessProfiler(fileName, mode="cprofile", interval=0.005):
+    """!Return the ProcessProfiler of this process, making it the first time this is called in a process
+
+    The profile is written to \<fileName>.\<pid> when the process exits (via multiprocessing's exit
+    handlers, which run when a pool worker exits normally, but not if it is terminated)
+    or when finishProcessProfiles is called in this process.
+
+    @param[in] fileName, mode, interval     see ProcessProfiler
+    """
+    global _processProfiler
+    if _processProfiler is None or _processProfiler.pid != os.getpid():
+        from multiprocessing.util import Finalize
+        _processProfiler = ProcessProfiler(fileName=fileName, mode=mode, interval=interval)
+        _processProfiler.finalizer = Finalize(_processProfiler, _processProfiler.dump, exitpriority=10)
+    return _processProfiler
+
+def _getProcessFileNames(fileName):
+    """Return the names of the files \<fileName>.\<pid> written by ProcessProfilers"""
+    dirName, baseName = os.path.split(fileName)
+    pattern = re.compile(re.escape(baseName) + r"\.\d+$")
+    return sorted(os.path.join(dirName, name) for name in os.listdir(dirName or ".") if pattern.match(name))
+
+def removeProcessProfiles(fileName):
+    """!Remove the files \<fileName>.\<pid> left by an earlier run"""
+    for name in _getProcessFileNames(fileName):
+        os.remove(name)
+
+def finishProcessProfiles(fileName, mode="cprofile"):
+    """!Write the profile of this process, then merge the profiles of all processes into one file
+
+    The files \<fileName>.\<pid> of the individual processes are removed once they are merged.
+    Call this after all worker processes have exited. cProfile statistics are merged with pstats;
+    collapsed stacks are merged by adding the number of samples of each stack.
+
+    @param[in] fileName     name of the merged profile
+    @param[in] mode         profiling mode used by the processes (see ProcessProfiler)
+    @return the number of process profiles that were merged
+    """
+    global _processProfiler
+    if _processProfiler is not None and _processProfiler.pid == os.getpid():
+        _processProfiler.dump()
+        if _processProfiler.finalizer is not None:
+            _processProfiler.finalizer.cancel()
+        _processProfiler = None
+    processFileNameList = _getProcessFileNames(fileName)
+    if not processFileNameList:
+        return 0
+    if mode == "cprofile":
+        import pstats
+        stats = pstats.Stats(*processFileNameList)
+        stats.dump_stats(fileName)
+    else:
+        countDict = {}
+        for processFileName in processFileNameList:
+            for collapsedStack, count in readCollapsed(processFileName).iteritems():
+                countDict[collapsedStack] = countDict.get(collapsedStack, 0) + count
+        writeCollapsed(countDict, fileName)
+    for processFileName in processFileNameList:
+        os.remove(processFileName)
+    return len(processFileNameList)
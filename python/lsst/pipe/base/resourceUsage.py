@@ -0,0 +1,161 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Resource usage of each target processed by a TaskRunner, and its summary across all processes.
+"""
+import array
+import heapq
+import itertools
+import os
+import resource
+import time
+
+from .struct import Struct
+
+__all__ = ["getResourceUsage", "ResourceSummary"]
+
+## Names of the fields of a resource usage record, as returned by getResourceUsage
+ResourceFieldNames = ("wallTime", "cpuTime", "maxResidentSetSize", "blockInputs", "blockOutputs",
+                      "minorPageFaults", "majorPageFaults")
+
+def getResourceUsage(startUsage=None):
+    """!Return the resource usage of this process, or the usage since an earlier call
+
+    @param[in] startUsage   a Struct returned by an earlier call to getResourceUsage, or None
+    @return a Struct with these fields (see ResourceFieldNames):
+    - wallTime: wall-clock time (sec)
+    - cpuTime: user + system CPU time (sec)
+    - maxResidentSetSize: maximum resident set size of this process so far (as reported by getrusage;
+        kB on Linux); this is a high-water mark, so it is never relative to startUsage
+    - blockInputs, blockOutputs: number of block input and output operations
+    - minorPageFaults, majorPageFaults: number of page faults that did not and did require I/O
+    If startUsage is specified then all fields but maxResidentSetSize are the difference from startUsage.
+
+    Only this process is measured (RUSAGE_SELF); call this in each worker process to measure it.
+    """
+    res = resource.getrusage(resource.RUSAGE_SELF)
+    usage = Struct(
+        wallTime = time.time(),
+        cpuTime = res.ru_utime + res.ru_stime,
+        maxResidentSetSize = res.ru_maxrss,
+        blockInputs = res.ru_inblock,
+        blockOutputs = res.ru_oublock,
+        minorPageFaults = res.ru_minflt,
+        majorPageFaults = res.ru_majflt,
+    )
+    if startUsage is not None:
+        for name in ResourceFieldNames:
+            if name != "maxResidentSetSize":
+                setattr(usage, name, getattr(usage, name) - getattr(startUsage, name))
+    return usage
+
+class ResourceSummary(object):
+    """!Summary of the resource usage of all targets of a run, such as CPU time, peak memory and I/O
+
+    Each worker process measures the resources used by each target with getResourceUsage
+    and returns the record to the parent process, which adds it here; the summary then covers
+    all processes, unlike the task metadata, which only describes the process that wrote it.
+
+    The records are held compactly (one array of doubles per field), and only the data IDs
+    of the slowest targets (by wall time) are retained.
+    """
+    ## Percentiles reported by format
+    Percentiles = (50, 90, 99)
+
+    def __init__(self, numSlowest=10):
+        """!Construct a ResourceSummary
+
+        @param[in] numSlowest   number of slowest targets whose data IDs are retained
+        """
+        self.numSlowest = int(numSlowest)
+        self._dataDict = dict((name, array.array("d")) for name in ResourceFieldNames)
+        self._slowestHeap = [] # heap of (wallTime, counter, dataId) of the slowest targets
+        self._counter = itertools.count()
+
+    def __len__(self):
+        """!Return the number of targets added"""
+        return len(self._dataDict["wallTime"])
+
+    def add(self, usage, dataId=None):
+        """!Add the resource usage of one target
+
+        @param[in] usage    resource usage of the target, as returned by getResourceUsage
+        @param[in] dataId   description of the target's data ID (e.g. a str), or None if unknown
+        """
+        for name in ResourceFieldNames:
+            self._dataDict[name].append(getattr(usage, name))
+        item = (usage.wallTime, next(self._counter), dataId)
+        if len(self._slowestHeap) < self.numSlowest:
+            heapq.heappush(self._slowestHeap, item)
+        elif self.numSlowest > 0:
+            heapq.heappushpop(self._slowestHeap, item)
+
+    def getValues(self, name):
+        """!Return the values of one field for all targets, in the order added, as an array of doubles
+
+        @param[in] name     name of field; one of ResourceFieldNames
+        """
+        return self._dataDict[name]
+
+    def getPercentile(self, name, percentile):
+        """!Return a percentile (0-100) of one field over all targets, or None if there are none
+
+        Uses the nearest-rank method, so the result is always one of the values.
+        """
+        values = sorted(self._dataDict[name])
+        if not values:
+            return None
+        rank = int(round(percentile / 100.0 * (len(values) - 1)))
+        return values[rank]
+
+    def getSlowest(self):
+        """!Return a list of (wallTime, dataId) for the slowest targets, slowest first"""
+        return [(wallTime, dataId) for wallTime, counter, dataId in sorted(self._slowestHeap, reverse=True)]
+
+    def format(self):
+        """!Return a text table of the totals and percentiles of each field, and the slowest targets"""
+        numCols = len(self.Percentiles) + 2
+        lineList = ["# Resource usage of %d targets" % (len(self),),
+                    ("%-20s" + " %14s" * numCols) %
+                    (("field", "total") + tuple("p%d" % (p,) for p in self.Percentiles) + ("max",))]
+        for name in ResourceFieldNames:
+            values = self._dataDict[name]
+            if not values:
+                continue
+            statList = [sum(values)] + [self.getPercentile(name, p) for p in self.Percentiles] + [max(values)]
+            strList = ["%14.6g" % (stat,) for stat in statList]
+            if name == "maxResidentSetSize":
+                strList[0] = "%14s" % ("-",) # the sum of the peak memory of each target is meaningless
+            lineList.append("%-20s %s" % (name, " ".join(strList)))
+        lineList.append("# Slowest targets")
+        lineList.append("%-20s %s" % ("wallTime", "dataId"))
+        for wallTime, dataId in self.getSlowest():
+            lineList.append("%-20.6g %s" % (wallTime, dataId))
+        return "\n".join(lineList) + "\n"
+
+    def write(self, fileName):
+        """!Write the table returned by format to a file, creating its directory if necessary"""
+        dirName = os.path.dirname(fileName)
+        if dirName and not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        with open(fileName, "w") as outFile:
+            outFile.write(self.format())
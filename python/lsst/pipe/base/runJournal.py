@@ -0,0 +1,126 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""A journal of the targets completed by a TaskRunner, so that an interrupted run can be resumed.
+"""
+import json
+import os
+import time
+
+__all__ = ["getTargetKey", "RunJournal"]
+
+def getTargetKey(args):
+    """!Return a str that identifies a target: the JSON form (with sorted keys) of its data ID
+
+    @param[in] args     a target, as returned by TaskRunner.getTargetList: a tuple whose first element
+        is a data reference or a list of data references
+    @return the key, or None if the target has no data references
+    """
+    try:
+        dataRef = args[0]
+        if hasattr(dataRef, "dataId"):
+            dataId = dict(dataRef.dataId)
+        else:
+            dataId = [dict(ref.dataId) for ref in dataRef]
+    except Exception:
+        return None
+    return json.dumps(dataId, sort_keys=True, default=str)
+
+class RunJournal(object):
+    """!Journal of the targets completed by TaskRunner.runIter, for resuming an interrupted run
+
+    The journal is a text file with one JSON record per line, appended as each target finishes:
+    {"key": target key (see getTargetKey), "status": "done" or "failed", "config": config digest,
+    "time": Unix time}. Each record is appended with a single write to a file opened in append mode,
+    so records from several runs appending to the same journal are not interleaved, and a run that
+    is killed loses at most its last, partly written, record (which is ignored when reading).
+    Only the parent process writes the journal, as results arrive; pool workers never access it.
+
+    Records are only valid for the config that produced them: records whose config digest
+    (see \ref configFingerprint.computeConfigDigest "computeConfigDigest") differs from the current config
+    are ignored, so changing the config (e.g. with --clobber-config) invalidates the journal.
+    """
+    def __init__(self, fileName, configDigest):
+        """!Construct a RunJournal
+
+        @param[in] fileName     name of journal file; it and its directory are created if necessary
+        @param[in] configDigest digest of the config of the task being run
+            (see \ref configFingerprint.computeConfigDigest "computeConfigDigest")
+        """
+        self.fileName = fileName
+        self.configDigest = configDigest
+        self._fd = None
+
+    def getStatusDict(self):
+        """!Return a dict of target key: status of the most recent record for that target (with this config)
+
+        @return a tuple of:
+        - the dict of target key: status
+        - the number of valid records that were ignored because they are for a different config
+        """
+        statusDict = {}
+        numInvalid = 0
+        if not os.path.exists(self.fileName):
+            return statusDict, numInvalid
+        with open(self.fileName) as journalFile:
+            for line in journalFile:
+                try:
+                    record = json.loads(line)
+                    key, status, configDigest = record["key"], record["status"], record["config"]
+                except (ValueError, KeyError, TypeError):
+                    continue # partly written record
+                if configDigest != self.configDigest:
+                    numInvalid += 1
+                else:
+                    statusDict[key] = status
+        return statusDict, numInvalid
+
+    def record(self, key, status):
+        """!Append a record for one target
+
+        @param[in] key      key of target (see getTargetKey)
+        @param[in] status   "done" if the target succeeded, else "failed"
+        """
+        if self._fd is None:
+            dirName = os.path.dirname(self.fileName)
+            if dirName and not os.path.isdir(dirName):
+                os.makedirs(dirName)
+            self._fd = os.open(self.fileName, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if not _endsWithNewline(self.fileName):
+                os.write(self._fd, "\n") # end the partly written record of a run that was killed
+        line = json.dumps(dict(key=key, status=status, config=self.configDigest, time=time.time())) + "\n"
+        os.write(self._fd, line)
+
+    def close(self):
+        """!Close the journal file"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+def _endsWithNewline(fileName):
+    """Return True if a file is empty or ends with a newline"""
+    with open(fileName, "rb") as inFile:
+        inFile.seek(0, os.SEEK_END)
+        if inFile.tell() == 0:
+            return True
+        inFile.seek(-1, os.SEEK_END)
+        return inFile.read(1) == "\n"
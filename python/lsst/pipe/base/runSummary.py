@@ -0,0 +1,234 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""A run-summary database with one row per target: its data ID, resource usage and flattened task metadata.
+
+To summarize a run-summary database from the command line:
+
+    python -m lsst.pipe.base.runSummary <filename> [--sort COLUMN] [--limit N] [--match SUBSTRING]
+"""
+import collections
+import json
+import os
+import time
+
+__all__ = ["flattenMetadata", "RunSummaryWriter", "readRunSummary", "readRunSummaryItem"]
+
+## Name of the table in a run-summary database; it has one row per (target, item)
+TableName = "summaryItem"
+
+## Name of the column holding the data ID of the target (as JSON); also the name of the data ID column
+## returned by readRunSummary
+KeyColumn = "dataId"
+
+def flattenMetadata(metadata, prefix=""):
+    """!Flatten the full metadata of a task into a dict of item name: value
+
+    Names are the full names of the items, as in \ref task.Task.getFullMetadata "getFullMetadata",
+    e.g. "processCcd:calibrate.runEndCpuTime". Items with several values are represented by the last value.
+
+    @param[in] metadata     an lsst.daf.base.PropertySet, such as the output of getFullMetadata
+    @param[in] prefix       prefix for the names of the items
+    @return a collections.OrderedDict of name: value
+    """
+    itemDict = collections.OrderedDict()
+    for name in metadata.names():
+        fullName = prefix + name
+        if metadata.isPropertySetPtr(name):
+            itemDict.update(flattenMetadata(metadata.getPropertySet(name), fullName + "."))
+        else:
+            itemDict[fullName] = metadata.getArray(name)[-1]
+    return itemDict
+
+def _quote(name):
+    """Quote a column name for SQL"""
+    return '"%s"' % (name.replace('"', '""'),)
+
+def _toSql(value):
+    """Convert a value to a type that can be stored by sqlite3"""
+    if value is None or isinstance(value, (int, long, float, basestring)):
+        return value
+    if hasattr(value, "item"): # numpy scalar
+        return value.item()
+    return str(value)
+
+class RunSummaryWriter(object):
+    """!Write one row per target to an SQLite database, as targets complete
+
+    Each row is a dict of column name: value, and rows need not all have the same columns
+    (see readRunSummary). Rows are stored in a narrow table with one record per (target, column name),
+    so the number of columns (e.g. of flattened task metadata) is not limited by SQLite.
+    Rows are keyed by the target's data ID: a row for a data ID that is already in the table replaces it,
+    so the table describes the most recent run of each target.
+
+    Rows are committed in batches, when flushSize rows are pending or flushInterval seconds have passed
+    since the last commit, so the database is usable while a long run is in progress.
+    """
+    def __init__(self, fileName, flushSize=100, flushInterval=10.0):
+        """!Construct a RunSummaryWriter, creating the database and table if necessary
+
+        @param[in] fileName         name of SQLite database file
+        @param[in] flushSize        number of pending rows that triggers a commit
+        @param[in] flushInterval    time (sec) since the last commit that triggers a commit
+        """
+        import sqlite3
+        dirName = os.path.dirname(fileName)
+        if dirName and not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        self.fileName = fileName
+        self.flushSize = int(flushSize)
+        self.flushInterval = float(flushInterval)
+        self._connection = sqlite3.connect(fileName)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS %s (%s TEXT, name TEXT, value, "
+                                     "PRIMARY KEY (%s, name))" % ((TableName,) + (_quote(KeyColumn),)*2))
+        self._pendingList = []
+        self._lastFlushTime = time.time()
+
+    def add(self, dataId, row):
+        """!Add the row for one target
+
+        @param[in] dataId   data ID of the target: a dict (which is stored as JSON with sorted keys),
+            or a str
+        @param[in] row      dict of column name: value
+        """
+        if isinstance(dataId, dict):
+            dataId = json.dumps(dataId, sort_keys=True, default=str)
+        self._pendingList.append((dataId, row))
+        if len(self._pendingList) >= self.flushSize or time.time() - self._lastFlushTime >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        """!Commit all pending rows"""
+        self._lastFlushTime = time.time()
+        if not self._pendingList:
+            return
+        pendingList, self._pendingList = self._pendingList, []
+        with self._connection:
+            self._connection.executemany("DELETE FROM %s WHERE %s = ?" % (TableName, _quote(KeyColumn)),
+                                         [(dataId,) for dataId, row in pendingList])
+            self._connection.executemany("INSERT OR REPLACE INTO %s VALUES (?, ?, ?)" % (TableName,),
+                                         ((dataId, name, _toSql(value)) for dataId, row in pendingList
+                                          for name, value in row.iteritems()))
+
+    def close(self):
+        """!Commit all pending rows and close the database"""
+        if self._connection is not None:
+            try:
+                self.flush()
+            finally:
+                self._connection.close()
+                self._connection = None
+
+def readRunSummary(fileName, columnNames=None):
+    """!Read a run-summary database as a dict of column name: numpy array, with one element per target
+
+    The data ID of each target is in column KeyColumn ("dataId"), as JSON.
+    Columns whose values are all numbers (or NULL) are returned as float arrays, with NaN for NULL
+    (including targets that have no value for the column); other columns are returned as object arrays.
+    To make a pandas DataFrame, use pandas.DataFrame(readRunSummary(fileName)).
+
+    @param[in] fileName     name of SQLite database file
+    @param[in] columnNames  names of columns to read, or None for all columns
+    @return a collections.OrderedDict of column name: numpy array
+    """
+    import sqlite3
+    import numpy
+    rowIndexDict = collections.OrderedDict() # data ID: index of row
+    valueDictDict = collections.OrderedDict() # column name: dict of row index: value
+    nameSet = None if columnNames is None else set(columnNames)
+    connection = sqlite3.connect(fileName)
+    try:
+        for dataId, name, value in connection.execute("SELECT %s, name, value FROM %s ORDER BY rowid" %
+                                                      (_quote(KeyColumn), TableName)):
+            rowIndex = rowIndexDict.setdefault(dataId, len(rowIndexDict))
+            if nameSet is None or name in nameSet:
+                valueDictDict.setdefault(name, {})[rowIndex] = value
+    finally:
+        connection.close()
+    valueListDict = collections.OrderedDict()
+    if nameSet is None or KeyColumn in nameSet:
+        valueListDict[KeyColumn] = list(rowIndexDict)
+    for name in (valueDictDict if columnNames is None else columnNames):
+        if name != KeyColumn and name in valueDictDict:
+            valueDict = valueDictDict[name]
+            valueListDict[name] = [valueDict.get(i) for i in range(len(rowIndexDict))]
+    columnDict = collections.OrderedDict()
+    for name, valueList in valueListDict.iteritems():
+        if all(value is None or isinstance(value, (int, long, float)) for value in valueList):
+            columnDict[name] = numpy.array([numpy.nan if value is None else value for value in valueList],
+                                           dtype=float)
+        else:
+            columnDict[name] = numpy.array(valueList, dtype=object)
+    return columnDict
+
+def readRunSummaryItem(fileName, name):
+    """!Read the values of one column of a run-summary database, for the targets that have a value
+
+    This is much faster than readRunSummary for one column of a large database.
+
+    @param[in] fileName     name of SQLite database file
+    @param[in] name         name of the column
+    @return a dict of data ID (as JSON with sorted keys, as stored by RunSummaryWriter.add): value
+    """
+    import sqlite3
+    connection = sqlite3.connect(fileName)
+    try:
+        return dict(connection.execute("SELECT %s, value FROM %s WHERE name = ?" %
+                                       (_quote(KeyColumn), TableName), (name,)))
+    finally:
+        connection.close()
+
+def main(argv=None):
+    """!Print a summary of a run-summary database: statistics of numeric columns, and the slowest targets"""
+    import argparse
+    import numpy
+    parser = argparse.ArgumentParser(description=main.__doc__.lstrip("!"))
+    parser.add_argument("fileName", help="run-summary database (an SQLite file)")
+    parser.add_argument("--sort", default="resources.wallTime",
+                        help="column by which to select the targets to list (default: %(default)s)")
+    parser.add_argument("--limit", type=int, default=10, help="number of targets to list (default: %(default)s)")
+    parser.add_argument("--match", default="",
+                        help="only show statistics of columns whose names contain this string")
+    args = parser.parse_args(argv)
+
+    columnDict = readRunSummary(args.fileName)
+    numRows = len(columnDict[KeyColumn])
+    print "%d targets in %s" % (numRows, args.fileName)
+    print "%-60s %8s %14s %14s %14s %14s" % ("column", "count", "mean", "p50", "p90", "max")
+    for name, values in columnDict.iteritems():
+        if values.dtype != float or args.match not in name:
+            continue
+        values = values[numpy.isfinite(values)]
+        if len(values) == 0:
+            continue
+        print "%-60s %8d %14.6g %14.6g %14.6g %14.6g" % (name, len(values), values.mean(),
+            numpy.percentile(values, 50), numpy.percentile(values, 90), values.max())
+    sortValues = columnDict.get(args.sort)
+    if sortValues is not None and sortValues.dtype == float and args.limit > 0:
+        print "\nTargets with the largest %s:" % (args.sort,)
+        order = numpy.argsort(numpy.where(numpy.isnan(sortValues), -numpy.inf, sortValues))[::-1]
+        for i in order[:args.limit]:
+            print "%14.6g %s" % (sortValues[i], columnDict[KeyColumn][i])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Return large arrays from worker processes through memory-mapped files, instead of pickling them.
+"""
+import atexit
+import copy
+import errno
+import itertools
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+
+from .struct import Struct, SlottedStruct
+
+__all__ = ["SharedArrayHandle", "makeSharedResultDir", "removeSharedResultDir", "exportSharedArrays",
+           "importSharedArrays"]
+
+## Directories in which to make shared result directories, in order of preference; /dev/shm is in memory
+_SharedDirList = ("/dev/shm",)
+
+## Prefix of the names of shared result directories; followed by \<host>_\<pid>_ of the process that made it
+_DirPrefix = "pipe_base_results_"
+
+## Shared result directories made by this process (or one it was forked from) and not yet removed:
+## dict of directory name: pid of the process that made it
+_liveDirDict = {}
+
+## Maximum depth of containers searched for arrays by exportSharedArrays and importSharedArrays
+_MaxDepth = 10
+
+class SharedArrayHandle(object):
+    """!Picklable reference to a numpy array that a worker process wrote to a memory-mapped file
+
+    Made by exportSharedArrays in a worker process, and replaced by the array, mapped from the file
+    without copying, by importSharedArrays in the parent process.
+    """
+    def __init__(self, fileName, dtype, shape, order):
+        """!Construct a SharedArrayHandle
+
+        @param[in] fileName     name of file holding the data of the array
+        @param[in] dtype        numpy dtype of the array
+        @param[in] shape        shape of the array
+        @param[in] order        order of the data in the file: "C" or "F"
+        """
+        self.fileName = fileName
+        self.dtype = dtype
+        self.shape = shape
+        self.order = order
+
+    def __repr__(self):
+        return "%s(%r, %r, %r, %r)" % (type(self).__name__, self.fileName, self.dtype, self.shape, self.order)
+
+def makeSharedResultDir():
+    """!Make a new directory for the shared arrays of one run, in /dev/shm if possible, and return its name
+
+    Remove it with removeSharedResultDir when the run ends. If that is not called, the directory is removed
+    when this process exits; and if this process is killed, the directory is removed by the next call
+    to makeSharedResultDir on this host (which removes the directories of processes that no longer exist).
+    """
+    for parentDir in _SharedDirList:
+        if os.path.isdir(parentDir) and os.access(parentDir, os.W_OK):
+            break
+    else:
+        parentDir = tempfile.gettempdir()
+    pid = os.getpid()
+    hostPrefix = "%s%s_" % (_DirPrefix, socket.gethostname())
+    _removeStaleDirs(parentDir, hostPrefix)
+    dirName = tempfile.mkdtemp(prefix="%s%d_" % (hostPrefix, pid), dir=parentDir)
+    _liveDirDict[dirName] = pid
+    return dirName
+
+def removeSharedResultDir(dirName):
+    """!Remove a directory made by makeSharedResultDir, and any shared arrays that were not imported
+
+    Arrays already returned by importSharedArrays remain valid.
+    """
+    shutil.rmtree(dirName, ignore_errors=True)
+    _liveDirDict.pop(dirName, None)
+
+def _removeStaleDirs(parentDir, hostPrefix):
+    """Remove the shared result directories in parentDir made on this host by processes that no longer exist
+    """
+    pattern = re.compile(re.escape(hostPrefix) + r"(\d+)_")
+    try:
+        nameList = os.listdir(parentDir)
+    except OSError:
+        return
+    for name in nameList:
+        match = pattern.match(name)
+        if match is None or _isProcessAlive(int(match.group(1))):
+            continue
+        path = os.path.join(parentDir, name)
+        try:
+            if os.stat(path).st_uid != os.getuid():
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+
+def _isProcessAlive(pid):
+    """Return True if a process with the given ID exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM # it exists, but belongs to another user
+    return True
+
+@atexit.register
+def _removeLiveDirs():
+    """Remove the shared result directories made by this process that were not removed"""
+    pid = os.getpid()
+    for dirName, dirPid in _liveDirDict.items():
+        if dirPid == pid:
+            removeSharedResultDir(dirName)
+
+def exportSharedArrays(obj, dirName, minSize):
+    """!Return a copy of obj in which each large numpy array is written to a file and replaced by a handle
+
+    Call this in a worker process on a result that is to be sent to the parent process.
+    Each array (numpy.ndarray or numpy.memmap) of at least minSize bytes whose dtype is not object
+    found in obj is copied once,
+    into a new file in dirName, and replaced by a SharedArrayHandle, which pickles to a few hundred bytes.
+    Arrays are found in obj itself, and in the values of Structs, dicts, lists and tuples within it.
+    Containers with no such arrays are returned as they are, and other objects are not examined.
+
+    @param[in] obj          object in which to replace arrays (e.g. a Struct)
+    @param[in] dirName      directory in which to write arrays, made by makeSharedResultDir
+    @param[in] minSize      minimum size (bytes) of array to write to a file
+    @return obj, or a copy of it in which arrays have been replaced
+    """
+    numpy = sys.modules.get("numpy")
+    if numpy is None:
+        return obj # there can be no arrays
+    counter = itertools.count()
+    def exportArray(array):
+        if array.dtype.hasobject or array.nbytes < max(1, minSize):
+            return array
+        order = "F" if array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+        fileName = os.path.join(dirName, "%d_%d.dat" % (os.getpid(), next(counter)))
+        while os.path.exists(fileName):
+            fileName = os.path.join(dirName, "%d_%d.dat" % (os.getpid(), next(counter)))
+        mappedArray = numpy.memmap(fileName, dtype=array.dtype, mode="w+", shape=array.shape, order=order)
+        mappedArray[...] = array
+        del mappedArray
+        return SharedArrayHandle(fileName, array.dtype, array.shape, order)
+    # subclasses such as masked arrays have more than their data, so they are pickled as usual
+    return _replace(obj, lambda value: type(value) in (numpy.ndarray, numpy.memmap), exportArray, 0)
+
+def importSharedArrays(obj):
+    """!Return a copy of obj in which each SharedArrayHandle is replaced by the array it refers to
+
+    Call this in the parent process on a result returned by exportSharedArrays. Each array is mapped
+    from its file (copy-on-write, so it may be modified without affecting anything else) and the file
+    is deleted at once; the memory is freed when the array is no longer used.
+
+    @param[in] obj          object in which to replace handles (e.g. a Struct)
+    @return obj, or a copy of it in which handles have been replaced
+    """
+    def importArray(handle):
+        import numpy
+        try:
+            mappedArray = numpy.memmap(handle.fileName, dtype=handle.dtype, mode="c", shape=handle.shape,
+                                       order=handle.order)
+        finally:
+            os.remove(handle.fileName)
+        return mappedArray.view(numpy.ndarray)
+    return _replace(obj, lambda value: isinstance(value, SharedArrayHandle), importArray, 0)
+
+def _replace(obj, isTarget, replaceFunc, depth):
+    """Return obj with each value for which isTarget(value) is true replaced by replaceFunc(value)
+
+    Values are searched for in obj, and in Structs, SlottedStructs, dicts, lists and tuples within it,
+    up to _MaxDepth levels deep. A container is copied only if a value in it is replaced.
+    """
+    if isTarget(obj):
+        return replaceFunc(obj)
+    if depth >= _MaxDepth:
+        return obj
+    if isinstance(obj, Struct):
+        itemDict = obj.getDict()
+        newItemDict = _replaceItems(itemDict, isTarget, replaceFunc, depth)
+        if newItemDict is itemDict:
+            return obj
+        newObj = copy.copy(obj)
+        newObj.__dict__.update(newItemDict)
+        return newObj
+    if isinstance(obj, SlottedStruct):
+        itemDict = obj.getDict()
+        newItemDict = _replaceItems(itemDict, isTarget, replaceFunc, depth)
+        if newItemDict is itemDict:
+            return obj
+        return type(obj)(**newItemDict)
+    if type(obj) is dict:
+        return _replaceItems(obj, isTarget, replaceFunc, depth)
+    if type(obj) in (list, tuple):
+        newList = [_replace(value, isTarget, replaceFunc, depth + 1) for value in obj]
+        if all(newValue is value for newValue, value in itertools.izip(newList, obj)):
+            return obj
+        return type(obj)(newList)
+    return obj
+
+def _replaceItems(itemDict, isTarget, replaceFunc, depth):
+    """Return itemDict, or a copy of it in which values have been replaced as for _replace"""
+    newItemDict = dict((name, _replace(value, isTarget, replaceFunc, depth + 1))
+                       for name, value in itemDict.iteritems())
+    if all(newItemDict[name] is value for name, value in itemDict.iteritems()):
+        return itemDict
+    return newItemDict
@@ -0,0 +1,156 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Hierarchical tracing of task execution, exported as Chrome trace events.
+"""
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+
+__all__ = ["SpanTracer", "getTracer", "setTracer", "traceSpan"]
+
+class SpanTracer(object):
+    """!Record nested spans of execution, for viewing as a timeline
+
+    A span is a named interval of wall-clock time. Spans opened while another span is open
+    in the same thread are its children: each span records its own ID and that of its parent,
+    along with the process and thread IDs, so the nesting of a task and its subtasks is preserved.
+
+    When a tracer is installed with setTracer, \ref timer.timeMethod "timeMethod" and Task.timer
+    record a span for each timed method or block, named \<full task name>.\<method or block name>.
+    TaskRunner installs a tracer in each process when --trace is specified, and collects the spans
+    of all processes into one file.
+
+    Spans are saved as Chrome trace events ("complete" events, with times in microseconds),
+    which can be viewed with chrome://tracing or other trace viewers.
+    """
+    def __init__(self):
+        ## ID of the process that constructed this tracer; a forked child process must make its own tracer
+        self.pid = os.getpid()
+        self._eventList = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._spanIdIter = itertools.count(1)
+
+    @contextlib.contextmanager
+    def span(self, name, category="", **kwargs):
+        """!Context manager that records a span for the enclosed block of code
+
+        @param[in] name         name of span
+        @param[in] category     category of span (e.g. the full name of a task)
+        @param[in] **kwargs     additional information to record with the span; must be JSON-serializable
+        """
+        spanStack = self._getSpanStack()
+        spanId = "%d:%d" % (self.pid, next(self._spanIdIter))
+        parentId = spanStack[-1] if spanStack else None
+        spanStack.append(spanId)
+        startTime = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - startTime
+            spanStack.pop()
+            kwargs.update(id=spanId, parentId=parentId)
+            event = dict(name=name, cat=category, ph="X", ts=startTime*1e6, dur=duration*1e6,
+                         pid=self.pid, tid=threading.current_thread().ident, args=kwargs)
+            with self._lock:
+                self._eventList.append(event)
+
+    def getEvents(self):
+        """!Return a copy of the list of trace events (dicts) recorded so far"""
+        with self._lock:
+            return list(self._eventList)
+
+    def popEvents(self):
+        """!Return the list of trace events (dicts) recorded so far, and forget them"""
+        with self._lock:
+            eventList, self._eventList = self._eventList, []
+        return eventList
+
+    def addEvents(self, eventList):
+        """!Add trace events recorded by another tracer (e.g. in another process)"""
+        with self._lock:
+            self._eventList += eventList
+
+    def writeChromeTrace(self, fileName):
+        """!Write all trace events to a file in Chrome trace event format (JSON)
+
+        @param[in] fileName     name of file to write
+        """
+        eventList = self.getEvents()
+        # name each process, so the parent can be told from the workers
+        for pid in sorted(set(event["pid"] for event in eventList) | set([self.pid])):
+            eventList.append(dict(name="process_name", ph="M", pid=pid,
+                                  args=dict(name="main" if pid == self.pid else "worker %d" % (pid,))))
+        with open(fileName, "w") as outFile:
+            json.dump(dict(traceEvents=eventList, displayTimeUnit="ms"), outFile)
+
+    def _getSpanStack(self):
+        """Return the list of IDs of the open spans of the current thread"""
+        spanStack = getattr(self._local, "spanStack", None)
+        if spanStack is None:
+            spanStack = self._local.spanStack = []
+        return spanStack
+
+class _NullSpan(object):
+    """A context manager that does nothing, used when no tracer is installed"""
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+_nullSpan = _NullSpan()
+
+## The tracer installed in this process, or None
+_tracer = None
+
+def getTracer():
+    """!Return the SpanTracer installed in this process, or None if tracing is disabled"""
+    return _tracer
+
+def setTracer(tracer):
+    """!Install a SpanTracer in this process, or disable tracing if tracer is None
+
+    @return the previously installed tracer, or None
+    """
+    global _tracer
+    oldTracer, _tracer = _tracer, tracer
+    return oldTracer
+
+def traceSpan(obj, name):
+    """!Return a context manager that records a span for a task, if a tracer is installed
+
+    @param[in] obj      a \ref task.Task "Task" (or any object, though only tasks have a full name)
+    @param[in] name     name of method or block of code; the span is named \<full task name>.\<name>
+
+    If no tracer is installed this returns a context manager that does nothing.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _nullSpan
+    fullName = getattr(obj, "_fullName", type(obj).__name__)
+    return tracer.span("%s.%s" % (fullName, name), category=fullName, task=fullName,
+                       parentTask=fullName.rpartition(".")[0] or None)
@@ -20,7 +20,11 @@ from __future__ import absolute_import, division
 # the GNU General Public License along with this program.  If not, 
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
-__all__ = ["Struct"]
+import keyword
+import re
+import sys
+
+__all__ = ["Struct", "StructType", "SlottedStruct"]
 
 class Struct(object):
     """!A struct to which you can add any fields
@@ -108,3 +112,122 @@ class Struct(object):
     def __repr__(self):
         itemList = ["%s=%r" % (name, val) for name, val in self.getDict().iteritems()]
         return "%s(%s)" % (self.__class__.__name__, "; ".join(itemList))
+
+class SlottedStruct(object):
+    """!Base class of the fixed-field structs made by StructType
+
+    Each struct class made by StructType stores its fields in __slots__, so its instances have no
+    per-instance dict: they are smaller than Structs and faster to construct and pickle.
+    Every field must be given a value when an instance is constructed, and fields cannot be added later.
+    Unlike Struct there is no mergeItems, since the fields are fixed.
+    """
+    __slots__ = ()
+
+    def _getValues(self):
+        """Return a tuple of the values of the fields, in order (replaced by StructType)"""
+        return ()
+
+    def getDict(self):
+        """!Return a dictionary of attribute name: value
+
+        @warning: the values are shallow copies.
+        """
+        return dict(zip(self.__slots__, self._getValues()))
+
+    def copy(self):
+        """!Return a one-level-deep copy (values are not copied)
+        """
+        return type(self)(*self._getValues())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._getValues() == other._getValues()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        itemList = ["%s=%r" % (name, val) for name, val in zip(self.__slots__, self._getValues())]
+        return "%s(%s)" % (self.__class__.__name__, "; ".join(itemList))
+
+    def __reduce__(self):
+        cls = type(self)
+        if getattr(sys.modules.get(cls.__module__), cls.__name__, None) is cls:
+            return (cls, self._getValues())
+        # the class cannot be found by name (e.g. it was made in a function), so make it again when unpickling
+        return (_makeSlottedStruct, (cls.__name__, cls.__slots__, self._getValues()))
+
+## Regular expression matching valid names for StructType and its fields
+_NameRe = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+## Struct classes made by StructType, indexed by (type name, tuple of field names)
+_structTypeDict = {}
+
+def StructType(typeName, fieldNames, doc=None):
+    """!Return a struct class with a fixed list of fields, stored in __slots__
+
+    For example:
+    @code
+    FooResult = StructType("FooResult", ["exposure", "sources"])
+    ...
+    return FooResult(exposure=exposure, sources=sources)
+    @endcode
+
+    Instances of the class are used like a Struct, and have the same getDict, copy, __eq__, __len__
+    and __repr__, but they are faster to construct and pickle, and use less memory (see SlottedStruct).
+    Each field must be given a value, by keyword or in order, when an instance is constructed.
+    Assign the class to a module-level name matching typeName so that instances pickle as a reference
+    to it; otherwise they pickle with their type name and field names, and the class is made again
+    (by this function) when they are unpickled. Calling StructType again with the same typeName
+    and fieldNames returns the same class.
+
+    @param[in] typeName     name of the class
+    @param[in] fieldNames   names of the fields: a sequence of str, or one str with names separated
+        by spaces or commas
+    @param[in] doc          docstring for the class, or None for a default
+
+    @throw RuntimeError if typeName or a field name is not a valid identifier, a field name appears twice,
+        begins with __ (two underscores) or is the name of a method of SlottedStruct
+    """
+    if isinstance(fieldNames, basestring):
+        fieldNames = fieldNames.replace(",", " ").split()
+    fieldNames = tuple(fieldNames)
+    cls = _structTypeDict.get((typeName, fieldNames))
+    if cls is not None:
+        return cls
+
+    for name in (typeName,) + fieldNames:
+        if not _NameRe.match(name) or keyword.iskeyword(name):
+            raise RuntimeError("Name %r invalid; must be a valid identifier" % (name,))
+    for i, name in enumerate(fieldNames):
+        if name in fieldNames[:i]:
+            raise RuntimeError("Item %s already exists" % (name,))
+        if name.startswith("__"):
+            raise RuntimeError("Item name %r invalid; must not begin with __" % (name,))
+        if hasattr(SlottedStruct, name):
+            raise RuntimeError("Item name %r invalid; it is the name of a method" % (name,))
+
+    # generate __init__ and _getValues, as namedtuple does, so neither loops over the fields;
+    # "__s" stands for "self", and cannot clash with a field name
+    source = "def __init__(__s%s):\n" % ("".join(", " + name for name in fieldNames),)
+    source += "".join("    __s.%s = %s\n" % (name, name) for name in fieldNames) or "    pass\n"
+    source += "def _getValues(__s):\n    return (%s)\n" % ("".join("__s.%s, " % (name,) for name in fieldNames),)
+    namespace = {}
+    exec source in namespace
+
+    cls = type(typeName, (SlottedStruct,), dict(
+        __slots__ = fieldNames,
+        __init__ = namespace["__init__"],
+        _getValues = namespace["_getValues"],
+        __doc__ = doc or "%s(%s): a struct with fixed fields" % (typeName, ", ".join(fieldNames)),
+        # the module of the caller, where the class is presumably assigned, so pickle can find it
+        __module__ = sys._getframe(1).f_globals.get("__name__", "__main__"),
+    ))
+    _structTypeDict[(typeName, fieldNames)] = cls
+    return cls
+
+def _makeSlottedStruct(typeName, fieldNames, values):
+    """Make an instance of StructType(typeName, fieldNames) from its values; used to unpickle"""
+    return StructType(typeName, fieldNames)(*values)
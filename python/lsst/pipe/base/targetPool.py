@@ -0,0 +1,380 @@
+from __future__ import absolute_import, division
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""A process pool that limits the wall time of each target, and re-runs stragglers speculatively.
+"""
+import bisect
+import errno
+import itertools
+import multiprocessing
+import select
+import time
+import traceback
+
+from .executor import Executor, TargetFailedError
+
+__all__ = ["TargetPool"]
+
+def _workerMain(conn, function, initializer, initargs, maxTargets):
+    """Main function of a TargetPool worker process: run function on each item received from conn
+
+    Each reply is a tuple of (True, result) or (False, exception, formatted traceback).
+    The worker exits when it receives None, when conn is closed, or after maxTargets items
+    (if not None).
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    for numTargets in itertools.count():
+        if maxTargets is not None and numTargets >= maxTargets:
+            break
+        try:
+            item = conn.recv()
+        except EOFError:
+            break
+        if item is None:
+            break
+        try:
+            reply = (True, function(item))
+        except Exception, e:
+            reply = (False, e, traceback.format_exc())
+        try:
+            conn.send(reply)
+        except Exception, e:
+            # the result or exception cannot be pickled
+            conn.send((False, RuntimeError("Cannot return result: %s" % (e,)), traceback.format_exc()))
+    conn.close()
+
+class _Worker(object):
+    """A TargetPool worker process, and the target it is running"""
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        ## the _Target being run, or None if idle
+        self.target = None
+        ## time at which the current target was sent to this worker
+        self.startTime = None
+        ## number of targets sent to this worker
+        self.numTargets = 0
+
+class _Target(object):
+    """A target dispatched by TargetPool, and the workers running it"""
+    def __init__(self, item):
+        self.item = item
+        ## time at which the target was first dispatched
+        self.startTime = time.time()
+        ## workers running this target: one, or two if the target is being re-run speculatively
+        self.workerList = []
+        ## True if a speculative copy of this target has been started
+        self.isSpeculated = False
+        ## True once a copy of this target has returned; any other copy is left to finish and its result ignored
+        self.isDone = False
+
+class TargetPool(Executor):
+    """!\ref executor.Executor "Executor" with a pool of worker processes, each running one target at a time,
+    with a per-target time limit
+
+    Unlike multiprocessing.Pool, a TargetPool tracks which worker runs which target. This allows it to:
+    - Kill the worker running a target that exceeds its wall-time limit, start a replacement worker,
+      and report the target as failed, while the other targets keep running.
+    - Detect a worker that dies (e.g. by a segmentation fault) and report its target as failed,
+      rather than waiting for a result that never comes.
+    - Re-run stragglers speculatively: once all targets have been dispatched, an idle worker starts a copy
+      of a target that has been running longer than most completed targets took; the first copy to finish
+      is used. The other copy is not killed, since it may be part way through writing its outputs:
+      it is left to finish (however long it takes; it is exempt from the time limit) and its result
+      is ignored, and TargetPool.imapUnordered does not return until it has finished.
+      Only use this for tasks whose outputs are the same however often they are written, since both
+      copies write them, and the winner's outputs may be rewritten after its result has been yielded.
+      If iteration stops early (an exception, or the caller abandons the iterator), a copy still running
+      is killed, and the outputs of its target may be incomplete; this is logged.
+
+    Each target is sent to a worker on its own (there is no chunking), and a target is only taken
+    from the iterable when a worker is idle, so at most one target per worker is in flight.
+    Workers are forked, so the function and initializer need not be picklable, but targets and results
+    must be. Only one call to TargetPool.imapUnordered may be in progress at a time.
+    """
+    def __init__(self, processes, initializer=None, initargs=(), maxTargetsPerWorker=None, targetTimeout=None,
+                 speculate=0.0, onFailure=None, log=None):
+        """!Construct a TargetPool
+
+        @param[in] processes        number of worker processes
+        @param[in] initializer      function called in each worker process when it starts, or None
+        @param[in] initargs         arguments for initializer
+        @param[in] maxTargetsPerWorker  number of targets a worker runs before it exits and is replaced
+            (e.g. 1 to run each target in a new process), or None for no limit
+        @param[in] targetTimeout    maximum wall time (sec) for one run of the function, or None for no limit
+        @param[in] speculate    fraction of slowest targets to re-run speculatively (0 for none): once every
+            item has been dispatched, an idle worker runs a second copy of a target that has been running
+            longer than all but this fraction of the completed targets took
+        @param[in] onFailure    function called as onFailure(item, reason, wallTime) for an item that timed
+            out or whose worker died, returning the value to yield for it; if None then
+            \ref executor.TargetFailedError "TargetFailedError" is raised instead
+        @param[in] log              log (an lsst.pex.logging.Log) for reporting failed targets, or None
+        """
+        self.processes = max(1, int(processes))
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.maxTargetsPerWorker = maxTargetsPerWorker
+        self.targetTimeout = targetTimeout
+        self.speculate = speculate
+        self.onFailure = onFailure
+        self.log = log
+        self._function = None
+        self._workerList = []
+        self._closed = False
+
+    def imapUnordered(self, function, iterable):
+        targetTimeout, speculate, onFailure = self.targetTimeout, self.speculate, self.onFailure
+        if self._closed:
+            raise RuntimeError("TargetPool is closed")
+        if function is not self._function:
+            # workers are forked with the function, so any old workers cannot run this one
+            for worker in list(self._workerList):
+                self._kill(worker)
+            self._function = function
+        iterator = iter(iterable)
+        exhausted = False
+        targetSet = set()
+        durationList = [] # sorted wall times of the completed targets, for choosing stragglers
+        try:
+            while True:
+                self._startWorkers()
+                for worker in self._workerList:
+                    if worker.target is not None:
+                        continue
+                    if not exhausted:
+                        try:
+                            target = _Target(next(iterator))
+                        except StopIteration:
+                            exhausted = True
+                        else:
+                            targetSet.add(target)
+                            self._dispatch(worker, target)
+                            continue
+                    straggler = self._findStraggler(targetSet, durationList, speculate)
+                    if straggler is None:
+                        break
+                    straggler.isSpeculated = True
+                    self._log("info", "Re-running a target speculatively after %0.1f sec: %s" %
+                              (time.time() - straggler.startTime, _describe(straggler.item)))
+                    self._dispatch(worker, straggler)
+                if exhausted and not targetSet and not [worker for worker in self._workerList
+                                                        if worker.target is not None]:
+                    return
+
+                busyList = [worker for worker in self._workerList if worker.target is not None]
+                readyList = _waitForReplies([worker.conn for worker in busyList],
+                                            self._getWaitTime(busyList, targetSet, durationList,
+                                                              targetTimeout, speculate, exhausted))
+                now = time.time()
+                for worker in busyList:
+                    target = worker.target
+                    if target is None:
+                        continue # killed because another copy of its target finished
+                    if worker.conn in readyList:
+                        try:
+                            reply = worker.conn.recv()
+                        except (EOFError, IOError):
+                            reply = None
+                        if reply is None:
+                            exitCode = self._reap(worker)
+                            reason = "lost its worker process, which died with exit code %s" % (exitCode,)
+                        elif target.isDone:
+                            # the other copy of this target has already been used
+                            self._release(worker)
+                            continue
+                        else:
+                            self._release(worker)
+                            targetSet.discard(target)
+                            target.isDone = True
+                            if target.workerList:
+                                self._log("info", "Using the first copy of a target to finish; "
+                                          "letting the other copy finish: %s" % (_describe(target.item),))
+                            if not reply[0]:
+                                self._log("warn", "Target failed in a worker process: %s\n%s" %
+                                          (_describe(target.item), reply[2]))
+                                raise reply[1]
+                            bisect.insort(durationList, now - worker.startTime)
+                            yield reply[1]
+                            continue
+                    elif target.isDone:
+                        continue # never kill a losing copy, which may be writing outputs
+                    elif targetTimeout is not None and now - worker.startTime > targetTimeout:
+                        self._kill(worker)
+                        reason = "timed out after %0.1f sec (limit %s sec); killed its worker process" % \
+                            (now - worker.startTime, targetTimeout)
+                    else:
+                        continue
+                    if worker in target.workerList:
+                        target.workerList.remove(worker)
+                    if target.isDone:
+                        self._log("warn", "The unused copy of a target %s: %s" %
+                                  (reason, _describe(target.item)))
+                        continue
+                    if target.workerList:
+                        self._log("warn", "A copy of a target %s; waiting for the other copy: %s" %
+                                  (reason, _describe(target.item)))
+                        continue
+                    targetSet.discard(target)
+                    self._log("warn", "Target %s: %s" % (reason, _describe(target.item)))
+                    if onFailure is None:
+                        raise TargetFailedError("Target %s: %s" % (reason, _describe(target.item)))
+                    yield onFailure(target.item, reason, now - target.startTime)
+        finally:
+            # kill the workers running abandoned targets, so they cannot send stale results
+            for worker in list(self._workerList):
+                if worker.target is None:
+                    continue
+                if worker.target.isDone:
+                    self._log("warn", "Killing the unused copy of a target; its outputs may be incomplete: %s" %
+                              (_describe(worker.target.item),))
+                self._kill(worker)
+
+    def close(self):
+        """!Tell the worker processes to exit once they are idle, and prevent further use of the pool"""
+        self._closed = True
+        for worker in self._workerList:
+            try:
+                worker.conn.send(None)
+            except Exception:
+                pass
+
+    def terminate(self):
+        """!Kill the worker processes at once, and prevent further use of the pool"""
+        self._closed = True
+        for worker in list(self._workerList):
+            self._kill(worker)
+
+    def join(self):
+        """!Wait for the worker processes to exit; call TargetPool.close or TargetPool.terminate first"""
+        for worker in self._workerList:
+            worker.process.join()
+            worker.conn.close()
+        self._workerList = []
+
+    def _startWorkers(self):
+        """Start worker processes, until there are self.processes of them"""
+        while len(self._workerList) < self.processes:
+            parentConn, childConn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_workerMain, args=(childConn, self._function,
+                self.initializer, self.initargs, self.maxTargetsPerWorker))
+            process.daemon = True
+            process.start()
+            childConn.close()
+            self._workerList.append(_Worker(process, parentConn))
+
+    def _dispatch(self, worker, target):
+        """Send a target to an idle worker"""
+        worker.conn.send(target.item)
+        worker.target = target
+        worker.startTime = time.time()
+        worker.numTargets += 1
+        target.workerList.append(worker)
+
+    def _release(self, worker):
+        """Mark a worker as idle after it returns a result, and replace it if it has run enough targets"""
+        if worker in worker.target.workerList:
+            worker.target.workerList.remove(worker)
+        worker.target = None
+        if self.maxTargetsPerWorker is not None and worker.numTargets >= self.maxTargetsPerWorker:
+            self._reap(worker)
+
+    def _kill(self, worker):
+        """Kill a worker process and forget it; a replacement is started when next needed"""
+        if worker.process.is_alive():
+            worker.process.terminate()
+        self._reap(worker)
+
+    def _reap(self, worker):
+        """Wait for a worker process that has exited or been killed and forget it; return its exit code"""
+        worker.process.join()
+        worker.conn.close()
+        if worker.target is not None and worker in worker.target.workerList:
+            worker.target.workerList.remove(worker)
+        worker.target = None
+        if worker in self._workerList:
+            self._workerList.remove(worker)
+        return worker.process.exitcode
+
+    def _findStraggler(self, targetSet, durationList, speculate):
+        """Return the running target that most deserves a speculative copy, or None if none does"""
+        if speculate <= 0 or not durationList:
+            return None
+        threshold = _getThreshold(durationList, speculate)
+        now = time.time()
+        candidateList = [target for target in targetSet
+                         if not target.isSpeculated and target.workerList and now - target.startTime > threshold]
+        if not candidateList:
+            return None
+        return min(candidateList, key=lambda target: target.startTime)
+
+    def _getWaitTime(self, busyList, targetSet, durationList, targetTimeout, speculate, exhausted):
+        """Return the time (sec) until a running target may time out or become a straggler, or None"""
+        now = time.time()
+        deadlineList = []
+        if targetTimeout is not None:
+            deadlineList += [worker.startTime + targetTimeout for worker in busyList if not worker.target.isDone]
+        if exhausted and speculate > 0 and durationList and len(busyList) < self.processes:
+            threshold = _getThreshold(durationList, speculate)
+            deadlineList += [target.startTime + threshold for target in targetSet if not target.isSpeculated]
+        if not deadlineList:
+            return None
+        return max(0.0, min(deadlineList) - now) + 0.01
+
+    def _log(self, level, msg):
+        """Log a message, if this pool has a log"""
+        if self.log is not None:
+            getattr(self.log, level)(msg)
+
+def _getThreshold(durationList, speculate):
+    """Return the wall time (sec) beyond which a target is among the slowest fraction speculate of targets"""
+    index = min(len(durationList) - 1, int((1.0 - min(speculate, 1.0)) * len(durationList)))
+    return durationList[index]
+
+def _waitForReplies(connList, timeout):
+    """Wait until a connection in connList is readable, or timeout (sec; None to wait forever) elapses
+
+    @return the list of readable connections
+    """
+    if not connList:
+        if timeout:
+            time.sleep(timeout)
+        return []
+    while True:
+        try:
+            readyFdList = select.select([conn.fileno() for conn in connList], [], [], timeout)[0]
+        except (OSError, select.error), e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        return [conn for conn in connList if conn.fileno() in readyFdList]
+
+def _describe(item):
+    """Return a short description of a target for a log message"""
+    try:
+        index, args = item
+        dataRef = args[0]
+        if hasattr(dataRef, "dataId"):
+            return "target %s, dataId=%s" % (index, dataRef.dataId)
+        return "target %s, dataId=%s" % (index, [ref.dataId for ref in dataRef])
+    except Exception:
+        return str(item)[:200]
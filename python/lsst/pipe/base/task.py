@@ -23,40 +23,48 @@ from __future__ import absolute_import, division
 import contextlib
 
 import lsstDebug
-from lsst.pex.config import ConfigurableField
-
-try:
-    import lsst.afw.display.ds9 as ds9
-except ImportError:
-    # afw is above pipe_base in the class hierarchy, so we have to cope without it.
-    # We'll warn on first use that it's unavailable, and then quietly swallow all
-    # references to it.
-    class Ds9Warning(object):
-        """A null pattern which warns once that ds9 is not available"""
-        def __init__(self):
-            super(Ds9Warning, self).__setattr__("_warned", False)
-        def __getattr__(self, name):
-            if name in ("GREEN", "YELLOW", "RED", "BLUE"):
-                # These are used in the Task.display definition, so don't warn when we use them
-                return self
-            if not super(Ds9Warning, self).__getattribute__("_warned"):
-                print "WARNING: afw's ds9 is not available"
-                super(Ds9Warning, self).__setattr__("_warned", True)
-            return self
-        def __setattr__(self, name, value):
-            return self
-        def __call__(self, *args, **kwargs):
-            return self
-    ds9 = Ds9Warning()
 
 import lsst.pex.logging as pexLog
 import lsst.daf.base as dafBase
-from .timer import logInfo
+from .timer import recordTiming, TimingBuffer
+from .spanTracer import traceSpan
+from .memoryTracer import traceMemory
 
 __all__ = ["Task", "TaskError"]
 
-## default ds9 colors for Task.display's ctypes argument
-_DefaultDS9CTypes = (ds9.GREEN, ds9.YELLOW, ds9.RED, ds9.BLUE) 
+class _Ds9Warning(object):
+    """A null pattern which warns once that ds9 is not available"""
+    def __init__(self):
+        super(_Ds9Warning, self).__setattr__("_warned", False)
+    def __getattr__(self, name):
+        if name in ("GREEN", "YELLOW", "RED", "BLUE"):
+            # These are used for the default ctypes of Task.display, so don't warn when we use them
+            return self
+        if not super(_Ds9Warning, self).__getattribute__("_warned"):
+            print "WARNING: afw's ds9 is not available"
+            super(_Ds9Warning, self).__setattr__("_warned", True)
+        return self
+    def __setattr__(self, name, value):
+        return self
+    def __call__(self, *args, **kwargs):
+        return self
+
+_ds9 = None
+
+def _getDs9():
+    """Return lsst.afw.display.ds9, importing it when first needed (it is slow to import)
+
+    afw is above pipe_base in the class hierarchy, so we have to cope without it.
+    If it is unavailable we warn on first use, and then quietly swallow all references to it.
+    """
+    global _ds9
+    if _ds9 is None:
+        try:
+            import lsst.afw.display.ds9 as ds9
+        except ImportError:
+            ds9 = _Ds9Warning()
+        _ds9 = ds9
+    return _ds9
 
 ## default ds9 point types for Task.display's ptypes argument
 _DefaultDS9PTypes = ("o", "+", "x", "*")
@@ -83,7 +91,8 @@ class Task(object):
     * config: task-specific configuration; an instance of ConfigClass (see below)
     * metadata: an lsst.daf.base.PropertyList for collecting task-specific metadata,
         e.g. data quality and performance metrics. This is data that is only meant to be
-        persisted, never to be used by the task.
+        persisted, never to be used by the task. Timing data recorded by \ref timer.timeMethod
+        "timeMethod" and Task.timer is buffered, and added to metadata when it is accessed.
     
     Subclasses typically have a method named "run" to perform the main data processing. Details:
     * run should process the minimum reasonable amount of data, typically a single CCD.
@@ -125,6 +134,7 @@ class Task(object):
         @throw RuntimeError if parentTask is not None and name is None.
         @throw RuntimeError if name is None and _DefaultName does not exist.
         """
+        self._timingBuffer = TimingBuffer()
         self.metadata = dafBase.PropertyList()
 
         if parentTask != None:
@@ -154,6 +164,21 @@ class Task(object):
         self._display = lsstDebug.Info(self.__module__).display
         self._taskDict[self._fullName] = self
 
+    @property
+    def metadata(self):
+        """!Metadata for this task (an lsst.daf.base.PropertyList), including buffered timing data"""
+        timingBuffer = self.__dict__.get("_timingBuffer")
+        if timingBuffer:
+            timingBuffer.flush(self._metadata)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        timingBuffer = self.__dict__.get("_timingBuffer")
+        if timingBuffer is not None:
+            timingBuffer.clear()
+        self._metadata = metadata
+
     def emptyMetadata(self):
         """!Empty (clear) the metadata for this Task and all sub-Tasks."""
         for subtask in self._taskDict.itervalues():
@@ -269,16 +294,20 @@ class Task(object):
             ...code to time...
         \endcode
 
-        See timer.logInfo for the information logged            
+        See timer.logInfo for the information logged; if a \ref spanTracer.SpanTracer "SpanTracer"
+        is installed then a span is also recorded for the block, and if a
+        \ref memoryTracer.MemoryTracer "MemoryTracer" is installed then the memory allocated by the block
+        is added to metadata.
         """
-        logInfo(obj = self, prefix = name + "Start", logLevel = logLevel)
-        try:
-            yield
-        finally:
-            logInfo(obj = self, prefix = name + "End",   logLevel = logLevel)
+        with traceSpan(self, name), traceMemory(self, name):
+            recordTiming(obj = self, prefix = name + "Start", logLevel = logLevel)
+            try:
+                yield
+            finally:
+                recordTiming(obj = self, prefix = name + "End",   logLevel = logLevel)
     
     def display(self, name, exposure=None, sources=(), matches=None,
-                ctypes=_DefaultDS9CTypes, ptypes=_DefaultDS9PTypes,
+                ctypes=None, ptypes=_DefaultDS9PTypes,
                 sizes=(4,),
                 pause=None, prompt=None):
         """!Display an exposure and/or sources
@@ -294,7 +323,7 @@ class Task(object):
             lsst.afw.table.ReferenceMatch), or None;
             if any matches are specified then exposure must be provided and have a lsst.afw.image.Wcs.
         @param[in] ctypes       array of colors to use on ds9 for displaying sources and matches
-            (in that order).
+            (in that order); if None then use green, yellow, red and blue.
             ctypes is indexed as follows, where ctypes is repeatedly cycled through, if necessary:
             - ctypes[i] is used to display sources[i]
             - ctypes[len(sources) + 2i] is used to display matches[i][0]
@@ -318,6 +347,10 @@ class Task(object):
             if (name not in self._display) or not self._display[name] or self._display[name] < 0:
                 return
 
+        ds9 = _getDs9()
+        if ctypes is None:
+            ctypes = (ds9.GREEN, ds9.YELLOW, ds9.RED, ds9.BLUE)
+
         if isinstance(self._display, int):
             frame = self._display
         elif isinstance(self._display, dict):
@@ -402,6 +435,7 @@ class Task(object):
         @param[in] doc      help text for the field
         @return a lsst.pex.config.ConfigurableField for this task
         """
+        from lsst.pex.config import ConfigurableField
         return ConfigurableField(doc=doc, target=cls)
 
     def _computeFullName(self, name):
@@ -22,14 +22,17 @@ from __future__ import absolute_import, division
 #
 """Utilities for measuring execution time.
 """
+import array
 import functools
 import resource
 import time
 import datetime
 
 from lsst.pex.logging import Log
+from .spanTracer import traceSpan
+from .memoryTracer import traceMemory
 
-__all__ = ["logInfo", "timeMethod"]
+__all__ = ["logInfo", "timeMethod", "TimingBuffer"]
 
 def logPairs(obj, pairs, logLevel=Log.DEBUG):
     """!Log (name, value) pairs to obj.metadata and obj.log
@@ -88,6 +91,85 @@ def logInfo(obj, prefix, logLevel=Log.DEBUG):
         logLevel = logLevel,
     )
 
+## Names of the items recorded by logInfo and TimingBuffer, after the prefix and excluding Utc
+_ItemNames = ("CpuTime", "UserTime", "SystemTime", "MaxResidentSetSize", "MinorPageFaults", "MajorPageFaults",
+    "BlockInputs", "BlockOutputs", "VoluntaryContextSwitches", "InvoluntaryContextSwitches")
+
+## Number of items recorded per sample by TimingBuffer: wall-clock time (for Utc), then _ItemNames
+_NumFields = 1 + len(_ItemNames)
+
+## Number of items of _ItemNames that are floating point; the rest are integer counters
+_NumFloatItems = 3
+
+class TimingBuffer(object):
+    """!Compact buffer of raw timing samples, converted to metadata and log messages only when needed
+
+    logInfo adds eleven items to metadata and formats a log message every time it is called, even if
+    the log message is not wanted. A TimingBuffer instead stores the raw values of each sample
+    (wall-clock time, CPU time and resource usage) in a preallocated array of doubles, formats a log message
+    only if the log would print it, and adds the samples to metadata, with the same names and types as logInfo,
+    when flush is called. Each \ref task.Task "Task" has a TimingBuffer that is flushed to its metadata
+    whenever the metadata is accessed, and that is used by \ref timeMethod "timeMethod" and Task.timer.
+    """
+    def __init__(self, capacity=16):
+        """!Construct a TimingBuffer
+
+        @param[in] capacity     number of samples for which to preallocate space; more is allocated as needed
+        """
+        self._data = array.array("d", [0.0]) * (capacity * _NumFields)
+        self._prefixList = []
+
+    def __len__(self):
+        """!Return the number of samples not yet flushed"""
+        return len(self._prefixList)
+
+    def record(self, prefix, log=None, logLevel=Log.DEBUG):
+        """!Record a sample
+
+        @param[in] prefix   name prefix, the resulting entries are \<prefix>CpuTime, etc. (see logInfo)
+        @param[in] log      log (an lsst.pex.logging.Log), or None; if the log prints messages at logLevel
+            then the sample is logged immediately
+        @param[in] logLevel log level (an lsst.pex.logging.Log level constant, e.g. lsst.pex.logging.Log.DEBUG)
+        """
+        cpuTime = time.clock()
+        res = resource.getrusage(resource.RUSAGE_SELF)
+        wallTime = time.time()
+        start = len(self._prefixList) * _NumFields
+        if start + _NumFields > len(self._data):
+            self._data.extend(self._data) # double the capacity
+        self._data[start:start + _NumFields] = array.array("d", (wallTime, cpuTime,
+            res.ru_utime, res.ru_stime, res.ru_maxrss, res.ru_minflt, res.ru_majflt,
+            res.ru_inblock, res.ru_oublock, res.ru_nvcsw, res.ru_nivcsw))
+        self._prefixList.append(prefix)
+        if log is not None and (not hasattr(log, "sends") or log.sends(logLevel)):
+            log.log(logLevel, "; ".join("%s=%s" % item for item in self._iterItems(len(self._prefixList) - 1)))
+
+    def flush(self, metadata):
+        """!Add all samples to metadata, with the same names and types as logInfo, and empty the buffer
+
+        @param[in,out] metadata     an instance of lsst.daf.base.PropertyList
+            (or other object with add(name, value) method)
+        """
+        prefixList, self._prefixList = self._prefixList, []
+        for i, prefix in enumerate(prefixList):
+            wallTime = self._data[i * _NumFields]
+            metadata.add(name = prefix + "Utc", value = datetime.datetime.utcfromtimestamp(wallTime).isoformat())
+            for name, value in self._iterItems(i, prefix):
+                metadata.add(name = name, value = value)
+
+    def clear(self):
+        """!Discard all samples"""
+        self._prefixList = []
+
+    def _iterItems(self, i, prefix=None):
+        """Iterate over (name, value) for sample i, excluding Utc"""
+        if prefix is None:
+            prefix = self._prefixList[i]
+        start = i * _NumFields + 1
+        for j, itemName in enumerate(_ItemNames):
+            value = self._data[start + j]
+            yield prefix + itemName, value if j < _NumFloatItems else long(value)
+
 def timeMethod(func):
     """!Decorator to measure duration of a task method
     
@@ -110,13 +192,33 @@ def timeMethod(func):
     @warning This decorator only works with instance methods of Task, or any class with these attributes:
     * metadata: an instance of lsst.daf.base.PropertyList (or other object with add(name, value) method)
     * log: an instance of lsst.pex.logging.Log
+    If the object also has a TimingBuffer as attribute _timingBuffer (as Task does),
+    the data are recorded in it instead of being added to metadata immediately.
+    If a \ref spanTracer.SpanTracer "SpanTracer" is installed, a span is also recorded for each call,
+    and if a \ref memoryTracer.MemoryTracer "MemoryTracer" is installed, the memory allocated by each call
+    is added to metadata.
     """
     @functools.wraps(func)
     def wrapper(self, *args, **keyArgs):
-        logInfo(obj = self, prefix = func.__name__ + "Start")
-        try:
-            res = func(self, *args, **keyArgs)
-        finally:
-            logInfo(obj = self, prefix = func.__name__ + "End")
+        with traceSpan(self, func.__name__), traceMemory(self, func.__name__):
+            recordTiming(obj = self, prefix = func.__name__ + "Start")
+            try:
+                res = func(self, *args, **keyArgs)
+            finally:
+                recordTiming(obj = self, prefix = func.__name__ + "End")
         return res
     return wrapper
+
+def recordTiming(obj, prefix, logLevel=Log.DEBUG):
+    """!Record timer information in obj._timingBuffer if obj has one, else call logInfo
+
+    @param obj      a \ref task.Task "Task", or any other object with attributes metadata and log
+        (see logInfo) and, optionally, _timingBuffer (a TimingBuffer)
+    @param prefix   name prefix, the resulting entries are \<prefix>CpuTime, etc.
+    @param logLevel log level (an lsst.pex.logging.Log level constant, such as lsst.pex.logging.Log.DEBUG)
+    """
+    timingBuffer = getattr(obj, "_timingBuffer", None)
+    if timingBuffer is None:
+        logInfo(obj = obj, prefix = prefix, logLevel = logLevel)
+    else:
+        timingBuffer.record(prefix = prefix, log = obj.log, logLevel = logLevel)
@@ -22,6 +22,8 @@
 #
 import itertools
 import os
+import shutil
+import tempfile
 import unittest
 
 import lsst.utils
@@ -139,6 +141,68 @@ class ArgumentParserTestCase(unittest.TestCase):
             self.assertEqual(idVal, predVal)
         self.assertEqual(len(namespace.id.refList), 3) # only have data for three of these
 
+    def testIdUnion(self):
+        """Test that data IDs specified by several --id arguments are only included once"""
+        namespace = self.ap.parse_args(
+            config = self.config,
+            args = [DataPath, "--id", "filter=g^r", "visit=1^2", "--id", "filter=r", "visit=2^3"],
+        )
+        self.assertEqual(len(namespace.id.dataIds), 5)
+        self.assertEqual([(dataId["filter"], dataId["visit"]) for dataId in namespace.id.idList],
+                         [("g", 1), ("g", 2), ("r", 1), ("r", 2), ("r", 3)])
+
+    def testDiscoveryThreads(self):
+        """Test finding data references with a pool of threads, and removal of duplicates"""
+        args = [DataPath, "--id", "filter=g^r", "visit=1^2^3", "--id", "visit=1"]
+        namespace = self.ap.parse_args(config=self.config, args=args)
+        serialDataIdList = [dataRef.dataId for dataRef in namespace.id.refList]
+        self.assertEqual(len(serialDataIdList), 3) # visit=1 is only found once
+
+        namespace = self.ap.parse_args(config=self.config, args=args + ["--discovery-threads", "4"])
+        self.assertEqual(namespace.discoveryThreads, 4)
+        self.assertEqual([dataRef.dataId for dataRef in namespace.id.refList], serialDataIdList)
+
+    def testExistenceIndex(self):
+        """Test that --existence-index finds the same data as butler.datasetExists"""
+        args = [DataPath, "--id", "filter=g^r", "visit=1^2^3^22"]
+        namespace = self.ap.parse_args(config=self.config, args=args)
+        self.assertIsNone(namespace.existenceIndex)
+        dataIdList = [dataRef.dataId for dataRef in namespace.id.refList]
+
+        namespace = self.ap.parse_args(config=self.config, args=args + ["--existence-index"])
+        self.assertGreater(namespace.existenceIndex.numListings, 0)
+        self.assertEqual([dataRef.dataId for dataRef in namespace.id.refList], dataIdList)
+        self.assertEqual(len(namespace.existenceIndex.getExistingPaths("raw")), len(dataIdList))
+
+    def testDataRefCache(self):
+        """Test that --dataref-cache restores the same data references"""
+        outPath = tempfile.mkdtemp()
+        try:
+            args = [DataPath, "--output", outPath, "--id", "filter=g^r", "visit=1^2^3^22"]
+            namespace = self.ap.parse_args(config=self.config, args=args)
+            self.assertIsNone(namespace.dataRefCache)
+            dataIdList = [dataRef.dataId for dataRef in namespace.id.refList]
+
+            for i in range(2):
+                namespace = self.ap.parse_args(config=self.config, args=args + ["--dataref-cache"])
+                self.assertEqual([dataRef.dataId for dataRef in namespace.id.refList], dataIdList)
+                self.assertEqual(len(os.listdir(os.path.join(outPath, "_dataRefCache"))), 1)
+
+            namespace = self.ap.parse_args(config=self.config, args=args + ["--clobber-dataref-cache"])
+            self.assertTrue(namespace.dataRefCache.refresh)
+            self.assertEqual([dataRef.dataId for dataRef in namespace.id.refList], dataIdList)
+        finally:
+            shutil.rmtree(outPath, ignore_errors=True)
+
+    def testLazyButler(self):
+        """Test that the butler is only constructed when needed"""
+        ap = pipeBase.ArgumentParser(name="argumentParser")
+        namespace = ap.parse_args(config=self.config, args=[DataPath])
+        self.assertNotIn("butler", vars(namespace))
+        butler = namespace.butler
+        self.assertIsNotNone(butler)
+        self.assertIs(namespace.butler, butler)
+
     def testIdDuplicate(self):
         """Verify that each ID name can only appear once in a given ID argument"""
         self.assertRaises(SystemExit, self.ap.parse_args,
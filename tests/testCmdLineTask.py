@@ -65,6 +65,65 @@ class NoMultiprocessTask(TestTask):
     canMultiprocess = False
 
 
+class GeneratorTaskRunner(pipeBase.TaskRunner):
+    """Version of TaskRunner whose getTargetList returns a generator"""
+    @staticmethod
+    def getTargetList(parsedCmd):
+        return ((dataRef, {}) for dataRef in parsedCmd.id.refList)
+
+class GeneratorTask(TestTask):
+    """Version of TestTask that uses GeneratorTaskRunner"""
+    RunnerClass = GeneratorTaskRunner
+
+
+class OutputTask(TestTask):
+    """Version of TestTask that declares its metadata as its output dataset"""
+    def _getOutputDatasetNames(self):
+        return [self._getMetadataName()]
+
+
+class CatchingTaskRunner(pipeBase.TaskRunner):
+    """Version of TaskRunner whose __call__ catches task failures and reports them with markFailed
+
+    If class variable doFail is true then every target fails.
+    """
+    doFail = False
+    def __call__(self, args):
+        dataRef, kwargs = args
+        try:
+            if self.doFail:
+                raise pipeBase.TaskError("Failed by request: doFail is true")
+            self.getTask(args).run(dataRef, **kwargs)
+        except pipeBase.TaskError:
+            self.markFailed()
+        return pipeBase.Struct(dataRef=dataRef)
+
+class CatchingTask(TestTask):
+    """Version of TestTask that uses CatchingTaskRunner"""
+    RunnerClass = CatchingTaskRunner
+
+
+class FailedResultTaskRunner(pipeBase.TaskRunner):
+    """Version of TaskRunner whose __call__ catches task failures and reports them in its result
+
+    If class variable doFail is true then every target fails.
+    """
+    doFail = False
+    def __call__(self, args):
+        dataRef, kwargs = args
+        try:
+            if self.doFail:
+                raise pipeBase.TaskError("Failed by request: doFail is true")
+            self.getTask(args).run(dataRef, **kwargs)
+        except pipeBase.TaskError:
+            return pipeBase.Struct(dataRef=dataRef, failed=True)
+        return pipeBase.Struct(dataRef=dataRef, failed=False)
+
+class FailedResultTask(TestTask):
+    """Version of TestTask that uses FailedResultTaskRunner"""
+    RunnerClass = FailedResultTaskRunner
+
+
 class CmdLineTaskTestCase(unittest.TestCase):
     """A test case for CmdLineTask
     """
@@ -132,6 +191,19 @@ class CmdLineTaskTestCase(unittest.TestCase):
         self.assertEqual(result.metadata.get("numProcessed"), 0)
         self.assertEqual(retVal.resultList[0].result, None)
 
+    def testConfigCheck(self):
+        """Test that a rerun checks the existing config, which must match unless clobbered
+        """
+        args = [DataPath, "--output", self.outPath, "--id", "visit=3", "filter=r"]
+        retVal = TestTask.parseAndRun(args=args)
+        self.assertEqual(len(retVal.resultList), 1)
+        retVal = TestTask.parseAndRun(args=args)
+        self.assertEqual(len(retVal.resultList), 1)
+        retVal = TestTask.parseAndRun(args=args + ["--config", "floatField=-99.9"])
+        self.assertEqual(retVal.resultList, [])
+        retVal = TestTask.parseAndRun(args=args + ["--config", "floatField=-99.9", "--clobber-config"])
+        self.assertEqual(len(retVal.resultList), 1)
+
     def testBackupConfig(self):
         """Test backup config file creation
         """
@@ -160,6 +232,103 @@ class CmdLineTaskTestCase(unittest.TestCase):
                                                  "-j", "5", "--id", "visit=2", "filter=r"])
             self.assertEqual(result.taskRunner.numProcesses, 5 if TaskClass.canMultiprocess else 1)
 
+    def testStreaming(self):
+        """Test chunked, bounded dispatch of targets from a generator
+        """
+        for numProcesses in (1, 2):
+            retVal = GeneratorTask.parseAndRun(args=[DataPath, "--output", self.outPath,
+                                                     "-j", str(numProcesses), "--chunksize", "2",
+                                                     "--max-in-flight", "2", "--id", "visit=1^2^3"],
+                                               doReturnResults=True)
+            self.assertEqual(retVal.taskRunner.chunksize, 2)
+            self.assertEqual(retVal.taskRunner.maxInFlight, 2)
+            self.assertEqual(len(retVal.resultList), len(retVal.parsedCmd.id.refList))
+            # run returns the results in the order of the targets, even when multiprocessing
+            self.assertEqual([result.dataRef.dataId["visit"] for result in retVal.resultList],
+                             [dataRef.dataId["visit"] for dataRef in retVal.parsedCmd.id.refList])
+            for result in retVal.resultList:
+                self.assertEqual(result.result.numProcessed, 1)
+
+    def testReuseTask(self):
+        """Test reusing one task for all targets
+        """
+        args = [DataPath, "--output", self.outPath, "--id", "visit=1^2^3"]
+        retVal = TestTask.parseAndRun(args=args + ["--reuse-task"], doReturnResults=True)
+        self.assertTrue(retVal.taskRunner.reuseTask)
+        numTargets = len(retVal.parsedCmd.id.refList)
+        self.assertGreater(numTargets, 1)
+        # the same task ran every target, but its metadata was emptied between targets
+        self.assertEqual([result.result.numProcessed for result in retVal.resultList],
+                         range(1, numTargets + 1))
+        for result in retVal.resultList:
+            self.assertEqual(result.metadata.get("numProcessed"), result.result.numProcessed)
+            self.assertEqual(len(result.metadata.getArray("runStartCpuTime")), 1)
+
+        retVal = TestTask.parseAndRun(args=args + ["--reuse-task", "-j", "2"], doReturnResults=True)
+        self.assertEqual(len(retVal.resultList), numTargets)
+
+    def testSchedule(self):
+        """Test longest-first scheduling using costs from the metadata of an earlier run
+        """
+        args = [DataPath, "--output", self.outPath, "--id", "visit=1^2^3"]
+        retVal = TestTask.parseAndRun(args=args)
+        costModel = pipeBase.MetadataCostModel(metadataName="test_metadata", taskName="test")
+        for dataRef in retVal.parsedCmd.id.refList:
+            self.assertGreaterEqual(costModel.getCost((dataRef, {})), 0.0)
+        self.assertIsNone(pipeBase.TargetCostModel().getCost((dataRef, {})))
+
+        retVal = TestTask.parseAndRun(args=args + ["-j", "2", "--schedule", "longest-first"],
+                                      doReturnResults=True)
+        self.assertEqual(retVal.taskRunner.schedule, "longest-first")
+        self.assertEqual(len(retVal.resultList), len(retVal.parsedCmd.id.refList))
+
+        # with a run summary, costs are read from it
+        retVal = TestTask.parseAndRun(args=args + ["--run-summary"])
+        costModel = retVal.taskRunner.makeCostModel(retVal.parsedCmd)
+        self.assertIsInstance(costModel, pipeBase.RunSummaryCostModel)
+        for dataRef in retVal.parsedCmd.id.refList:
+            self.assertGreaterEqual(costModel.getCost((dataRef, {})), 0.0)
+
+    def testSkipExisting(self):
+        """Test skipping targets whose declared outputs exist, and resuming with a journal
+        """
+        args = [DataPath, "--output", self.outPath, "--id", "visit=1^2^3"]
+        retVal = OutputTask.parseAndRun(args=args[:-1] + ["visit=1"])
+        self.assertEqual(len(retVal.resultList), 1)
+
+        for extraArgs in ([], ["--discovery-threads", "2", "--existence-index"]):
+            retVal = OutputTask.parseAndRun(args=args + ["--skip-existing"] + extraArgs, doReturnResults=True)
+            numTargets = len(retVal.parsedCmd.id.refList)
+            self.assertEqual(len(retVal.resultList), numTargets - 1)
+            self.assertNotIn(1, [result.dataRef.dataId["visit"] for result in retVal.resultList])
+
+        # TestTask declares no outputs, so nothing is skipped
+        retVal = TestTask.parseAndRun(args=args + ["--skip-existing"], doReturnResults=True)
+        self.assertEqual(len(retVal.resultList), numTargets)
+
+        retVal = TestTask.parseAndRun(args=args + ["--resume"], doReturnResults=True)
+        self.assertEqual(len(retVal.resultList), numTargets)
+        retVal = TestTask.parseAndRun(args=args + ["--resume"], doReturnResults=True)
+        self.assertEqual(retVal.resultList, [])
+
+    def testResumeCustomCall(self):
+        """Test that targets failed by a TaskRunner.__call__ that catches exceptions are not journaled as done
+        """
+        for TaskClass in (CatchingTask, FailedResultTask):
+            outPath = os.path.join(self.outPath, TaskClass.__name__)
+            args = [DataPath, "--output", outPath, "--id", "visit=1^2^3", "--resume"]
+            TaskClass.RunnerClass.doFail = True
+            try:
+                retVal = TaskClass.parseAndRun(args=args, doReturnResults=True)
+            finally:
+                TaskClass.RunnerClass.doFail = False
+            numTargets = len(retVal.parsedCmd.id.refList)
+            self.assertEqual(len(retVal.resultList), numTargets)
+            retVal = TaskClass.parseAndRun(args=args, doReturnResults=True)
+            self.assertEqual(len(retVal.resultList), numTargets)
+            retVal = TaskClass.parseAndRun(args=args, doReturnResults=True)
+            self.assertEqual(retVal.resultList, [])
+
     def testCannotConstructTask(self):
         """Test error handling when a task cannot be constructed
         """
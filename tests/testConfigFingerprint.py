@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
+
+class FingerprintConfig(pexConfig.Config):
+    threshold = pexConfig.Field(doc="a parameter", dtype=float, default=5.0)
+    name = pexConfig.Field(doc="another parameter", dtype=str, default="foo")
+
+class PersistedConfig(object):
+    """Stand-in for a config that persists its lines in a given order, with comments"""
+    def __init__(self, lineList):
+        self.lineList = lineList
+
+    def saveToStream(self, out, root="config"):
+        for line in self.lineList:
+            out.write(line + "\n")
+
+class FakeButler(object):
+    """Butler that reports the path of datasets of type <datasetType>_filename"""
+    def __init__(self, pathDict):
+        self.pathDict = pathDict
+
+    def get(self, datasetType, immediate=False):
+        return [self.pathDict[datasetType[:-len("_filename")]]]
+
+def writeConfig(configPath, threshold, queue):
+    """Write a config with the given threshold to configPath, if absent; put the result on queue"""
+    config = FingerprintConfig()
+    config.threshold = threshold
+    queue.put((threshold, pipeBase.writeConfigIfAbsent(config, configPath)))
+
+class ConfigFingerprintTestCase(unittest.TestCase):
+    """A test case for config digests and fingerprints
+    """
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp()
+        self.configPath = os.path.join(self.outDir, "repo", "config", "test.py")
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def testConfigDigest(self):
+        """Test that the digest depends on the values, but not the order or comments, of the persisted config
+        """
+        digest = pipeBase.computeConfigDigest(PersistedConfig(["import foo", "config.a=1", "config.b='x'"]))
+        self.assertEqual(pipeBase.computeConfigDigest(
+            PersistedConfig(["# b is a str", "config.b='x'", "", "import foo", "# a is an int", "config.a=1"])),
+            digest)
+        self.assertNotEqual(pipeBase.computeConfigDigest(PersistedConfig(["import foo", "config.a=2",
+                                                                          "config.b='x'"])), digest)
+
+    def testConfigValueDigest(self):
+        """Test that the digest of a config depends on its values"""
+        config = FingerprintConfig()
+        digest = pipeBase.computeConfigDigest(config)
+        self.assertEqual(pipeBase.computeConfigDigest(FingerprintConfig()), digest)
+        config.threshold = 6.0
+        self.assertNotEqual(pipeBase.computeConfigDigest(config), digest)
+
+    def testGetDatasetPath(self):
+        """Test getDatasetPath
+        """
+        butler = FakeButler(dict(test_config=self.configPath))
+        self.assertEqual(pipeBase.getDatasetPath(butler, "test_config"), self.configPath)
+        self.assertIsNone(pipeBase.getDatasetPath(butler, "other_config"))
+
+    def testWriteIfAbsent(self):
+        """Test that a config is written once, with a fingerprint that is valid until the config changes
+        """
+        config = FingerprintConfig()
+        digest = pipeBase.computeConfigDigest(config)
+        self.assertIsNone(pipeBase.readConfigFingerprint(self.configPath))
+        self.assertTrue(pipeBase.writeConfigIfAbsent(config, self.configPath))
+        self.assertEqual(pipeBase.readConfigFingerprint(self.configPath), digest)
+
+        otherConfig = FingerprintConfig()
+        otherConfig.threshold = 6.0
+        self.assertFalse(pipeBase.writeConfigIfAbsent(otherConfig, self.configPath))
+        self.assertEqual(pipeBase.readConfigFingerprint(self.configPath), digest)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.configPath))), ["test.py", "test.py.digest"])
+
+        # a config changed without updating its fingerprint invalidates the fingerprint
+        with open(self.configPath, "a") as f:
+            f.write("config.threshold=6.0\n")
+        self.assertIsNone(pipeBase.readConfigFingerprint(self.configPath))
+        pipeBase.writeConfigFingerprint(self.configPath, pipeBase.computeConfigDigest(otherConfig))
+        self.assertEqual(pipeBase.readConfigFingerprint(self.configPath),
+                         pipeBase.computeConfigDigest(otherConfig))
+
+    def testConcurrentWrite(self):
+        """Test that exactly one of several processes writing different configs at once succeeds
+        """
+        queue = multiprocessing.Queue()
+        processList = [multiprocessing.Process(target=writeConfig, args=(self.configPath, float(i), queue))
+                       for i in range(8)]
+        for process in processList:
+            process.start()
+        resultList = [queue.get(timeout=30) for process in processList]
+        for process in processList:
+            process.join()
+        writtenList = [threshold for threshold, written in resultList if written]
+        self.assertEqual(len(writtenList), 1)
+        config = FingerprintConfig()
+        config.threshold = writtenList[0]
+        self.assertEqual(pipeBase.readConfigFingerprint(self.configPath), pipeBase.computeConfigDigest(config))
+
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(ConfigFingerprintTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import cPickle as pickle
+import collections
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pipe.base as pipeBase
+
+class DataIdSetTestCase(unittest.TestCase):
+    """A test case for DataIdSpec and DataIdSet
+    """
+    def testSpec(self):
+        """Test that a DataIdSpec computes the cross product lazily, in order, without duplicates"""
+        spec = pipeBase.DataIdSpec(collections.OrderedDict([("visit", [1, 2, 1]), ("ccd", range(100000))]))
+        self.assertEqual(len(spec), 200000)
+        dataIdIter = iter(spec)
+        self.assertEqual(dict(dataIdIter.next()), dict(visit=1, ccd=0))
+        self.assertEqual(dict(dataIdIter.next()), dict(visit=1, ccd=1))
+        self.assertIn(dict(visit=2, ccd=99999), spec)
+        self.assertNotIn(dict(visit=3, ccd=0), spec)
+        self.assertNotIn(dict(visit=1), spec)
+        self.assertNotIn(dict(visit=1, ccd=0, filter="g"), spec)
+
+    def testMapValues(self):
+        """Test that mapValues calls the function once per distinct value"""
+        callList = []
+        def cast(key, value):
+            callList.append((key, value))
+            return int(value)
+        spec = pipeBase.DataIdSpec(collections.OrderedDict([("visit", ["1", "2"]), ("ccd", ["0", "1", "2"])]))
+        castSpec = spec.mapValues(cast)
+        self.assertEqual(len(callList), 5)
+        self.assertEqual([dataId.values() for dataId in castSpec], [[v, c] for v in (1, 2) for c in (0, 1, 2)])
+
+    def testSetAlgebra(self):
+        """Test union and difference of data ID specifications"""
+        spec1 = pipeBase.DataIdSpec(collections.OrderedDict([("visit", [1, 2]), ("ccd", [0, 1])]))
+        spec2 = pipeBase.DataIdSpec(collections.OrderedDict([("visit", [2, 3]), ("ccd", [1, 2])]))
+        excluded = pipeBase.DataIdSpec(dict(visit=[3], ccd=[1]))
+        dataIdSet = pipeBase.DataIdSet([spec1]) | spec2
+        self.assertEqual(len(dataIdSet), 7)
+        dataIdSet -= excluded
+        predIdList = [(1, 0), (1, 1), (2, 0), (2, 1), (2, 2), (3, 2)]
+        self.assertEqual([(dataId["visit"], dataId["ccd"]) for dataId in dataIdSet], predIdList)
+        self.assertIn(dict(visit=2, ccd=2), dataIdSet)
+        self.assertNotIn(dict(visit=3, ccd=1), dataIdSet)
+        self.assertEqual(len(pickle.loads(pickle.dumps(dataIdSet))), len(predIdList))
+        self.assertFalse(pipeBase.DataIdSet([spec1]) - spec1)
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(DataIdSetTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
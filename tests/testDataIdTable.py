@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import collections
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pipe.base as pipeBase
+
+class SimpleButler(object):
+    """Minimal stand-in for a butler that knows the types of data ID keys"""
+    def getKeys(self, datasetType, level):
+        return dict(visit=int, ccd=int, filter=str, expTime=float)
+
+class DataIdTableTestCase(unittest.TestCase):
+    """A test case for DataIdTable
+    """
+    def testFromDicts(self):
+        """Test construction from data ID dicts and reading them back"""
+        dataIdList = [collections.OrderedDict([("visit", str(v)), ("filter", f)])
+                      for v in range(5) for f in "gr"]
+        table = pipeBase.DataIdTable.fromDicts(dataIdList)
+        self.assertEqual(len(table), 10)
+        self.assertEqual(table.keys(), ["visit", "filter"])
+        self.assertEqual(list(table), dataIdList)
+        self.assertEqual(table[3], dataIdList[3])
+        self.assertRaises(ValueError, pipeBase.DataIdTable.fromDicts, [dict(visit=1), dict(ccd=1)])
+
+    def testFromSpec(self):
+        """Test that fromSpec computes the same data IDs, in the same order, as the DataIdSpec"""
+        spec = pipeBase.DataIdSpec(collections.OrderedDict([("visit", [1, 2, 3]), ("ccd", [0, 1]),
+                                                            ("filter", ["g", "r"])]))
+        self.assertEqual(list(pipeBase.DataIdTable.fromSpec(spec)), list(spec))
+
+    def testCast(self):
+        """Test casting, including by DataIdContainer.castDataIds, and errors"""
+        table = pipeBase.DataIdTable(collections.OrderedDict([
+            ("visit", ["1", "22", "1"]), ("filter", ["g", "r", "i"]), ("expTime", ["15", "30.5", "15"]),
+        ]))
+        container = pipeBase.DataIdContainer()
+        container.setDatasetType("raw")
+        container.dataIds = table
+        container.castDataIds(butler=SimpleButler())
+        self.assertIsInstance(container.dataIds, pipeBase.DataIdTable)
+        self.assertEqual(container.idList[1], dict(visit=22, filter="r", expTime=30.5))
+        self.assertIsInstance(container.idList[0]["visit"], int)
+
+        badTable = pipeBase.DataIdTable(dict(visit=["1", "2", "x3"]))
+        with self.assertRaises(TypeError) as cm:
+            badTable.cast(dict(visit=int))
+        self.assertIn("'x3'", str(cm.exception))
+        bigTable = pipeBase.DataIdTable(dict(visit=["1", "99999999999999999999"]))
+        with self.assertRaises(TypeError) as cm:
+            bigTable.cast(dict(visit=int))
+        self.assertIn("'99999999999999999999'", str(cm.exception))
+        self.assertIn("'visit'", str(cm.exception))
+        container.dataIds = pipeBase.DataIdTable(dict(visit=["1"], foo=["bar"]))
+        self.assertRaises(KeyError, container.castDataIds, butler=SimpleButler())
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(DataIdTableTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
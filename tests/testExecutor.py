@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import socket
+import subprocess
+import sys
+import time
+import multiprocessing
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pipe.base as pipeBase
+
+AuthKey = "testExecutor"
+
+def _run(item):
+    """Return (item, pid), after raising or exiting if item says so"""
+    if item == "raise":
+        raise ValueError("intentional error")
+    if item == "exit":
+        os._exit(1)
+    return item, os.getpid()
+
+def _runWorker(address):
+    """Run a socket worker, retrying for a while until the executor is listening"""
+    for i in range(100):
+        try:
+            pipeBase.runSocketWorker(address, AuthKey)
+            return
+        except (socket.error, EOFError):
+            time.sleep(0.02)
+
+def _getFreeAddress():
+    """Return an address (host, port) on localhost that is not in use"""
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    address = sock.getsockname()
+    sock.close()
+    return address
+
+class ExecutorTestCase(unittest.TestCase):
+    """A test case for executors"""
+    def runExecutor(self, executor, itemList):
+        """Run _run on itemList and return a dict of item: pid, closing the executor"""
+        try:
+            return dict(executor.imapUnordered(_run, itemList))
+        finally:
+            executor.close()
+            executor.join()
+
+    def testSerialAndPool(self):
+        """Test SerialExecutor and PoolExecutor"""
+        resultDict = self.runExecutor(pipeBase.SerialExecutor(), range(5))
+        self.assertEqual(resultDict, dict.fromkeys(range(5), os.getpid()))
+
+        for chunksize, maxInFlight in ((1, None), (3, 2)):
+            resultDict = self.runExecutor(pipeBase.PoolExecutor(2, chunksize=chunksize, maxInFlight=maxInFlight),
+                                          range(20))
+            self.assertEqual(sorted(resultDict), range(20))
+            self.assertNotIn(os.getpid(), resultDict.values())
+
+    def testParseAddress(self):
+        """Test parseAddress"""
+        self.assertEqual(pipeBase.parseAddress("example.com:1234"), ("example.com", 1234))
+        self.assertEqual(pipeBase.parseAddress(":0"), ("", 0))
+        self.assertRaises(ValueError, pipeBase.parseAddress, "example.com")
+
+    def testSocket(self):
+        """Test SocketExecutor with workers on localhost, which connect while it runs, and some of which
+        disconnect
+
+        The worker processes are started before the executor, so they do not inherit its listening socket.
+        """
+        address = _getFreeAddress()
+        processList = [multiprocessing.Process(target=_runWorker, args=(address,)) for i in range(3)]
+        for process in processList:
+            process.start()
+        # the worker that receives "exit" disconnects, so "exit" is sent to one other worker,
+        # and then abandoned
+        failedList = []
+        def onFailure(item, reason, wallTime):
+            failedList.append(item)
+            return item, None
+        executor = pipeBase.SocketExecutor(address, AuthKey, onFailure=onFailure)
+        self.assertEqual(executor.address, address)
+        resultDict = self.runExecutor(executor, range(30) + ["exit"])
+        self.assertEqual(sorted(resultDict), range(30) + ["exit"])
+        self.assertEqual(failedList, ["exit"])
+        self.assertNotIn(os.getpid(), resultDict.values())
+        for process in processList:
+            process.join()
+
+        # an exception raised by the function is raised here
+        address = _getFreeAddress()
+        process = multiprocessing.Process(target=_runWorker, args=(address,))
+        process.start()
+        executor = pipeBase.SocketExecutor(address, AuthKey)
+        self.assertRaises(ValueError, self.runExecutor, executor, [0, "raise", 1])
+        process.join()
+
+    def testWorkerCommand(self):
+        """Test workers started with python -m lsst.pipe.base.executor"""
+        address = _getFreeAddress()
+        executor = pipeBase.SocketExecutor(address, AuthKey)
+        env = dict(os.environ, PIPE_BASE_AUTHKEY=AuthKey)
+        process = subprocess.Popen([sys.executable, "-m", "lsst.pipe.base.executor", "-j", "2",
+                                    "%s:%d" % address], env=env, close_fds=True)
+        try:
+            resultList = list(executor.imapUnordered(abs, range(-10, 0)))
+        finally:
+            executor.close()
+            executor.join()
+        self.assertEqual(sorted(resultList), range(1, 11))
+        self.assertEqual(process.wait(), 0)
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(ExecutorTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pipe.base as pipeBase
+
+class SimpleLocation(object):
+    """Minimal stand-in for a ButlerLocation"""
+    def __init__(self, path):
+        self.path = path
+
+    def getLocations(self):
+        return [self.path]
+
+class SimpleMapper(object):
+    """Minimal stand-in for a mapper that puts dataset "raw" in <root>/raw/v<visit>/c<ccd>.fits"""
+    def __init__(self, root):
+        self.root = root
+
+    def map(self, datasetType, dataId, write=False):
+        if datasetType != "raw":
+            raise KeyError("Unknown dataset type %r" % (datasetType,))
+        return SimpleLocation(os.path.join(self.root, "raw", "v%(visit)d" % dataId, "c%(ccd)d.fits[0]" % dataId))
+
+class SimpleButler(object):
+    """Minimal stand-in for a butler with a mapper"""
+    def __init__(self, root):
+        self.mapper = SimpleMapper(root)
+
+class ExistenceIndexTestCase(unittest.TestCase):
+    """A test case for ExistenceIndex
+    """
+    def setUp(self):
+        self.rootPath = tempfile.mkdtemp()
+        self.inputPath = os.path.join(self.rootPath, "input")
+        self.outputPath = os.path.join(self.inputPath, "rerun", "output")
+        os.makedirs(os.path.join(self.inputPath, "raw", "v1"))
+        os.makedirs(os.path.join(self.outputPath, "raw", "v2"))
+        os.symlink(self.inputPath, os.path.join(self.outputPath, "_parent"))
+        for path in (
+            os.path.join(self.inputPath, "raw", "v1", "c0.fits"),
+            os.path.join(self.outputPath, "raw", "v2", "c1.fits"),
+        ):
+            open(path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.rootPath)
+
+    def testExists(self):
+        """Test existence queries, including a search through the _parent link"""
+        index = pipeBase.ExistenceIndex(
+            butler = SimpleButler(self.outputPath),
+            rootList = [self.outputPath, self.inputPath, None],
+        )
+        self.assertTrue(index.datasetExists("raw", dict(visit=1, ccd=0)))
+        self.assertTrue(index.datasetExists("raw", dict(visit=2, ccd=1)))
+        self.assertFalse(index.datasetExists("raw", dict(visit=1, ccd=1)))
+        self.assertFalse(index.datasetExists("raw", dict(visit=3, ccd=0)))
+        self.assertIsNone(index.datasetExists("unknown", dict(visit=1, ccd=0)))
+        self.assertEqual(index.getExistingPaths("raw"), set([
+            os.path.join(self.inputPath, "raw", "v1", "c0.fits"),
+            os.path.join(self.outputPath, "raw", "v2", "c1.fits"),
+        ]))
+
+        # each directory is listed once
+        numListings = index.numListings
+        self.assertTrue(index.datasetExists("raw", dict(visit=1, ccd=0)))
+        self.assertFalse(index.datasetExists("raw", dict(visit=1, ccd=2)))
+        self.assertEqual(index.numListings, numListings)
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(ExistenceIndexTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import subprocess
+import sys
+import textwrap
+import unittest
+
+import lsst.utils.tests as utilsTests
+
+## Modules that are slow to import and that importing lsst.pipe.base should not import
+HeavyModuleNames = ("lsst.afw.display.ds9", "lsst.afw.table", "lsst.daf.persistence", "lsst.pex.config")
+
+## Script that imports lsst.pipe.base and prints the import time (sec), the maximum resident set size
+## after import (as reported by getrusage) and the heavy modules that were imported
+ImportScript = textwrap.dedent("""
+    import resource
+    import sys
+    import time
+    startTime = time.time()
+    import lsst.pipe.base
+    duration = time.time() - startTime
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print duration, maxRss, " ".join(name for name in %r if name in sys.modules)
+""" % (HeavyModuleNames,))
+
+class ImportTestCase(unittest.TestCase):
+    """A test case for the cost of importing lsst.pipe.base
+    """
+    def testImport(self):
+        """Measure the time and memory used to import lsst.pipe.base, and check it imports no heavy modules
+
+        lsst.pipe.base is imported in a new process, so the measurement is not affected by modules
+        that were already imported.
+        """
+        output = subprocess.check_output([sys.executable, "-c", ImportScript])
+        fieldList = output.split()
+        duration, maxRss = float(fieldList[0]), int(fieldList[1])
+        print "import lsst.pipe.base took %0.3f sec; max RSS after import = %d" % (duration, maxRss)
+        self.assertEqual(fieldList[2:], [])
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(ImportTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
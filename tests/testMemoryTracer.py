@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
+import lsst.pipe.base.memoryTracer as memoryTracer
+
+class LeafTask(pipeBase.Task):
+    ConfigClass = pexConfig.Config
+
+    @pipeBase.timeMethod
+    def run(self):
+        self.kept = [0] * 2000000
+        temp = [1] * 4000000
+        del temp
+
+class LeafConfig(pexConfig.Config):
+    leaf = LeafTask.makeField("leaf task")
+
+class RootTask(pipeBase.Task):
+    ConfigClass = LeafConfig
+    _DefaultName = "root"
+
+    def __init__(self, **keyArgs):
+        pipeBase.Task.__init__(self, **keyArgs)
+        self.makeSubtask("leaf")
+
+    @pipeBase.timeMethod
+    def run(self):
+        with self.timer("inner"):
+            self.leaf.run()
+
+class TracemallocWithoutResetPeak(object):
+    """A tracemalloc module without reset_peak, as in Python < 3.9 and pytracemalloc
+
+    If tracemalloc is not available then no Python memory is traced.
+    """
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        if name == "reset_peak":
+            raise AttributeError(name)
+        if self._module is None:
+            return dict(is_tracing=lambda: True, get_traced_memory=lambda: (0, 0))[name]
+        return getattr(self._module, name)
+
+class MemoryTracerTestCase(unittest.TestCase):
+    """A test case for MemoryTracer
+    """
+    def setUp(self):
+        self.tracer = pipeBase.MemoryTracer(numTopSites=3)
+        self.oldTracer = pipeBase.setMemoryTracer(self.tracer)
+
+    def tearDown(self):
+        pipeBase.setMemoryTracer(self.oldTracer)
+        self.tracer.stop()
+
+    def testMetadata(self):
+        """Test that the net and peak memory of timed methods and blocks are added to task metadata"""
+        task = RootTask()
+        task.run()
+        keptSize = 2000000 * 8 # at least the size of the list of pointers
+        for subtask, name in ((task, "run"), (task, "inner"), (task.leaf, "run")):
+            net = subtask.metadata.get(name + "MemoryNet")
+            self.assertGreaterEqual(net, keptSize * 0.9)
+            if subtask.metadata.exists(name + "MemoryPeak"):
+                peak = subtask.metadata.get(name + "MemoryPeak")
+                self.assertGreaterEqual(peak, net)
+                self.assertGreaterEqual(peak, keptSize * 2)
+            if self.tracer.numTopSites > 0:
+                self.assertTrue(subtask.metadata.exists(name + "MemoryTopSites"))
+
+    def testPeakFallback(self):
+        """Test that the peak is the peak resident set size if tracemalloc cannot reset its peak,
+        and is omitted if that cannot be reset either
+        """
+        pipeBase.setMemoryTracer(None)
+        self.tracer.stop()
+        oldTracemalloc, oldResetPeakRss = memoryTracer.tracemalloc, memoryTracer._resetPeakRss
+        memoryTracer.tracemalloc = TracemallocWithoutResetPeak(oldTracemalloc)
+        try:
+            for canResetRss in (True, False):
+                if not canResetRss:
+                    memoryTracer._resetPeakRss = lambda: False
+                tracer = pipeBase.MemoryTracer(numTopSites=0)
+                pipeBase.setMemoryTracer(tracer)
+                try:
+                    task = RootTask()
+                    task.run()
+                finally:
+                    pipeBase.setMemoryTracer(None)
+                    tracer.stop()
+                if canResetRss and not oldResetPeakRss():
+                    continue # not Linux
+                for subtask, name in ((task, "run"), (task, "inner"), (task.leaf, "run")):
+                    self.assertTrue(subtask.metadata.exists(name + "MemoryNet"))
+                    self.assertEqual(subtask.metadata.exists(name + "MemoryPeak"), canResetRss)
+                    if canResetRss:
+                        # memory freed by earlier tests may be reused, so the resident set need not grow much
+                        self.assertGreaterEqual(subtask.metadata.get(name + "MemoryPeak"), 0)
+        finally:
+            memoryTracer.tracemalloc, memoryTracer._resetPeakRss = oldTracemalloc, oldResetPeakRss
+
+    def testDisabled(self):
+        """Test that nothing is added to metadata when no memory tracer is installed"""
+        pipeBase.setMemoryTracer(None)
+        task = RootTask()
+        task.run()
+        self.assertFalse(task.metadata.exists("runMemoryNet"))
+        self.assertFalse(task.leaf.metadata.exists("runMemoryNet"))
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(MemoryTracerTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.daf.base as dafBase
+import lsst.pipe.base as pipeBase
+
+class FakeDataRef(object):
+    """A data reference that records the datasets put with it"""
+    def __init__(self, dataId, putDict):
+        self.dataId = dataId
+        self.putDict = putDict
+
+    def put(self, obj, datasetType):
+        self.putDict[(datasetType, self.dataId["visit"])] = obj
+        self.putThread = threading.current_thread()
+
+def makeMetadata(visit):
+    """Make full metadata of a task with one subtask"""
+    taskMetadata = dafBase.PropertyList()
+    taskMetadata.add("visit", visit)
+    subtaskMetadata = dafBase.PropertyList()
+    subtaskMetadata.add("flux", 1.5)
+    subtaskMetadata.add("flux", 2.5)
+    fullMetadata = dafBase.PropertySet()
+    fullMetadata.set("top", taskMetadata)
+    fullMetadata.set("top:sub", subtaskMetadata)
+    return fullMetadata
+
+class MetadataWriterTestCase(unittest.TestCase):
+    """A test case for MetadataWriter
+    """
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def testAsync(self):
+        """Test that an AsyncMetadataWriter puts all metadata with the butler by the time it is flushed"""
+        putDict = {}
+        writer = pipeBase.AsyncMetadataWriter(pipeBase.ButlerMetadataWriter(), maxBatchSize=3)
+        dataRefList = [FakeDataRef(dict(visit=visit), putDict) for visit in range(10)]
+        for dataRef in dataRefList:
+            writer.write(dataRef, "top_metadata", makeMetadata(dataRef.dataId["visit"]))
+        writer.flush()
+        self.assertEqual(sorted(putDict), [("top_metadata", visit) for visit in range(10)])
+        # the butler is not thread-safe, so metadata is put in this thread
+        for dataRef in dataRefList:
+            self.assertIs(dataRef.putThread, threading.current_thread())
+        self.assertEqual(putDict[("top_metadata", 3)].get("top").get("visit"), 3)
+        writer.close()
+
+    def testSqlite(self):
+        """Test that a SqliteMetadataWriter stores all items of all targets in one database"""
+        fileName = os.path.join(self.outDir, "repo", "top_metadata.sqlite3")
+        writer = pipeBase.SqliteMetadataWriter(fileName)
+        writer.writeBatch([(FakeDataRef(dict(visit=visit), None), "top_metadata", makeMetadata(visit))
+                           for visit in range(3)])
+        # metadata for a target that was already written replaces it
+        writer.write(FakeDataRef(dict(visit=2), None), "top_metadata", makeMetadata(20))
+        writer.close()
+
+        connection = sqlite3.connect(fileName)
+        try:
+            rowList = connection.execute("SELECT dataId, name, value FROM metadata").fetchall()
+        finally:
+            connection.close()
+        self.assertEqual(len(rowList), 6)
+        itemDict = dict(((json.loads(dataId)["visit"], name), json.loads(value))
+                        for dataId, name, value in rowList)
+        self.assertEqual(itemDict[(0, "top.visit")], [0])
+        self.assertEqual(itemDict[(2, "top.visit")], [20])
+        self.assertEqual(itemDict[(1, "top:sub.flux")], [1.5, 2.5])
+
+    def testInstall(self):
+        """Test getMetadataWriter and setMetadataWriter"""
+        writer = pipeBase.ButlerMetadataWriter()
+        oldWriter = pipeBase.setMetadataWriter(writer)
+        try:
+            self.assertIs(pipeBase.getMetadataWriter(), writer)
+        finally:
+            self.assertIs(pipeBase.setMetadataWriter(oldWriter), writer)
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(MetadataWriterTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
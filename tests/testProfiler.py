@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pipe.base as pipeBase
+import lsst.pipe.base.profiler as pipeProfiler
+
+def spin(numIter):
+    """Use some CPU time"""
+    total = 0
+    for i in xrange(numIter):
+        total += i*i
+    return total
+
+class ProfilerTestCase(unittest.TestCase):
+    """A test case for SampleProfiler and per-process profiles
+    """
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.outDir, "profile")
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def testSampleProfiler(self):
+        """Test that a SampleProfiler records collapsed stacks of the code being run"""
+        profiler = pipeBase.SampleProfiler(interval=0.001)
+        profiler.enable()
+        try:
+            spin(2000000)
+        finally:
+            profiler.disable()
+        countDict = profiler.getCounts()
+        self.assertGreater(sum(countDict.itervalues()), 0)
+        self.assertTrue(any(";spin (testProfiler.py:" in stack for stack in countDict))
+
+        profiler.dump_stats(self.fileName)
+        self.assertEqual(pipeProfiler.readCollapsed(self.fileName), countDict)
+
+    def testMergeCProfile(self):
+        """Test that the cProfile statistics of this process are written and merged"""
+        pipeBase.removeProcessProfiles(self.fileName)
+        processProfiler = pipeBase.getProcessProfiler(self.fileName, mode="cprofile")
+        self.assertIs(pipeBase.getProcessProfiler(self.fileName, mode="cprofile"), processProfiler)
+        for i in range(2):
+            processProfiler.start()
+            spin(1000)
+            processProfiler.stop()
+        # pretend that another process wrote a profile, and that one was left by an earlier run
+        shutil.copy(__file__, self.fileName + ".notapid")
+        processProfiler.dump()
+        os.rename(processProfiler.processFileName, self.fileName + ".1")
+
+        self.assertEqual(pipeBase.finishProcessProfiles(self.fileName, mode="cprofile"), 2)
+        stats = pstats.Stats(self.fileName)
+        numCallsList = [value[0] for key, value in stats.stats.iteritems() if key[2] == "spin"]
+        self.assertEqual(numCallsList, [4])
+
+    def testMergeSample(self):
+        """Test that collapsed stacks of several processes are merged by adding the samples"""
+        pipeProfiler.writeCollapsed({"main;a": 2, "main;b": 1}, self.fileName + ".10")
+        pipeProfiler.writeCollapsed({"main;a": 3}, self.fileName + ".11")
+        self.assertEqual(pipeBase.finishProcessProfiles(self.fileName, mode="sample"), 2)
+        self.assertEqual(pipeProfiler.readCollapsed(self.fileName), {"main;a": 5, "main;b": 1})
+        # the profiles of the processes are removed once merged
+        self.assertFalse(os.path.exists(self.fileName + ".10"))
+        self.assertFalse(os.path.exists(self.fileName + ".11"))
+        with open(self.fileName) as inFile:
+            self.assertEqual(inFile.readline(), "main;a 5\n")
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(ProfilerTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
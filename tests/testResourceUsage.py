@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pipe.base as pipeBase
+
+class ResourceUsageTestCase(unittest.TestCase):
+    """A test case for getResourceUsage and ResourceSummary
+    """
+    def testGetResourceUsage(self):
+        """Test that resource usage since an earlier call is a difference, except for maximum RSS"""
+        startUsage = pipeBase.getResourceUsage()
+        sum(xrange(100000)) # use some CPU
+        usage = pipeBase.getResourceUsage(startUsage)
+        self.assertGreaterEqual(usage.wallTime, 0)
+        self.assertLess(usage.wallTime, startUsage.wallTime)
+        self.assertGreaterEqual(usage.cpuTime, 0)
+        self.assertGreaterEqual(usage.maxResidentSetSize, startUsage.maxResidentSetSize)
+
+    def testSummary(self):
+        """Test totals, percentiles and the slowest targets of a ResourceSummary"""
+        summary = pipeBase.ResourceSummary(numSlowest=3)
+        for i in range(101):
+            usage = pipeBase.Struct(wallTime=float(i), cpuTime=0.5*i, maxResidentSetSize=1000 + i,
+                                    blockInputs=1, blockOutputs=2, minorPageFaults=3, majorPageFaults=0)
+            summary.add(usage, dataId="visit=%d" % (i,))
+        self.assertEqual(len(summary), 101)
+        self.assertEqual(sum(summary.getValues("cpuTime")), 0.5*5050)
+        self.assertEqual(summary.getPercentile("wallTime", 50), 50.0)
+        self.assertEqual(summary.getPercentile("wallTime", 90), 90.0)
+        self.assertEqual(summary.getPercentile("maxResidentSetSize", 100), 1100)
+        self.assertEqual(summary.getSlowest(), [(100.0, "visit=100"), (99.0, "visit=99"), (98.0, "visit=98")])
+
+        outDir = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(outDir, "config", "test_resources.txt")
+            summary.write(fileName)
+            with open(fileName) as inFile:
+                text = inFile.read()
+        finally:
+            shutil.rmtree(outDir, ignore_errors=True)
+        self.assertEqual(text, summary.format())
+        self.assertIn("# Resource usage of 101 targets", text)
+        self.assertIn("visit=100", text)
+        self.assertNotIn("visit=97", text)
+
+    def testEmpty(self):
+        """Test a ResourceSummary with no targets"""
+        summary = pipeBase.ResourceSummary()
+        self.assertEqual(len(summary), 0)
+        self.assertIsNone(summary.getPercentile("cpuTime", 50))
+        self.assertEqual(summary.getSlowest(), [])
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(ResourceUsageTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pipe.base as pipeBase
+
+class FakeDataRef(object):
+    def __init__(self, **dataId):
+        self.dataId = dataId
+
+class RunJournalTestCase(unittest.TestCase):
+    """A test case for RunJournal
+    """
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.outDir, "repo", "test_runJournal.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def testTargetKey(self):
+        """Test that target keys do not depend on the order of data ID keys"""
+        self.assertEqual(pipeBase.getTargetKey((FakeDataRef(visit=1, ccd=2), {})), '{"ccd": 2, "visit": 1}')
+        self.assertEqual(pipeBase.getTargetKey(([FakeDataRef(visit=1), FakeDataRef(visit=2)], {})),
+                         '[{"visit": 1}, {"visit": 2}]')
+        self.assertIsNone(pipeBase.getTargetKey(("notADataRef", {})))
+
+    def testRecord(self):
+        """Test recording targets, the most recent status winning, and ignoring records of other configs"""
+        journal = pipeBase.RunJournal(self.fileName, "digest1")
+        self.assertEqual(journal.getStatusDict(), ({}, 0))
+        journal.record("a", "done")
+        journal.record("b", "failed")
+        journal.record("c", "done")
+        journal.close()
+
+        # a run with another config, then a run with the original config that was killed mid-write
+        journal = pipeBase.RunJournal(self.fileName, "digest2")
+        journal.record("b", "done")
+        journal.close()
+        journal = pipeBase.RunJournal(self.fileName, "digest1")
+        journal.record("b", "done")
+        journal.record("c", "failed")
+        journal.close()
+        with open(self.fileName, "a") as journalFile:
+            journalFile.write('{"key": "d", "sta')
+
+        statusDict, numInvalid = pipeBase.RunJournal(self.fileName, "digest1").getStatusDict()
+        self.assertEqual(statusDict, dict(a="done", b="done", c="failed"))
+
+        # the next run must not append to the partly written record
+        journal = pipeBase.RunJournal(self.fileName, "digest1")
+        journal.record("d", "done")
+        journal.close()
+        statusDict, numInvalid = journal.getStatusDict()
+        self.assertEqual(statusDict, dict(a="done", b="done", c="failed", d="done"))
+        self.assertEqual(numInvalid, 1)
+        self.assertEqual(pipeBase.RunJournal(self.fileName, "digest2").getStatusDict()[0], dict(b="done"))
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(RunJournalTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
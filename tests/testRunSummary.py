@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import lsst.utils.tests as utilsTests
+import lsst.daf.base as dafBase
+import lsst.pipe.base as pipeBase
+import lsst.pipe.base.runSummary as runSummary
+
+class RunSummaryTestCase(unittest.TestCase):
+    """A test case for the run-summary database
+    """
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.outDir, "test_runSummary.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def testFlattenMetadata(self):
+        """Test that full task metadata is flattened with full names, keeping the last value of arrays"""
+        taskMetadata = dafBase.PropertyList()
+        taskMetadata.add("runEndCpuTime", 1.5)
+        subtaskMetadata = dafBase.PropertyList()
+        subtaskMetadata.add("numStars", 3)
+        subtaskMetadata.add("numStars", 5)
+        fullMetadata = dafBase.PropertySet()
+        fullMetadata.set("top", taskMetadata)
+        fullMetadata.set("top:sub", subtaskMetadata)
+        self.assertEqual(dict(pipeBase.flattenMetadata(fullMetadata)),
+                         {"top.runEndCpuTime": 1.5, "top:sub.numStars": 5})
+
+    def testWriteRead(self):
+        """Test writing rows with different columns, replacing rows, and reading the result"""
+        writer = pipeBase.RunSummaryWriter(self.fileName, flushSize=2)
+        for visit in range(5):
+            row = {"visit": visit, "top.runEndCpuTime": 0.5 * visit}
+            if visit == 3:
+                row["top.comment"] = "odd one"
+            writer.add(dict(visit=visit), row)
+        writer.add(dict(visit=4), {"visit": 4, "top.runEndCpuTime": 10.0})
+        writer.close()
+
+        columnDict = pipeBase.readRunSummary(self.fileName)
+        self.assertEqual(set(columnDict), set(["dataId", "visit", "top.runEndCpuTime", "top.comment"]))
+        order = columnDict["visit"].argsort()
+        self.assertEqual(list(columnDict["top.runEndCpuTime"][order]), [0.0, 0.5, 1.0, 1.5, 10.0])
+        self.assertEqual(columnDict["dataId"][order][0], '{"visit": 0}')
+        self.assertEqual(list(columnDict["top.comment"][order]), [None, None, None, "odd one", None])
+
+        columnDict = pipeBase.readRunSummary(self.fileName, columnNames=["top.runEndCpuTime"])
+        self.assertEqual(columnDict.keys(), ["top.runEndCpuTime"])
+        self.assertEqual(pipeBase.readRunSummaryItem(self.fileName, "top.comment"), {'{"visit": 3}': "odd one"})
+
+    def testManyColumns(self):
+        """Test rows with more columns than an SQLite table can have"""
+        numColumns = 2500
+        writer = pipeBase.RunSummaryWriter(self.fileName)
+        for visit in range(3):
+            writer.add(dict(visit=visit), dict(("item%d" % (i,), visit + i) for i in range(numColumns)))
+        writer.close()
+        columnDict = pipeBase.readRunSummary(self.fileName)
+        self.assertEqual(len(columnDict), numColumns + 1)
+        self.assertEqual(list(columnDict["item2000"]), [2000.0, 2001.0, 2002.0])
+
+    def testMain(self):
+        """Test the command-line summary"""
+        writer = pipeBase.RunSummaryWriter(self.fileName)
+        for visit in range(5):
+            writer.add(dict(visit=visit), {"resources.wallTime": float(visit), "numStars": None})
+        writer.close()
+        self.assertTrue(math.isnan(pipeBase.readRunSummary(self.fileName)["numStars"][0]))
+
+        oldStdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            runSummary.main([self.fileName, "--limit", "2"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = oldStdout
+        self.assertIn("5 targets", output)
+        self.assertIn('{"visit": 4}', output)
+        self.assertIn('{"visit": 3}', output)
+        self.assertNotIn('{"visit": 2}', output)
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(RunSummaryTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
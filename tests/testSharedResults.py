@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import multiprocessing
+import os
+import socket
+import unittest
+
+import numpy
+
+import lsst.utils.tests as utilsTests
+import lsst.pipe.base as pipeBase
+import lsst.pipe.base.sharedResults as pipeBaseShared
+
+def _makeResult():
+    """Make a Struct holding large and small arrays, some in containers"""
+    return pipeBase.Struct(
+        big = numpy.arange(100000, dtype=float),
+        fortran = numpy.asfortranarray(numpy.arange(20000, dtype=numpy.int32).reshape(100, 200)),
+        records = numpy.zeros(5000, dtype=[("a", "f8"), ("b", "i2")]),
+        small = numpy.arange(3),
+        masked = numpy.ma.masked_array(numpy.arange(10000.0), mask=numpy.arange(10000) % 2),
+        objects = numpy.array([None]*10000, dtype=object),
+        nested = [dict(big=numpy.ones(10000), name="name")],
+        value = 3,
+    )
+
+def _exportInWorker(conn, dirName):
+    """Export the arrays of _makeResult() and send the result through conn"""
+    conn.send(pipeBase.exportSharedArrays(_makeResult(), dirName, 1000))
+    conn.close()
+
+class SharedResultsTestCase(unittest.TestCase):
+    """A test case for returning arrays through memory-mapped files"""
+    def setUp(self):
+        self.dirName = pipeBase.makeSharedResultDir()
+
+    def tearDown(self):
+        pipeBase.removeSharedResultDir(self.dirName)
+        self.assertFalse(os.path.exists(self.dirName))
+
+    def testRemoveStale(self):
+        """Test that the directories of processes that no longer exist are removed"""
+        process = multiprocessing.Process(target=os.getpid)
+        process.start()
+        process.join()
+        parentDir = os.path.dirname(self.dirName)
+        staleDirName = os.path.join(parentDir, "%s%s_%d_test" % (pipeBaseShared._DirPrefix, socket.gethostname(),
+                                                                  process.pid))
+        os.mkdir(staleDirName)
+        newDirName = pipeBase.makeSharedResultDir()
+        try:
+            self.assertFalse(os.path.exists(staleDirName))
+            # the directory of this process is in use
+            self.assertTrue(os.path.exists(self.dirName))
+        finally:
+            pipeBase.removeSharedResultDir(newDirName)
+            pipeBase.removeSharedResultDir(staleDirName)
+
+    def checkResult(self, result):
+        """Check that result matches _makeResult()"""
+        expected = _makeResult()
+        self.assertEqual(sorted(result.getDict()), sorted(expected.getDict()))
+        for name in ("big", "fortran", "records", "small"):
+            self.assertEqual(getattr(result, name).dtype, getattr(expected, name).dtype)
+            self.assertTrue(numpy.all(getattr(result, name) == getattr(expected, name)))
+        self.assertTrue(result.fortran.flags.f_contiguous)
+        self.assertIsInstance(result.masked, numpy.ma.MaskedArray)
+        self.assertTrue(numpy.all(result.masked.mask == expected.masked.mask))
+        self.assertTrue(numpy.all(result.nested[0]["big"] == 1))
+        self.assertEqual(result.nested[0]["name"], "name")
+        self.assertEqual(result.value, 3)
+
+    def testRoundTrip(self):
+        """Test that large plain arrays are replaced by handles and restored, and the files deleted"""
+        result = _makeResult()
+        exported = pipeBase.exportSharedArrays(result, self.dirName, 1000)
+        for name in ("big", "fortran", "records"):
+            self.assertIsInstance(getattr(exported, name), pipeBase.SharedArrayHandle)
+        self.assertIsInstance(exported.nested[0]["big"], pipeBase.SharedArrayHandle)
+        for name in ("small", "masked", "objects", "value"):
+            self.assertIs(getattr(exported, name), getattr(result, name))
+        self.assertEqual(len(os.listdir(self.dirName)), 4)
+
+        imported = pipeBase.importSharedArrays(exported)
+        self.assertEqual(os.listdir(self.dirName), [])
+        self.checkResult(imported)
+        self.assertIsInstance(imported.big, numpy.ndarray)
+        imported.big[0] = -1.0 # the arrays are writable
+
+        # objects with no large arrays are returned as they are
+        struct = pipeBase.Struct(a=[1, 2], b=numpy.arange(3))
+        self.assertIs(pipeBase.exportSharedArrays(struct, self.dirName, 1000), struct)
+        self.assertIs(pipeBase.importSharedArrays(struct), struct)
+
+    def testWorker(self):
+        """Test returning arrays from a worker process, and removing arrays that were not imported"""
+        parentConn, childConn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_exportInWorker, args=(childConn, self.dirName))
+        process.start()
+        exported = parentConn.recv()
+        process.join()
+        self.assertEqual(len(os.listdir(self.dirName)), 4)
+        result = pipeBase.importSharedArrays(exported)
+        self.checkResult(result)
+
+        pipeBase.exportSharedArrays(_makeResult(), self.dirName, 1000)
+        pipeBase.removeSharedResultDir(self.dirName)
+        self.assertFalse(os.path.exists(self.dirName))
+        self.checkResult(result) # imported arrays remain valid
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(SharedResultsTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests as utilsTests
+import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
+
+class LeafTask(pipeBase.Task):
+    ConfigClass = pexConfig.Config
+
+    @pipeBase.timeMethod
+    def run(self):
+        pass
+
+class LeafConfig(pexConfig.Config):
+    leaf = LeafTask.makeField("leaf task")
+
+class RootTask(pipeBase.Task):
+    ConfigClass = LeafConfig
+    _DefaultName = "root"
+
+    def __init__(self, **keyArgs):
+        pipeBase.Task.__init__(self, **keyArgs)
+        self.makeSubtask("leaf")
+
+    @pipeBase.timeMethod
+    def run(self):
+        with self.timer("inner"):
+            self.leaf.run()
+
+class SpanTracerTestCase(unittest.TestCase):
+    """A test case for SpanTracer
+    """
+    def setUp(self):
+        self.tracer = pipeBase.SpanTracer()
+        self.oldTracer = pipeBase.setTracer(self.tracer)
+        self.outDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        pipeBase.setTracer(self.oldTracer)
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def testNesting(self):
+        """Test that spans of timed methods and blocks of a task and its subtasks are nested"""
+        RootTask().run()
+        eventDict = dict((event["name"], event) for event in self.tracer.getEvents())
+        self.assertEqual(sorted(eventDict), ["root.inner", "root.leaf.run", "root.run"])
+        runArgs = eventDict["root.run"]["args"]
+        innerArgs = eventDict["root.inner"]["args"]
+        leafArgs = eventDict["root.leaf.run"]["args"]
+        self.assertIsNone(runArgs["parentId"])
+        self.assertEqual(innerArgs["parentId"], runArgs["id"])
+        self.assertEqual(leafArgs["parentId"], innerArgs["id"])
+        self.assertEqual(leafArgs["parentTask"], "root")
+        self.assertLessEqual(eventDict["root.run"]["ts"], eventDict["root.leaf.run"]["ts"])
+        self.assertGreaterEqual(eventDict["root.run"]["dur"], eventDict["root.leaf.run"]["dur"])
+
+    def testChromeTrace(self):
+        """Test merging events from another tracer and writing a Chrome trace"""
+        RootTask().run()
+        otherTracer = pipeBase.SpanTracer()
+        otherTracer.pid += 1 # pretend it is another process
+        with otherTracer.span("target", category="TaskRunner", index=3):
+            pass
+        self.tracer.addEvents(otherTracer.popEvents())
+        self.assertEqual(otherTracer.getEvents(), [])
+
+        fileName = os.path.join(self.outDir, "trace.json")
+        self.tracer.writeChromeTrace(fileName)
+        with open(fileName) as inFile:
+            trace = json.load(inFile)
+        spanList = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+        self.assertEqual(len(spanList), 4)
+        processNameDict = dict((event["pid"], event["args"]["name"])
+                               for event in trace["traceEvents"] if event["ph"] == "M")
+        self.assertEqual(processNameDict[self.tracer.pid], "main")
+        self.assertEqual(processNameDict[otherTracer.pid], "worker %d" % (otherTracer.pid,))
+
+    def testDisabled(self):
+        """Test that nothing is recorded when no tracer is installed"""
+        pipeBase.setTracer(None)
+        RootTask().run()
+        self.assertEqual(self.tracer.getEvents(), [])
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+
+    suites += unittest.makeSuite(SpanTracerTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
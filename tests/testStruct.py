@@ -20,6 +20,8 @@
 # the GNU General Public License along with this program.  If not, 
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import copy
+import pickle
 import unittest
 
 import lsst.utils.tests as utilsTests
@@ -92,6 +94,91 @@ class StructTestCase(unittest.TestCase):
             self.assertEqual(val, self.valDict[name])
             self.assertRaises(RuntimeError, newS.mergeItems, s, name)
 
+## A struct class at module level, so that its instances pickle by reference to it
+PickleTestStruct = pipeBase.StructType("PickleTestStruct", ["foo", "bar"])
+
+class StructTypeTestCase(unittest.TestCase):
+    """A test case for StructType
+    """
+    def setUp(self):
+        self.valDict = dict(
+            foo = 1,
+            bar = (1, 2, 3),
+            baz = "value for baz",
+            alist = [3, 5, 7, 9],
+        )
+        self.FooStruct = pipeBase.StructType("FooStruct", ["foo", "bar", "baz", "alist"])
+
+    def tearDown(self):
+        self.valDict = None
+        self.FooStruct = None
+
+    def testInit(self):
+        """Test construction by keyword and in order
+        """
+        s = self.FooStruct(**self.valDict)
+        self.assertEqual(self.valDict, s.getDict())
+        for name, val in self.valDict.iteritems():
+            self.assertEqual(getattr(s, name), val)
+        self.assertEqual(len(s), 4)
+        self.assertEqual(s, self.FooStruct(1, (1, 2, 3), "value for baz", [3, 5, 7, 9]))
+        self.assertFalse(hasattr(s, "__dict__"))
+
+        # every field is required, and fields cannot be added
+        self.assertRaises(TypeError, self.FooStruct, foo=1)
+        self.assertRaises(AttributeError, setattr, s, "other", 5)
+
+    def testNames(self):
+        """Test that invalid type and field names are rejected
+        """
+        self.assertEqual(pipeBase.StructType("Foo", "a, b").__slots__, ("a", "b"))
+        for fieldNames in (
+            ["foo", "foo"],
+            ["__foo"],
+            ["copy"],
+            ["getDict"],
+            ["not valid"],
+            ["1foo"],
+            ["class"],
+        ):
+            self.assertRaises(RuntimeError, pipeBase.StructType, "Foo", fieldNames)
+        self.assertRaises(RuntimeError, pipeBase.StructType, "Foo Bar", ["foo"])
+
+    def testCache(self):
+        """Test that the same name and fields give the same class
+        """
+        self.assertTrue(pipeBase.StructType("FooStruct", ("foo", "bar", "baz", "alist")) is self.FooStruct)
+        self.assertFalse(pipeBase.StructType("FooStruct", ("foo", "bar")) is self.FooStruct)
+
+    def testCopy(self):
+        """Test copy, which returns a shallow copy, and equality
+        """
+        s = self.FooStruct(**self.valDict)
+        sc = s.copy()
+        self.assertEqual(s.getDict(), sc.getDict())
+
+        sc.alist[0] = 97
+        self.assertEqual(s, sc)
+
+        sc.foo += 1
+        self.assertNotEqual(s, sc)
+        self.assertNotEqual(s, pipeBase.Struct(**self.valDict))
+
+    def testPickle(self):
+        """Test pickling instances of module-level and other struct classes
+        """
+        for s in (PickleTestStruct(foo=1, bar=[2, 3]), self.FooStruct(**self.valDict)):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                newS = pickle.loads(pickle.dumps(s, protocol))
+                self.assertTrue(type(newS) is type(s))
+                self.assertEqual(newS, s)
+        self.assertEqual(copy.deepcopy(self.FooStruct(**self.valDict)).getDict(), self.valDict)
+
+    def testRepr(self):
+        """Test repr
+        """
+        self.assertEqual(repr(PickleTestStruct(foo=1, bar="a")), "PickleTestStruct(foo=1; bar='a')")
+
 
 def suite():
     """Return a suite containing all the test cases in this module.
@@ -101,6 +188,7 @@ def suite():
     suites = []
 
     suites += unittest.makeSuite(StructTestCase)
+    suites += unittest.makeSuite(StructTypeTestCase)
     suites += unittest.makeSuite(utilsTests.MemoryTestCase)
 
     return unittest.TestSuite(suites)
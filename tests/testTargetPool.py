@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# 
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+# 
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the LSST License Statement and 
+# the GNU General Public License along with this program.  If not, 
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import functools
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import lsst.utils.tests as utilsTests
+from lsst.pipe.base import TargetPool, TargetFailedError
+
+def _run(item):
+    """Return (item, pid), after sleeping for item sec if item is a float, or die or raise as item says"""
+    if item == "die":
+        os._exit(3)
+    if item == "raise":
+        raise ValueError("intentional error")
+    if isinstance(item, float):
+        time.sleep(item)
+    return item, os.getpid()
+
+def _runOnceSlowly(flagFile, item):
+    """Sleep for a while the first time this is called for item 0, then write flagFile + ".done";
+    else return item at once
+    """
+    if item == 0 and not os.path.exists(flagFile):
+        open(flagFile, "w").close()
+        time.sleep(4)
+        open(flagFile + ".done", "w").close()
+    return item
+
+class TargetPoolTestCase(unittest.TestCase):
+    """A test case for TargetPool"""
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def runPool(self, pool, itemList):
+        """Run _run on itemList and return a dict of item: result, closing the pool"""
+        try:
+            return dict((result[0], result[1:]) for result in pool.imapUnordered(_run, itemList))
+        finally:
+            pool.close()
+            pool.join()
+
+    def testBasics(self):
+        """Test that every item is run, and that workers are replaced after maxTargetsPerWorker targets"""
+        for maxTargetsPerWorker, minNumPids in ((None, 1), (1, 10)):
+            pool = TargetPool(3, maxTargetsPerWorker=maxTargetsPerWorker)
+            resultDict = self.runPool(pool, range(10))
+            self.assertEqual(sorted(resultDict), range(10))
+            pidSet = set(pid for pid, in resultDict.itervalues())
+            self.assertGreaterEqual(len(pidSet), minNumPids)
+            self.assertLessEqual(len(pidSet), 10)
+            self.assertNotIn(os.getpid(), pidSet)
+
+    def testTimeout(self):
+        """Test that a target that times out, or whose worker dies, fails without stopping the run"""
+        failedList = []
+        def onFailure(item, reason, wallTime):
+            failedList.append((item, reason, wallTime))
+            return (item, None)
+        pool = TargetPool(2, targetTimeout=1.0, onFailure=onFailure)
+        startTime = time.time()
+        resultDict = self.runPool(pool, [0.0, 30.0, "die", 0.0, 0.1, 0.2])
+        self.assertLess(time.time() - startTime, 10)
+        self.assertEqual(len(resultDict), 5) # both 0.0 are in one entry
+        self.assertEqual(resultDict[30.0], (None,))
+        self.assertEqual(resultDict["die"], (None,))
+        self.assertEqual(sorted(item for item, reason, wallTime in failedList), [30.0, "die"])
+        for item, reason, wallTime in failedList:
+            if item == 30.0:
+                self.assertIn("timed out", reason)
+                self.assertGreaterEqual(wallTime, 1.0)
+            else:
+                self.assertIn("exit code 3", reason)
+
+        pool = TargetPool(2, targetTimeout=0.5)
+        self.assertRaises(TargetFailedError, self.runPool, pool, [0.0, 30.0, 0.0])
+
+    def testException(self):
+        """Test that an exception raised by the function is raised in the parent"""
+        pool = TargetPool(2)
+        self.assertRaises(ValueError, self.runPool, pool, [0.0, "raise", 0.0])
+
+    def testSpeculate(self):
+        """Test that a straggler is re-run, the first copy to finish is used,
+        and the other copy is left to finish (even past the time limit) rather than killed
+        """
+        flagFile = os.path.join(self.outDir, "flag")
+        pool = TargetPool(2, speculate=0.5, targetTimeout=2.0)
+        startTime = time.time()
+        resultList = []
+        try:
+            for result in pool.imapUnordered(functools.partial(_runOnceSlowly, flagFile), range(6)):
+                resultList.append(result)
+                if len(resultList) == 6:
+                    firstTime = time.time() - startTime
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertLess(firstTime, 3)
+        self.assertLess(time.time() - startTime, 10)
+        self.assertEqual(sorted(resultList), range(6))
+        self.assertTrue(os.path.exists(flagFile + ".done"))
+
+def suite():
+    """Return a suite containing all the test cases in this module.
+    """
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(TargetPoolTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+
+    return unittest.TestSuite(suites)
+
+def run(shouldExit=False):
+    """Run the tests"""
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == "__main__":
+    run(True)
@@ -233,6 +233,30 @@ class TaskTestCase(unittest.TestCase):
         )
         self.assertLessEqual(addMultTask.add.metadata.get("runEndCpuTime"), currCpuTime)
 
+    def testTimingBuffer(self):
+        """Test that timing data are buffered until metadata is accessed, and discarded by emptyMetadata
+        """
+        addMultTask = AddMultTask()
+        addMultTask.run(val=1.1)
+        self.assertGreater(len(addMultTask._timingBuffer), 0) # at least contextEnd and runEnd
+        addMultTask.getFullMetadata()
+        self.assertEqual(len(addMultTask._timingBuffer), 0)
+        self.assertIn("runEndCpuTime", addMultTask.metadata.names())
+
+        addMultTask.run(val=1.1)
+        addMultTask.emptyMetadata()
+        self.assertNotIn("runEndCpuTime", addMultTask.metadata.names())
+
+        # the buffer grows as needed
+        timingBuffer = pipeBase.TimingBuffer(capacity=1)
+        metadata = dafBase.PropertyList()
+        for i in range(5):
+            timingBuffer.record("step%d" % (i,))
+        timingBuffer.flush(metadata)
+        for i in range(5):
+            self.assertIsInstance(metadata.get("step%dMaxResidentSetSize" % (i,)), numbers.Integral)
+        self.assertLessEqual(metadata.get("step0CpuTime"), metadata.get("step4CpuTime"))
+
 
 def suite():
     """Return a suite containing all the test cases in this module.